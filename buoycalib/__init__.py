@@ -1 +1,16 @@
-from . import (atmo, buoy, modtran, radiance, settings, sat)
+"""
+Submodules are imported on first use (buoycalib.buoy, buoycalib.sat.landsat, ...),
+importing the package alone does not load GDAL, OpenCV, netCDF4 or requests.
+"""
+import importlib
+
+__all__ = ['atmo', 'buoy', 'modtran', 'radiance', 'settings', 'sat']
+
+
+def __getattr__(name):
+    try:
+        return importlib.import_module('.' + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != '{0}.{1}'.format(__name__, name):
+            raise
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
@@ -0,0 +1,34 @@
+"""
+python -m buoycalib serve: run the calibration service (see service.py) of
+forward.calibrate, the forward model of forward_model.py.
+"""
+import argparse
+import warnings
+
+from . import (forward, instrument, service, settings)
+
+parser = argparse.ArgumentParser(prog='python -m buoycalib')
+commands = parser.add_subparsers(dest='command')
+commands.required = True
+
+serve = commands.add_parser('serve', help='Run scenes on request, over HTTP, with the caches of the process kept warm.')
+serve.add_argument('-a', '--address', default=settings.SERVICE_URL, help='Url the service listens on, local only.')
+serve.add_argument('-j', '--jobs', default=service.JOBS, type=int, help='Scenes run at once.')
+serve.add_argument('-q', '--queue', default=service.QUEUE, type=int, help='Requests waiting for a job, more are refused.')
+serve.add_argument('-b', '--db', default=settings.RESULTS_DB, help='Result store the results are appended to.')
+serve.add_argument('-u', '--subset', default=False, action='store_true', help='Download only the atmospheric data around the buoys.')
+serve.add_argument('-n', '--no-instrument', default=False, action='store_true', help='Do not record the time and resources used by each stage.')
+serve.add_argument('-w', '--warnings', default=False, action='store_true')
+
+args = parser.parse_args()
+
+if not args.warnings:
+    warnings.filterwarnings("ignore")
+
+if args.subset:
+    settings.ATMO_SUBSET = True
+
+instrument.ENABLED = not args.no_instrument
+
+service.warm()
+service.serve(service.Service(forward.calibrate, args.db, args.jobs, args.queue), args.address)
@@ -0,0 +1,114 @@
+"""
+Asyncio versions of the blocking I/O of the forward model, so one event
+loop keeps many downloads and several MODTRAN runs in flight.
+
+Downloads run download.url_download (with its file locks, resume and
+manifest) in threads of a shared executor, at most PER_HOST at once for
+each host. Programs (MODTRAN, swath2grid) are started with
+asyncio.create_subprocess_exec, at most SUBPROCESSES at once, and are waited
+on by the event loop instead of a thread each.
+
+The limits are per event loop, and shared by every coroutine running in it,
+i.e. by all the scenes of forward.calibrate_async run together.
+
+Usage:
+    files = asyncio.run(aio.download_many([(url, directory), ...]))
+    output = asyncio.run(aio.run(['swath2grid', '-pf=swath.prm'], cwd=directory))
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import subprocess
+import threading
+import urllib.parse
+import weakref
+
+from . import download
+
+PER_HOST = 4   # downloads in flight per host
+SUBPROCESSES = os.cpu_count() or 4   # programs running at once
+THREADS = 64   # threads running blocking calls, a download holds one while it runs
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_limits = weakref.WeakKeyDictionary()   # event loop -> {name: semaphore}
+
+
+def executor():
+    """ the thread pool running the blocking calls of every event loop """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='aio')
+
+    return _executor
+
+
+def limit(name, value):
+    """ semaphore of value named name (i.e. a host) in the running event loop """
+    semaphores = _limits.setdefault(asyncio.get_running_loop(), {})
+
+    if name not in semaphores:
+        semaphores[name] = asyncio.Semaphore(value)
+
+    return semaphores[name]
+
+
+async def run_blocking(func, *args):
+    """ await func(*args) run in a thread, in a copy of this context (i.e. the instrument job) """
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor(), call)
+
+
+async def url_download(url, out_dir, _filename=None, auth=None):
+    """ download.url_download, at most PER_HOST at once for the host of url """
+    host = urllib.parse.urlsplit(url).hostname
+
+    async with limit('host:{0}'.format(host), PER_HOST):
+        return await run_blocking(download.url_download, url, out_dir, _filename, auth)
+
+
+async def download_many(downloads):
+    """
+    Download many files at once, see download.download_many.
+
+    Returns:
+        list of filepaths, in the same order as downloads
+
+    Raises:
+        the first exception raised by a download, after all of them have finished
+    """
+    filepaths = await asyncio.gather(*[url_download(*d) for d in downloads], return_exceptions=True)
+
+    for f in filepaths:
+        if isinstance(f, BaseException):
+            raise f
+
+    return filepaths
+
+
+async def run(args, cwd=None, check=True):
+    """
+    Run a program, at most SUBPROCESSES at once in the event loop.
+
+    Args:
+        args: program and its arguments, not run through a shell
+        cwd: directory it runs in, the working directory of this process is left alone
+        check: raise subprocess.CalledProcessError if it exits with an error
+
+    Returns:
+        its output, stdout and stderr together, bytes
+    """
+    async with limit('subprocess', SUBPROCESSES):
+        process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT)
+        output, __ = await process.communicate()
+
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args, output)
+
+    return output
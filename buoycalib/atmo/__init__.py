@@ -1,4 +1,21 @@
-from . import narr
-from . import merra
-from .. import settings
-from .process import process
\ No newline at end of file
+import importlib
+
+__all__ = ['columns', 'narr', 'merra', 'provider', 'subset', 'settings', 'process']
+
+
+def __getattr__(name):
+    # submodules on first use, process is the function of the process module
+    if name == 'process':
+        from .process import process
+        globals()['process'] = process
+        return process
+    if name == 'settings':
+        from .. import settings
+        return settings
+
+    try:
+        return importlib.import_module('.' + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != '{0}.{1}'.format(__name__, name):
+            raise
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
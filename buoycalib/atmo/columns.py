@@ -0,0 +1,311 @@
+"""
+Column store of downloaded reanalysis files, for fast access to vertical profiles.
+
+The first time a MERRA or NARR file set is used it is converted, once, into
+a directory under settings.COLUMN_DIR holding one .npy file per variable,
+laid out [lat, lon, time, level], so that all the times and levels of one
+grid column are contiguous on disk. The arrays are memory mapped, reading
+the profiles of a few columns only touches those columns.
+
+Each store records the size and mtime of the files it was built from, and
+is rebuilt if they change.
+
+The stores are about the size of the files they come from, and are not
+tracked by the download manifest (store.py). When settings.COLUMN_BUDGET is
+set, the least recently used stores are deleted after a build to stay under
+it, except the stores open in this process.
+"""
+import collections
+import json
+import os
+import shutil
+import threading
+
+import numpy
+
+from . import data
+from .. import settings
+
+# variables kept for each source, and the name of their pressure level coordinate
+VARIABLES = {
+    'merra': (['T', 'RH', 'H'], 'lev'),
+    'narr': (['air', 'hgt', 'shum'], 'level'),
+}
+TIME_CHUNK = 8   # time steps converted at once, bounds the memory used while building
+MAX_STORES = 16   # stores kept open, the least recently used is dropped
+
+# stores opened in this process, keyed by directory, least recently used first
+_STORES = collections.OrderedDict()
+
+# held while reading netCDF files, the netCDF4/HDF5 library is not thread safe,
+# and build() names its temporary directory by process id
+_NETCDF_LOCK = threading.Lock()
+
+
+class Columns(object):
+    """
+    Memory mapped vertical profiles of one reanalysis file set.
+
+    Attributes:
+        lat, lon: 2d grids of the column coordinates, indexed like the first two array axes
+        levels: pressure levels
+        time, time_units: time coordinate, as in the netCDF files
+        arrays: variable name -> memory mapped (lat, lon, time, level) array
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+
+        self.lat = numpy.load(os.path.join(directory, 'lat.npy'))
+        self.lon = numpy.load(os.path.join(directory, 'lon.npy'))
+        self.levels = numpy.asarray(meta['levels'])
+        self.time = numpy.asarray(meta['time'])
+        self.time_units = meta['time_units']
+
+        self.arrays = {v: numpy.load(os.path.join(directory, v + '.npy'), mmap_mode='r')
+                       for v in meta['variables']}
+
+    def profiles(self, variable, t, idxs):
+        """
+        Profiles of variable at time index t, for the grid points idxs.
+
+        Args:
+            idxs: (lat indices, lon indices), as returned by funcs.choose_points
+
+        Returns:
+            (N, levels) masked array, missing values masked
+        """
+        return numpy.ma.masked_invalid(self.arrays[variable][idxs[0], idxs[1], t, :])
+
+    def around(self, date, lat_oi, lon_oi):
+        """
+        The profiles of the 4 grid columns closest to a point, at the 2 times around date.
+
+        Returns:
+            data_coor: coordinates of the 4 columns
+            (t1_dt, t2_dt): the 2 times
+            profiles: variable name -> (profiles at t1, profiles at t2), each (4, levels)
+        """
+        return self.around_many([date], [lat_oi], [lon_oi])[0]
+
+    def around_many(self, dates, lats, lons):
+        """
+        around() for many points at once: the closest columns of every point are
+        found in one vectorized search, and each variable is read with a single
+        gather, touching only those columns.
+
+        Args:
+            dates, lats, lons: sequences of the N points
+
+        Returns:
+            list of around() results, in points order
+        """
+        lats = numpy.asarray(lats, dtype=numpy.float64)
+        lons = numpy.asarray(lons, dtype=numpy.float64)
+        n = len(lats)
+
+        # same choice as funcs.choose_points, for every point: 4 smallest euclidean distances
+        distances = (self.lat.ravel()[None, :] - lats[:, None])**2 + (self.lon.ravel()[None, :] - lons[:, None])**2
+        closest = numpy.argsort(distances, axis=1)[:, :4]
+        rows, cols = numpy.unravel_index(closest, self.lat.shape)   # (N, 4) each
+
+        hours = numpy.asarray([data.closest_hours(self.time, self.time_units, d) for d in dates]).reshape(n, 2)
+        t1, t2 = hours[:, 0:1], hours[:, 1:2]   # (N, 1), broadcast against the 4 columns
+
+        gathered = {v: (numpy.ma.masked_invalid(a[rows, cols, t1, :]), numpy.ma.masked_invalid(a[rows, cols, t2, :]))
+                    for v, a in self.arrays.items()}   # (N, 4, levels) each
+
+        from netCDF4 import num2date
+
+        results = []
+        for i in range(n):
+            data_coor = list(zip(self.lat[rows[i], cols[i]], self.lon[rows[i], cols[i]]))
+            times = (num2date(self.time[hours[i, 0]], self.time_units), num2date(self.time[hours[i, 1]], self.time_units))
+            profiles = {v: (p1[i], p2[i]) for v, (p1, p2) in gathered.items()}
+
+            results.append((data_coor, times, profiles))
+
+        return results
+
+
+def store_path(source, files):
+    """ directory of the store built from files """
+    name = os.path.splitext(os.path.basename(files[0]))[0]
+    return os.path.join(settings.COLUMN_DIR, '{0}_{1}'.format(source, name))
+
+
+def _file_info(files):
+    return [[os.path.abspath(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files]
+
+
+def build(source, files, directory):
+    """
+    Convert netCDF files to a column store.
+
+    Args:
+        source: 'merra' or 'narr', selects the variables
+        files: the netCDF files, merra: one file with every variable,
+            narr: one file per variable
+        directory: where to write the store, replaced if it exists
+    """
+    variables, level_name = VARIABLES[source]
+
+    # written next to the final directory, then renamed, so readers never see a partial store
+    part = '{0}.part{1}'.format(directory, os.getpid())
+    shutil.rmtree(part, ignore_errors=True)
+    os.makedirs(part)
+
+    datasets = [data.open_netcdf4(f) for f in files]
+    first = datasets[0]
+
+    lat = numpy.asarray(first.variables['lat'][:], dtype=numpy.float64)
+    lon = numpy.asarray(first.variables['lon'][:], dtype=numpy.float64)
+    if lat.ndim == 1:
+        # 2d grids indexed [lat, lon], like the variables
+        lat, lon = numpy.meshgrid(lat, lon, indexing='ij')
+    numpy.save(os.path.join(part, 'lat.npy'), lat)
+    numpy.save(os.path.join(part, 'lon.npy'), lon)
+
+    time = first.variables['time']
+    meta = {
+        'source': source,
+        'files': _file_info(files),
+        'variables': [],
+        'levels': numpy.asarray(first.variables[level_name][:], dtype=numpy.float64).tolist(),
+        'time': numpy.asarray(time[:], dtype=numpy.float64).tolist(),
+        'time_units': time.units,
+    }
+
+    for ds in datasets:
+        for name in variables:
+            if name not in ds.variables or name in meta['variables']:
+                continue
+
+            var = ds.variables[name]   # (time, level, lat, lon)
+            nt, nlev, ny, nx = var.shape
+
+            out = numpy.lib.format.open_memmap(os.path.join(part, name + '.npy'), mode='w+',
+                                               dtype=numpy.float32, shape=(ny, nx, nt, nlev))
+            for t0 in range(0, nt, TIME_CHUNK):
+                values = numpy.ma.filled(var[t0:t0 + TIME_CHUNK].astype(numpy.float32), numpy.nan)
+                out[:, :, t0:t0 + TIME_CHUNK, :] = values.transpose(2, 3, 0, 1)
+            out.flush()
+            del out
+
+            meta['variables'].append(name)
+
+    for ds in datasets:
+        ds.close()
+
+    with open(os.path.join(part, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        os.rename(part, directory)
+    except OSError:   # another process finished the same store first
+        shutil.rmtree(part, ignore_errors=True)
+
+    return directory
+
+
+def _up_to_date(directory, files):
+    try:
+        with open(os.path.join(directory, 'meta.json'), 'r') as f:
+            return json.load(f)['files'] == _file_info(files)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def load(source, files):
+    """
+    Get the column store of a downloaded file set, building it the first time.
+    Safe to call from several threads, the store is built once and shared.
+
+    Args:
+        source: 'merra' or 'narr'
+        files: list of the netCDF files, as returned by merra.download or narr.download
+
+    Returns:
+        Columns
+    """
+    files = [files] if isinstance(files, str) else list(files)
+    directory = store_path(source, files)
+
+    with _NETCDF_LOCK:
+        if directory in _STORES and _STORES[directory][0] == _file_info(files):
+            _STORES.move_to_end(directory)
+            return _STORES[directory][1]
+
+        built = not _up_to_date(directory, files)
+        if built:
+            build(source, files, directory)
+
+        _STORES[directory] = (_file_info(files), Columns(directory))
+        _STORES.move_to_end(directory)
+        while len(_STORES) > MAX_STORES:
+            _STORES.popitem(last=False)
+
+        os.utime(directory)   # last use, for evict()
+        if built:
+            evict()
+
+        return _STORES[directory][1]
+
+
+def evict(budget=None):
+    """
+    Delete the least recently used column stores until they use at most budget
+    bytes. The stores open in this process are kept.
+
+    Args:
+        budget: [bytes] default settings.COLUMN_BUDGET, None for no limit
+
+    Returns:
+        list of the deleted store directories
+    """
+    budget = settings.COLUMN_BUDGET if budget is None else budget
+    if budget is None or not os.path.isdir(settings.COLUMN_DIR):
+        return []
+
+    stores = []
+    for name in os.listdir(settings.COLUMN_DIR):
+        directory = os.path.join(settings.COLUMN_DIR, name)
+        if '.part' in name or not os.path.isdir(directory):   # i.e. being built by another process
+            continue
+
+        try:
+            used = os.stat(directory).st_mtime
+            size = sum(entry.stat().st_size for entry in os.scandir(directory))
+        except OSError:   # removed meanwhile
+            continue
+        stores.append((used, directory, size))
+
+    total = sum(size for __, __, size in stores)
+    removed = []
+    for used, directory, size in sorted(stores):
+        if total <= budget:
+            break
+        if directory in _STORES:
+            continue
+
+        # open memory maps of other processes stay valid, they build the store again when they load it
+        shutil.rmtree(directory, ignore_errors=True)
+        removed.append(directory)
+        total -= size
+
+    return removed
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert downloaded reanalysis files to column stores.')
+    parser.add_argument('source', choices=['merra', 'narr'])
+    parser.add_argument('files', nargs='+', help='merra: daily files, narr: air, hgt and shum files of each month, in that order')
+
+    args = parser.parse_args()
+
+    step = 1 if args.source == 'merra' else 3
+    for i in range(0, len(args.files), step):
+        print(build(args.source, args.files[i:i + step], store_path(args.source, args.files[i:i + step])))
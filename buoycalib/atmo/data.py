@@ -3,8 +3,6 @@ import os
 import itertools
 
 import numpy
-from netCDF4 import Dataset, num2date
-import utm
 
 from . import funcs
 
@@ -22,6 +20,8 @@ def open_netcdf4(filename):
     Raises:
         IOError: if file does not exist at the expected path
     """
+    from netCDF4 import Dataset   # on first use, buoy data needs this module but not netCDF4
+
     if not os.path.isfile(filename):
         raise IOError('Data file not at path: {0}'.format(filename))
 
@@ -30,6 +30,8 @@ def open_netcdf4(filename):
 
 
 def closest_hours(time_data, time_units, date):
+    from netCDF4 import num2date
+
     dates = num2date(time_data, time_units)
     t1, t2 = sorted(abs(dates - date).argsort()[:2])
 
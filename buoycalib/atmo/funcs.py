@@ -1,5 +1,4 @@
 import numpy
-import utm
     
 def choose_points(lat, lon, buoy_lat, buoy_lon, flat=False):
     """
@@ -1,68 +1,102 @@
 import numpy
-from netCDF4 import num2date
 
-from . import (data, funcs)
-from .. import (settings, interp)
+from . import (columns, subset)
+from .. import (instrument, settings, interp)
 from ..download import url_download
 
 
-def download(date):
+def download(date, box=None):
     """
-    Download MERRA data via ftp.
+    Download MERRA data via http.
 
     Args:
-        cc: CalibrationController object
+        date: datetime object, selects the daily file
+        box: (south, north, west, east), only download this area (see subset.py),
+            None for the whole file
 
     Returns:
-        None
+        filename
     """
+    if box is not None:
+        return url_download(*subset.merra_download(date, box))
+
+    filename = url_download(url(date), settings.MERRA_DIR, auth=settings.MERRA_LOGIN)
+    return filename
+
+
+def download_for(date, lat_oi, lon_oi):
+    """ download the data needed around a point, honoring settings.ATMO_SUBSET """
+    if settings.ATMO_SUBSET:
+        return download(date, subset.bbox(lat_oi, lon_oi))
+
+    return download(date)
+
+
+def url(date):
+    """ url of the daily MERRA-2 file which covers date. """
     # year with century, zero padded month, then full date
     # TODO fix merra url to include new format strings
-    url = settings.MERRA_URL % (date.strftime('%Y'), date.strftime('%m'),
-                                date.strftime('%Y%m%d'))
+    return settings.MERRA_URL % (date.strftime('%Y'), date.strftime('%m'),
+                                 date.strftime('%Y%m%d'))
 
-    filename = url_download(url, settings.MERRA_DIR, auth=settings.MERRA_LOGIN)
-    return filename
+
+def group(date, lat_oi, lon_oi):
+    """ key of the file set download_for would use for a point, without downloading it """
+    if settings.ATMO_SUBSET:
+        return date.strftime('%Y%m%d'), subset.bbox(lat_oi, lon_oi)
+
+    return date.strftime('%Y%m%d'), None
 
 
 def process(date, lat_oi, lon_oi, verbose=False):
     """
     process atmospheric data, yield an atmosphere
     """
-    
-    filename = download(date)
+    return process_many([(date, lat_oi, lon_oi)], verbose)[0]
+
 
-    atmo_data = data.open_netcdf4(filename)
+@instrument.timed()
+def process_many(points, verbose=False):
+    """
+    process for several points at once.
+
+    Points which share a file set (see group) are read from one column store,
+    with a single vectorized extraction.
+
+    Args:
+        points: list of (date, lat, lon)
+
+    Returns:
+        list of atmospheres (height, press, temp, relhum), in points order
+    """
+    groups = {}
+    for i, point in enumerate(points):
+        groups.setdefault(group(*point), []).append(i)
+
+    atmospheres = [None] * len(points)
 
-    # choose points
-    lat = atmo_data.variables['lat'][:]
-    lon = atmo_data.variables['lon'][:]
-    lat = numpy.stack([lat]*lon.shape[0], axis=0)
-    lon = numpy.stack([lon]*lat.shape[1], axis=1)
-    chosen_idxs, data_coor = funcs.choose_points(lat, lon, lat_oi, lon_oi)
+    for idxs in groups.values():
+        atmo_data = columns.load('merra', download_for(*points[idxs[0]]))
+        dates, lats, lons = zip(*[points[i] for i in idxs])
 
-    latidx = tuple(chosen_idxs[0])
-    lonidx = tuple(chosen_idxs[1])
+        for i, extracted in zip(idxs, atmo_data.around_many(dates, lats, lons)):
+            atmospheres[i] = _atmosphere(points[i], atmo_data.levels, extracted, verbose)
 
-    t1, t2 = data.closest_hours(atmo_data.variables['time'][:].data,
-                                atmo_data.variables['time'].units, date)
-    t1_dt = num2date(atmo_data.variables['time'][t1], atmo_data.variables['time'].units)
-    t2_dt = num2date(atmo_data.variables['time'][t2], atmo_data.variables['time'].units)
+    return atmospheres
 
-    index1 = (t1, slice(None), latidx, lonidx)
-    index2 = (t2, slice(None), latidx, lonidx)
 
-    press = numpy.array(atmo_data.variables['lev'][:])
+def _atmosphere(point, levels, extracted, verbose=False):
+    """ atmosphere at a point, from the profiles around it (as returned by columns.Columns.around) """
+    date, lat_oi, lon_oi = point
 
-    # the .T on the end is a transpose
-    temp1 = numpy.diagonal(atmo_data.variables['T'][index1], axis1=1, axis2=2).T
-    temp2 = numpy.diagonal(atmo_data.variables['T'][index2], axis1=1, axis2=2).T
+    # profiles of the 4 closest grid columns, at the 2 closest times
+    data_coor, (t1_dt, t2_dt), profiles = extracted
 
-    rhum1 = numpy.diagonal(atmo_data.variables['RH'][index1], axis1=1, axis2=2).T   # relative humidity
-    rhum2 = numpy.diagonal(atmo_data.variables['RH'][index2], axis1=1, axis2=2).T
+    press = numpy.array(levels)
 
-    height1 = numpy.diagonal(atmo_data.variables['H'][index1], axis1=1, axis2=2).T / 1000.0   # height
-    height2 = numpy.diagonal(atmo_data.variables['H'][index2], axis1=1, axis2=2).T / 1000.0
+    temp1, temp2 = profiles['T']
+    rhum1, rhum2 = profiles['RH']   # relative humidity
+    height1, height2 = (h / 1000.0 for h in profiles['H'])   # height
 
     # interpolate in time, now they are shape (4, N)
     t = interp.interp_time(date, temp1, temp2, t1_dt, t2_dt)
@@ -94,47 +128,26 @@ def process(date, lat_oi, lon_oi, verbose=False):
     if verbose:
         # send out plots and stuff
         stuff = numpy.asarray([height, press, temp, relhum]).T
-        h = 'Height [km], Pressure[kPa], Temperature[k], Relative_Humidity[0-100]' + '\nCoordinates: {0} Buoy:{1}'.format(data_coor, buoy)
+        h = 'Height [km], Pressure[kPa], Temperature[k], Relative_Humidity[0-100]' + '\nCoordinates: {0} Point:{1}'.format(data_coor, (lat_oi, lon_oi))
         
-        numpy.savetxt('atmosphere_{0}_{1}_{2}.txt'.format('merra', date.strftime('%Y%m%d'), buoy.id), stuff, fmt='%7.2f, %7.2f, %7.2f, %7.2f', header=h)
+        numpy.savetxt('atmosphere_{0}_{1}_{2}_{3}.txt'.format('merra', date.strftime('%Y%m%d'), lat_oi, lon_oi), stuff, fmt='%7.2f, %7.2f, %7.2f, %7.2f', header=h)
 
     return height, press, temp, relhum
 
 
 def error_bar_atmos(date, lat_oi, lon_oi, verbose=False):
-    filename = download(date)
-    atmo_data = data.open_netcdf4(filename)
-
-    # choose points
-    lat = atmo_data.variables['lat'][:]
-    lon = atmo_data.variables['lon'][:]
-    lat = numpy.stack([lat]*lon.shape[0], axis=0)
-    lon = numpy.stack([lon]*lat.shape[1], axis=1)
-    chosen_idxs, data_coor = funcs.choose_points(lat, lon, lat_oi, lon_oi)
-
-    latidx = tuple(chosen_idxs[0])
-    lonidx = tuple(chosen_idxs[1])
-
-    t1, t2 = data.closest_hours(atmo_data.variables['time'][:].data,
-                                atmo_data.variables['time'].units, date)
-    t1_dt = num2date(atmo_data.variables['time'][t1], atmo_data.variables['time'].units)
-    t2_dt = num2date(atmo_data.variables['time'][t2], atmo_data.variables['time'].units)
-
-    index1 = (t1, slice(None), latidx, lonidx)
-    index2 = (t2, slice(None), latidx, lonidx)
+    filename = download_for(date, lat_oi, lon_oi)
 
-    # shape (4, N) each except for pressure
-    press = numpy.array(atmo_data.variables['lev'][:])
+    atmo_data = columns.load('merra', filename)
 
-    # the .T on the end is a transpose
-    temp1 = numpy.diagonal(atmo_data.variables['T'][index1], axis1=1, axis2=2).T
-    temp2 = numpy.diagonal(atmo_data.variables['T'][index2], axis1=1, axis2=2).T
+    # profiles of the 4 closest grid columns, at the 2 closest times
+    data_coor, (t1_dt, t2_dt), profiles = atmo_data.around(date, lat_oi, lon_oi)
 
-    rhum1 = numpy.diagonal(atmo_data.variables['RH'][index1], axis1=1, axis2=2).T   # relative humidity
-    rhum2 = numpy.diagonal(atmo_data.variables['RH'][index2], axis1=1, axis2=2).T
+    press = numpy.array(atmo_data.levels)
 
-    height1 = numpy.diagonal(atmo_data.variables['H'][index1], axis1=1, axis2=2).T / 1000.0   # height
-    height2 = numpy.diagonal(atmo_data.variables['H'][index2], axis1=1, axis2=2).T / 1000.0
+    temp1, temp2 = profiles['T']
+    rhum1, rhum2 = profiles['RH']   # relative humidity
+    height1, height2 = (h / 1000.0 for h in profiles['H'])   # height
 
     atmos = []
 
@@ -1,71 +1,106 @@
 import numpy
-from netCDF4 import num2date
 
-from . import (data, funcs)
-from .. import (settings, interp)
-from ..download import url_download
+from . import (columns, data, subset)
+from .. import (instrument, settings, interp)
+from ..download import download_many
 
 
-def download(date):
+def download(date, box=None):
     """
     Download NARR Data (netCDF4 format) via ftp.
 
     Args:
-        scene
+        date: datetime object, selects the monthly files
+        box: (south, north, west, east), only download this area and the hours
+            around date (see subset.py), None for the whole files
+
+    Returns:
+        temperature, height and humidity filenames
     """
     # TODO fix narr urls to include new format strings
 
+    if box is not None:
+        return download_many(subset.narr_downloads(date, box))
+
+    # temperature, height and humidity files, all at once
+    narr_files = download_many([(url, settings.NARR_DIR) for url in urls(date)])
+
+    return narr_files
+
+
+def download_for(date, lat_oi, lon_oi):
+    """ download the data needed around a point, honoring settings.ATMO_SUBSET """
+    if settings.ATMO_SUBSET:
+        return download(date, subset.bbox(lat_oi, lon_oi))
+
+    return download(date)
+
+
+def urls(date):
+    """ urls of the monthly NARR temperature, height and humidity files which cover date. """
     date = date.strftime('%Y%m')   # YYYYMM
-    narr_files = []
 
-    for url in settings.NARR_URLS:
-        url = url % date
+    return [url % date for url in settings.NARR_URLS]
 
-        filename = url_download(url, settings.NARR_DIR)
-        narr_files.append(filename)
+def group(date, lat_oi, lon_oi):
+    """ key of the file set download_for would use for a point, without downloading it """
+    if settings.ATMO_SUBSET:
+        # subsets hold the hours around date only
+        return date.strftime('%Y%m%d%H%M'), subset.bbox(lat_oi, lon_oi)
+
+    return date.strftime('%Y%m'), None
 
-    return narr_files
 
-def process(source, date, buoy, verbose=False):
+def process(date, lat_oi, lon_oi, verbose=False):
     """
     process atmospheric data, yield an atmosphere
     """
-    files = download(date)
+    return process_many([(date, lat_oi, lon_oi)], verbose)[0]
+
+
+@instrument.timed()
+def process_many(points, verbose=False):
+    """
+    process for several points at once.
 
-    temp_file, height_file, shum_file = files
-    temp_netcdf = data.open_netcdf4(temp_file)
-    height_netcdf = data.open_netcdf4(height_file)
-    shum_netcdf = data.open_netcdf4(shum_file)
+    Points which share a file set (see group) are read from one column store,
+    with a single vectorized extraction.
+
+    Args:
+        points: list of (date, lat, lon)
+
+    Returns:
+        list of atmospheres (height, press, temp, relhum), in points order
+    """
+    groups = {}
+    for i, point in enumerate(points):
+        groups.setdefault(group(*point), []).append(i)
 
-    # choose points
-    lat = temp_netcdf.variables['lat'][:]
-    lon = temp_netcdf.variables['lon'][:]
+    atmospheres = [None] * len(points)
 
-    chosen_idxs, data_coor = funcs.choose_points(lat, lon, buoy.lat, buoy.lon)
+    for idxs in groups.values():
+        atmo_data = columns.load('narr', download_for(*points[idxs[0]]))
+        dates, lats, lons = zip(*[points[i] for i in idxs])
 
-    latidx = tuple(chosen_idxs[0])
-    lonidx = tuple(chosen_idxs[1])
+        for i, extracted in zip(idxs, atmo_data.around_many(dates, lats, lons)):
+            atmospheres[i] = _atmosphere(points[i], atmo_data.levels, extracted, verbose)
 
-    t1, t2 = data.closest_hours(temp_netcdf.variables['time'][:],
-                                temp_netcdf.variables['time'].units, date)
+    return atmospheres
 
-    t1_dt = num2date(temp_netcdf.variables['time'][t1], temp_netcdf.variables['time'].units)
-    t2_dt = num2date(temp_netcdf.variables['time'][t2], temp_netcdf.variables['time'].units)
 
-    index1 = (t1, slice(None), latidx, lonidx)
-    index2 = (t2, slice(None), latidx, lonidx)
+def _atmosphere(point, levels, extracted, verbose=False):
+    """ atmosphere at a point, from the profiles around it (as returned by columns.Columns.around) """
+    date, lat_oi, lon_oi = point
 
-    press = numpy.array(temp_netcdf.variables['level'][:])
+    # profiles of the 4 closest grid columns, at the 2 closest times
+    data_coor, (t1_dt, t2_dt), profiles = extracted
 
-    # the .T on the end is a transpose
-    temp1 = numpy.diagonal(temp_netcdf.variables['air'][index1], axis1=1, axis2=2).T
-    temp2 = numpy.diagonal(temp_netcdf.variables['air'][index2], axis1=1, axis2=2).T
+    press = numpy.array(levels)
 
-    height1 = numpy.diagonal(height_netcdf.variables['hgt'][index1], axis1=1, axis2=2).T / 1000.0   # convert m to km
-    height2 = numpy.diagonal(height_netcdf.variables['hgt'][index2], axis1=1, axis2=2).T / 1000.0
+    temp1, temp2 = profiles['air']
+    height1, height2 = (h / 1000.0 for h in profiles['hgt'])   # convert m to km
 
-    shum_1 = numpy.diagonal(shum_netcdf.variables['shum'][index1], axis1=1, axis2=2).T
-    shum_2 = numpy.diagonal(shum_netcdf.variables['shum'][index2], axis1=1, axis2=2).T
+    shum_1, shum_2 = profiles['shum']
     rhum1 = data.convert_sh_rh(shum_1, temp1, press)
     rhum2 = data.convert_sh_rh(shum_2, temp2, press)
 
@@ -75,9 +110,9 @@ def process(source, date, buoy, verbose=False):
     rh = interp.interp_time(date, rhum1, rhum2, t1_dt, t2_dt)
     
     # interpolate in space, now they are shape (1, N)
-    height = interp.idw(h, data_coor, [buoy.lat, buoy.lon])
-    temp = interp.idw(t, data_coor, [buoy.lat, buoy.lon])
-    relhum = interp.idw(rh, data_coor, [buoy.lat, buoy.lon])
+    height = interp.idw(h, data_coor, [lat_oi, lon_oi])
+    temp = interp.idw(t, data_coor, [lat_oi, lon_oi])
+    relhum = interp.idw(rh, data_coor, [lat_oi, lon_oi])
 
     # get rid of nans 
     # TODO is this still necesary?
@@ -99,8 +134,8 @@ def process(source, date, buoy, verbose=False):
     if verbose:
         # send out plots and stuff
         stuff = numpy.asarray([height, press, temp, relhum]).T
-        h = 'Height [km], Pressure[kPa], Temperature[k], Relative_Humidity[0-100]' + '\nCoordinates: {0} Buoy:{1}'.format(data_coor, buoy)
+        h = 'Height [km], Pressure[kPa], Temperature[k], Relative_Humidity[0-100]' + '\nCoordinates: {0} Point:{1}'.format(data_coor, (lat_oi, lon_oi))
         
-        numpy.savetxt('atmosphere_{0}_{1}_{2}.txt'.format(source, date.strftime('%Y%m%d'), buoy.id), stuff, fmt='%7.2f, %7.2f, %7.2f, %7.2f', header=h)
+        numpy.savetxt('atmosphere_{0}_{1}_{2}_{3}.txt'.format('narr', date.strftime('%Y%m%d'), lat_oi, lon_oi), stuff, fmt='%7.2f, %7.2f, %7.2f, %7.2f', header=h)
 
     return height, press, temp, relhum
@@ -1,7 +1,6 @@
 import numpy
-from netCDF4 import num2date
 
-from . import (narr, merra, data, funcs)
+from . import (narr, merra, data, columns)
 from .. import (settings, interp)
 
 def process(source, date, buoy, verbose=False):
@@ -13,76 +12,31 @@ def process(source, date, buoy, verbose=False):
     files = mod.download(date)
 
     if source == 'narr':
-        temp_file, height_file, shum_file = files
-        temp_netcdf = data.open_netcdf4(temp_file)
-        height_netcdf = data.open_netcdf4(height_file)
-        shum_netcdf = data.open_netcdf4(shum_file)
+        atmo_data = columns.load('narr', files)
 
-        # choose points
-        lat = temp_netcdf.variables['lat'][:]
-        lon = temp_netcdf.variables['lon'][:]
+        # profiles of the 4 closest grid columns, at the 2 closest times
+        data_coor, (t1_dt, t2_dt), profiles = atmo_data.around(date, buoy.lat, buoy.lon)
 
-        chosen_idxs, data_coor = funcs.choose_points(lat, lon, buoy.lat, buoy.lon)
+        press = numpy.array(atmo_data.levels)
 
-        latidx = tuple(chosen_idxs[0])
-        lonidx = tuple(chosen_idxs[1])
+        temp1, temp2 = profiles['air']
+        height1, height2 = (h / 1000.0 for h in profiles['hgt'])   # convert m to km
 
-        t1, t2 = data.closest_hours(temp_netcdf.variables['time'][:],
-                                    temp_netcdf.variables['time'].units, date)
-
-        t1_dt = num2date(temp_netcdf.variables['time'][t1], temp_netcdf.variables['time'].units)
-        t2_dt = num2date(temp_netcdf.variables['time'][t2], temp_netcdf.variables['time'].units)
-
-        index1 = (t1, slice(None), latidx, lonidx)
-        index2 = (t2, slice(None), latidx, lonidx)
-
-        press = numpy.array(temp_netcdf.variables['level'][:])
-
-        # the .T on the end is a transpose
-        temp1 = numpy.diagonal(temp_netcdf.variables['air'][index1], axis1=1, axis2=2).T
-        temp2 = numpy.diagonal(temp_netcdf.variables['air'][index2], axis1=1, axis2=2).T
-
-        height1 = numpy.diagonal(height_netcdf.variables['hgt'][index1], axis1=1, axis2=2).T / 1000.0   # convert m to km
-        height2 = numpy.diagonal(height_netcdf.variables['hgt'][index2], axis1=1, axis2=2).T / 1000.0
-
-        shum_1 = numpy.diagonal(shum_netcdf.variables['shum'][index1], axis1=1, axis2=2).T
-        shum_2 = numpy.diagonal(shum_netcdf.variables['shum'][index2], axis1=1, axis2=2).T
+        shum_1, shum_2 = profiles['shum']
         rhum1 = data.convert_sh_rh(shum_1, temp1, press)
         rhum2 = data.convert_sh_rh(shum_2, temp2, press)
 
     elif source == 'merra':
-        filename = files
-        atmo_data = data.open_netcdf4(filename)
-
-        # choose points
-        lat = atmo_data.variables['lat'][:]
-        lon = atmo_data.variables['lon'][:]
-        lat = numpy.stack([lat]*lon.shape[0], axis=0)
-        lon = numpy.stack([lon]*lat.shape[1], axis=1)
-        chosen_idxs, data_coor = funcs.choose_points(lat, lon, buoy.lat, buoy.lon)
-
-        latidx = tuple(chosen_idxs[0])
-        lonidx = tuple(chosen_idxs[1])
-
-        t1, t2 = data.closest_hours(atmo_data.variables['time'][:].data,
-                                    atmo_data.variables['time'].units, date)
-        t1_dt = num2date(atmo_data.variables['time'][t1], atmo_data.variables['time'].units)
-        t2_dt = num2date(atmo_data.variables['time'][t2], atmo_data.variables['time'].units)
-
-        index1 = (t1, slice(None), latidx, lonidx)
-        index2 = (t2, slice(None), latidx, lonidx)
-
-        press = numpy.array(atmo_data.variables['lev'][:])
+        atmo_data = columns.load('merra', files)
 
-        # the .T on the end is a transpose
-        temp1 = numpy.diagonal(atmo_data.variables['T'][index1], axis1=1, axis2=2).T
-        temp2 = numpy.diagonal(atmo_data.variables['T'][index2], axis1=1, axis2=2).T
+        # profiles of the 4 closest grid columns, at the 2 closest times
+        data_coor, (t1_dt, t2_dt), profiles = atmo_data.around(date, buoy.lat, buoy.lon)
 
-        rhum1 = numpy.diagonal(atmo_data.variables['RH'][index1], axis1=1, axis2=2).T   # relative humidity
-        rhum2 = numpy.diagonal(atmo_data.variables['RH'][index2], axis1=1, axis2=2).T
+        press = numpy.array(atmo_data.levels)
 
-        height1 = numpy.diagonal(atmo_data.variables['H'][index1], axis1=1, axis2=2).T / 1000.0   # height
-        height2 = numpy.diagonal(atmo_data.variables['H'][index2], axis1=1, axis2=2).T / 1000.0
+        temp1, temp2 = profiles['T']
+        rhum1, rhum2 = profiles['RH']   # relative humidity
+        height1, height2 = (h / 1000.0 for h in profiles['H'])   # height
 
     else:
         raise ValueError('Source must be one of (\'narr\' or \'merra\'): {0}'.format(source))
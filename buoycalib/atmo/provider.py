@@ -0,0 +1,74 @@
+"""
+Atmospheres of many buoys and scenes, extracted together.
+
+A batch often has many scenes on the same MERRA day or NARR month, each with
+several buoys. Instead of one read of the reanalysis per buoy, the points
+(overpass date, buoy lat, buoy lon) of a group of scenes are registered
+ahead with expect(). The first time the atmosphere of a point is needed,
+every expected point sharing its files is extracted at once, from one open
+column store (see merra.process_many), and the others are then served
+from memory.
+"""
+import threading
+
+from . import (merra, narr)
+
+SOURCES = {'merra': merra, 'narr': narr}
+
+
+class AtmosphereProvider(object):
+    """
+    Usage:
+        provider = AtmosphereProvider()
+        provider.expect('merra', [(date, lat, lon), ...])
+        atmosphere = provider.process('merra', date, lat, lon)
+    """
+    def __init__(self):
+        self._expected = {}   # (source, group) -> {(date, lat, lon): None}, in the order they were expected
+        self._atmospheres = {}   # (source, date, lat, lon) -> atmosphere
+        self._groups = {}   # (source, group) -> lock held while the group is extracted
+        self._lock = threading.Lock()
+
+    def expect(self, source, points):
+        """ register points whose atmospheres will probably be asked for """
+        module = SOURCES[source]
+
+        with self._lock:
+            for point in points:
+                if (source,) + tuple(point) not in self._atmospheres:
+                    self._expected.setdefault((source, module.group(*point)), {})[tuple(point)] = None
+
+    def process(self, source, date, lat_oi, lon_oi, verbose=False):
+        """ the atmosphere at a point, as merra.process or narr.process """
+        if source not in SOURCES:
+            raise ValueError('atmo_source is not one of (narr, merra)')
+        module = SOURCES[source]
+        key = (source, date, lat_oi, lon_oi)
+        group = (source, module.group(date, lat_oi, lon_oi))
+
+        with self._lock:
+            group_lock = self._groups.setdefault(group, threading.Lock())
+
+        # threads of the same group wait here for the one extraction, other groups extract meanwhile
+        with group_lock:
+            with self._lock:
+                if key in self._atmospheres:
+                    return self._atmospheres[key]
+
+                expected = self._expected.pop(group, {})
+                expected[(date, lat_oi, lon_oi)] = None
+                points = [p for p in expected if (source,) + p not in self._atmospheres]
+
+            atmospheres = module.process_many(points, verbose)
+
+            with self._lock:
+                for point, atmosphere in zip(points, atmospheres):
+                    self._atmospheres[(source,) + point] = atmosphere
+
+                return self._atmospheres[key]
+
+    def forget(self):
+        """ drop the atmospheres kept so far, i.e. between groups of a batch """
+        with self._lock:
+            self._atmospheres.clear()
+            self._expected.clear()
@@ -0,0 +1,121 @@
+"""
+Download only a lat/lon/time subset of the reanalysis data, instead of whole files.
+
+MERRA-2 is read through the GES DISC OPeNDAP server, which returns the
+requested index ranges of each variable as a small netCDF4 file. NARR is read
+through the NOAA PSL THREDDS NetCDF Subset Service, which takes a lat/lon
+box and a time range. The subsets keep the variable names and layout of the
+full files, so merra.process and narr.process read them the same way.
+
+Boxes are widened by SUBSET_MARGIN and snapped outward to whole multiples
+of SUBSET_SNAP degrees, so nearby buoys share one cached subset. Subsets are
+saved in settings.SUBSET_DIR, named by (source, date, box).
+"""
+import datetime
+import math
+
+from .. import settings
+
+SUBSET_MARGIN = 1.0   # [degrees], around the points, more than one grid cell of either source
+SUBSET_SNAP = 2.0   # [degrees]
+
+# MERRA-2 inst3_3d_asm_Np grid: lat = -90 + 0.5 i, lon = -180 + 0.625 j
+MERRA_LAT0, MERRA_DLAT, MERRA_NLAT = -90.0, 0.5, 361
+MERRA_LON0, MERRA_DLON, MERRA_NLON = -180.0, 0.625, 576
+MERRA_NLEV = 42
+MERRA_NTIME = 8
+MERRA_VARIABLES = ['T', 'RH', 'H']
+
+NARR_VARIABLES = ['air', 'hgt', 'shum']
+NARR_STEP = datetime.timedelta(hours=3)
+
+
+def bbox(lats, lons):
+    """
+    Box around one or more points, snapped to the subset grid.
+
+    Args:
+        lats, lons: scalars or sequences of latitude and longitude
+
+    Returns:
+        (south, north, west, east) [degrees]
+    """
+    lats = [lats] if not hasattr(lats, '__iter__') else list(lats)
+    lons = [lons] if not hasattr(lons, '__iter__') else list(lons)
+
+    def _down(value):
+        return math.floor(value / SUBSET_SNAP) * SUBSET_SNAP
+
+    def _up(value):
+        return math.ceil(value / SUBSET_SNAP) * SUBSET_SNAP
+
+    south = max(_down(min(lats) - SUBSET_MARGIN), -90.0)
+    north = min(_up(max(lats) + SUBSET_MARGIN), 90.0)
+    west = max(_down(min(lons) - SUBSET_MARGIN), -180.0)
+    east = min(_up(max(lons) + SUBSET_MARGIN), 180.0)
+
+    return south, north, west, east
+
+
+def _box_name(box):
+    return '{0:+04.0f}{1:+04.0f}{2:+05.0f}{3:+05.0f}'.format(*box)
+
+
+def merra_indices(box):
+    """ inclusive index ranges (lat0, lat1), (lon0, lon1) of the MERRA grid covering box """
+    south, north, west, east = box
+
+    lat0 = max(int(math.floor((south - MERRA_LAT0) / MERRA_DLAT)), 0)
+    lat1 = min(int(math.ceil((north - MERRA_LAT0) / MERRA_DLAT)), MERRA_NLAT - 1)
+    lon0 = max(int(math.floor((west - MERRA_LON0) / MERRA_DLON)), 0)
+    lon1 = min(int(math.ceil((east - MERRA_LON0) / MERRA_DLON)), MERRA_NLON - 1)
+
+    return (lat0, lat1), (lon0, lon1)
+
+
+def merra_url(date, box):
+    """ OPeNDAP url of the MERRA-2 subset for the day of date, as netCDF4. """
+    (lat0, lat1), (lon0, lon1) = merra_indices(box)
+
+    dataset = settings.MERRA_OPENDAP_URL % (date.strftime('%Y'), date.strftime('%m'), date.strftime('%Y%m%d'))
+
+    # the daily file has all 8 times, all of them are kept so data.closest_hours works as usual
+    grid = '[0:{0}][0:{1}][{2}:{3}][{4}:{5}]'.format(MERRA_NTIME - 1, MERRA_NLEV - 1, lat0, lat1, lon0, lon1)
+    constraint = ['lat[{0}:{1}]'.format(lat0, lat1), 'lon[{0}:{1}]'.format(lon0, lon1),
+                  'lev[0:{0}]'.format(MERRA_NLEV - 1), 'time[0:{0}]'.format(MERRA_NTIME - 1)]
+    constraint += [var + grid for var in MERRA_VARIABLES]
+
+    # Hyrax returns netCDF4 when .nc4 is appended to the dataset name
+    return dataset + '.nc4?' + ','.join(constraint)
+
+
+def merra_download(date, box):
+    """ (url, directory, filename, auth) of the MERRA-2 subset, as taken by download.url_download """
+    filename = 'merra_{0}_{1}.nc4'.format(date.strftime('%Y%m%d'), _box_name(box))
+
+    return merra_url(date, box), settings.SUBSET_DIR, filename, settings.MERRA_LOGIN
+
+
+def narr_urls(date, box):
+    """ NetCDF Subset Service urls of the NARR temperature, height and humidity around date. """
+    south, north, west, east = box
+
+    # the two 3 hourly times on either side of date
+    start = date - NARR_STEP
+    end = date + NARR_STEP
+
+    query = 'north={0}&south={1}&west={2}&east={3}&horizStride=1&time_start={4}&time_end={5}' \
+            '&addLatLon=true&accept=netcdf4'.format(north, south, west, east,
+                                                    start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                                    end.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+    return [settings.NARR_NCSS_URL % (var, date.strftime('%Y%m')) + '?var={0}&'.format(var) + query
+            for var in NARR_VARIABLES]
+
+
+def narr_downloads(date, box):
+    """ (url, directory, filename, auth) of the NARR subsets, in narr.download order """
+    filenames = ['narr_{0}_{1}_{2}.nc'.format(var, date.strftime('%Y%m%d%H%M'), _box_name(box))
+                 for var in NARR_VARIABLES]
+
+    return [(url, settings.SUBSET_DIR, filename, None) for url, filename in zip(narr_urls(date, box), filenames)]
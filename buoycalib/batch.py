@@ -0,0 +1,382 @@
+"""
+Persistent job queue for batches of scenes.
+
+Jobs are rows of a SQLite table, one per scene, with a status:
+
+    pending -> running -> done
+                       -> pending again after a failure, until the retries are used up
+                       -> failed
+
+Any number of worker processes, on one or several machines sharing a
+filesystem, claim pending jobs in the order the scenes were added. Jobs may
+carry a group (i.e. the reanalysis day of the scene), a worker claims the
+jobs of one group together so they can share their inputs. A job
+claimed by a worker that stopped updating its heartbeat (crashed, killed,
+node lost) is claimed again by another worker. Rerunning a batch over the
+same queue skips the scenes already done, so an interrupted batch resumes
+where it stopped.
+
+Usage:
+    queue = JobQueue('batch.sqlite')
+    queue.add(scenes)
+    run(queue, process_scene, workers=4)
+    for scene_id, result in queue.results():
+        ...
+"""
+import contextlib
+import multiprocessing
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import warnings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    scene_id TEXT PRIMARY KEY,
+    position INTEGER,
+    status TEXT,
+    attempts INTEGER,
+    worker TEXT,
+    heartbeat REAL,
+    not_before REAL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    result BLOB,
+    grp TEXT DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, position);
+"""
+
+RETRIES = 3   # attempts of a job before it is marked failed
+BACKOFF = 60.0   # [s], wait before the first retry, doubled at each retry
+STALE_AFTER = 2 * 60 * 60.0   # [s], without a heartbeat, a running job is claimed again
+HEARTBEAT = 60.0   # [s], between heartbeats of a worker while it runs jobs, at most stale_after / 4
+REPORT_EVERY = 30.0   # [s], between progress reports
+
+
+class JobQueue(object):
+    """
+    SQLite table of the jobs of a batch.
+
+    Args:
+        path: sqlite file, on a filesystem shared by every worker
+        retries: attempts of a job before it is marked failed
+        backoff: [s] wait before the first retry, doubled at each retry
+        stale_after: [s] a running job without a heartbeat for this long is claimed again
+    """
+    def __init__(self, path, retries=RETRIES, backoff=BACKOFF, stale_after=STALE_AFTER):
+        self.path = path
+        self.retries = retries
+        self.backoff = backoff
+        self.stale_after = stale_after
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+            # queues created before jobs had a group
+            if 'grp' not in [row[1] for row in db.execute('PRAGMA table_info(jobs)')]:
+                db.execute("ALTER TABLE jobs ADD COLUMN grp TEXT DEFAULT ''")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one short lived connection per call, like store.DataStore, so processes can share the queue
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, two workers never claim the same job
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+    def add(self, scenes, group=None):
+        """
+        Add scenes as pending jobs, in order. Duplicates and scenes already
+        in the queue (i.e. when resuming) are skipped.
+
+        Args:
+            scenes: scene ids
+            group: function scene_id -> group name, jobs of a group are claimed together
+
+        Returns:
+            number of jobs added
+        """
+        scenes = [s for s in dict.fromkeys(scenes) if s]
+
+        with self._transaction() as db:
+            start = db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM jobs').fetchone()[0]
+            before = db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+            db.executemany('INSERT OR IGNORE INTO jobs (scene_id, position, status, attempts, not_before, grp) '
+                           'VALUES (?, ?, ?, 0, 0, ?)',
+                           [(scene_id, start + i, 'pending', group(scene_id) if group else '')
+                            for i, scene_id in enumerate(scenes)])
+            after = db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+
+        return after - before
+
+    def claim(self, worker, n=1):
+        """
+        Take the next pending job, and up to n - 1 more pending jobs of its
+        group, in scene order.
+
+        Running jobs whose worker stopped updating its heartbeat are put
+        back to pending first.
+
+        Returns:
+            list of scene ids, empty if no job is ready
+        """
+        now = time.time()
+
+        with self._transaction() as db:
+            db.execute('UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat < ?',
+                       ('pending', 'running', now - self.stale_after))
+
+            first = db.execute('SELECT grp FROM jobs WHERE status = ? AND not_before <= ? '
+                               'ORDER BY position LIMIT 1', ('pending', now)).fetchone()
+            if first is None:
+                return []
+
+            rows = db.execute('SELECT scene_id FROM jobs WHERE status = ? AND not_before <= ? AND grp = ? '
+                              'ORDER BY position LIMIT ?', ('pending', now, first[0], n)).fetchall()
+            scenes = [row[0] for row in rows]
+
+            db.executemany('UPDATE jobs SET status = ?, worker = ?, heartbeat = ?, started = ? WHERE scene_id = ?',
+                           [('running', worker, now, now, scene_id) for scene_id in scenes])
+
+        return scenes
+
+    def heartbeat(self, worker):
+        """ mark the running jobs of worker as still alive """
+        with self._transaction() as db:
+            db.execute('UPDATE jobs SET heartbeat = ? WHERE worker = ? AND status = ?',
+                       (time.time(), worker, 'running'))
+
+    def release(self, scene_ids, worker):
+        """ put claimed jobs that were not run back to pending, their attempts unchanged """
+        with self._transaction() as db:
+            db.executemany('UPDATE jobs SET status = ?, worker = NULL WHERE scene_id = ? AND worker = ? AND status = ?',
+                           [('pending', scene_id, worker, 'running') for scene_id in scene_ids])
+
+    def complete(self, scene_id, result=None):
+        """ mark a job done, with its (picklable) result """
+        with self._transaction() as db:
+            db.execute('UPDATE jobs SET status = ?, finished = ?, error = NULL, result = ? WHERE scene_id = ?',
+                       ('done', time.time(), pickle.dumps(result, protocol=4), scene_id))
+
+    def fail(self, scene_id, error, retry=True):
+        """
+        Record a failed attempt of a job. It is retried after a backoff,
+        unless retry is False or its attempts are used up.
+        """
+        with self._transaction() as db:
+            attempts = db.execute('SELECT attempts FROM jobs WHERE scene_id = ?', (scene_id,)).fetchone()[0] + 1
+
+            if retry and attempts < self.retries:
+                status, not_before = 'pending', time.time() + self.backoff * 2 ** (attempts - 1)
+            else:
+                status, not_before = 'failed', 0
+
+            db.execute('UPDATE jobs SET status = ?, attempts = ?, not_before = ?, finished = ?, worker = NULL, '
+                       'error = ? WHERE scene_id = ?', (status, attempts, not_before, time.time(), error, scene_id))
+
+    def retry_failed(self):
+        """ put failed jobs back to pending, with their attempts reset """
+        with self._transaction() as db:
+            return db.execute('UPDATE jobs SET status = ?, attempts = 0, not_before = 0 WHERE status = ?',
+                              ('pending', 'failed')).rowcount
+
+    def unfinished(self):
+        """ number of jobs not done or failed yet """
+        with self._connect() as db:
+            return db.execute('SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)', ('pending', 'running')).fetchone()[0]
+
+    def progress(self):
+        """
+        Returns:
+            dict of the job counts by status, plus 'total', and 'rate': jobs
+            finished per hour since the first job started
+        """
+        with self._connect() as db:
+            counts = dict(db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            started, finished = db.execute('SELECT MIN(started), MAX(finished) FROM jobs WHERE status IN (?, ?)',
+                                           ('done', 'failed')).fetchone()
+
+        progress = {status: counts.get(status, 0) for status in ('pending', 'running', 'done', 'failed')}
+        progress['total'] = sum(counts.values())
+
+        elapsed = (finished - started) if started is not None else 0
+        progress['rate'] = (progress['done'] + progress['failed']) * 3600.0 / elapsed if elapsed > 0 else 0.0
+
+        return progress
+
+    def results(self):
+        """ (scene_id, result) of the done jobs, in scene order """
+        with self._connect() as db:
+            rows = db.execute('SELECT scene_id, result FROM jobs WHERE status = ? ORDER BY position', ('done',)).fetchall()
+
+        return [(scene_id, pickle.loads(result)) for scene_id, result in rows]
+
+    def errors(self):
+        """ (scene_id, attempts, error) of the failed jobs, in scene order """
+        with self._connect() as db:
+            return db.execute('SELECT scene_id, attempts, error FROM jobs WHERE status = ? ORDER BY position',
+                              ('failed',)).fetchall()
+
+
+def worker_name():
+    """ unique name of this process, across the machines sharing a queue """
+    return '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+
+def work(queue, process, permanent=(), lookahead=0, prefetch=None, prepare=None):
+    """
+    Process jobs until none is left.
+
+    Args:
+        queue: JobQueue
+        process: function scene_id -> result, run for each job
+        permanent: exception types that are not worth a retry (i.e. no buoys in the scene)
+        lookahead: jobs claimed ahead of the one being processed, so their downloads start early
+        prefetch: function (scene ids) -> prefetch.Prefetcher (not started), or None
+        prepare: function (scene ids, prefetcher) run on each claim of jobs before
+            they are processed, i.e. to share inputs between the scenes of a group
+
+    A background thread keeps the heartbeat of the claimed jobs while they run.
+    A failed hook is only a warning; claimed jobs not run when the worker stops
+    go back to pending.
+    """
+    worker = worker_name()
+
+    while True:
+        scenes = queue.claim(worker, 1 + lookahead)
+
+        if not scenes:
+            if queue.unfinished() == 0:
+                return
+            # retries waiting on their backoff, or jobs of other workers that may go stale
+            time.sleep(min(queue.backoff, 10.0))
+            continue
+
+        left = list(scenes)   # claimed, not run yet
+
+        with _heartbeat(queue, worker):
+            prefetcher = None
+            if prefetch is not None:
+                prefetcher = _hook('prefetch', lambda: prefetch(scenes).start())
+
+            try:
+                if prepare is not None:
+                    _hook('prepare', prepare, scenes, prefetcher)
+
+                while left:
+                    scene_id = left[0]
+
+                    if prefetcher is not None:
+                        prefetcher.wait(scene_id)
+
+                    try:
+                        result = process(scene_id)
+                    except permanent as e:
+                        queue.fail(scene_id, '{0}: {1}'.format(type(e).__name__, e), retry=False)
+                    except Exception:
+                        queue.fail(scene_id, traceback.format_exc())
+                    else:
+                        queue.complete(scene_id, result)
+                    finally:
+                        if prefetcher is not None:
+                            prefetcher.release(scene_id)
+
+                    left.pop(0)
+            finally:
+                # stopped early (i.e. interrupted), the other workers take the rest at once
+                queue.release(left, worker)
+
+                if prefetcher is not None:
+                    prefetcher.close()
+
+
+def _hook(name, hook, *args):
+    """ run a hook of work(), a failed hook is a warning, the jobs run without it """
+    try:
+        return hook(*args)
+    except Exception:
+        warnings.warn('{0} failed: {1}'.format(name, traceback.format_exc()), RuntimeWarning)
+        return None
+
+
+@contextlib.contextmanager
+def _heartbeat(queue, worker):
+    """ keep the running jobs of worker alive from a background thread, while the block runs """
+    every = min(HEARTBEAT, queue.stale_after / 4)
+    stop = threading.Event()
+
+    def _beat():
+        while not stop.wait(every):
+            try:
+                queue.heartbeat(worker)
+            except sqlite3.Error as e:   # i.e. the shared filesystem is busy, the next one may pass
+                warnings.warn('heartbeat failed: {0}'.format(e), RuntimeWarning)
+
+    thread = threading.Thread(target=_beat, name='heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def report(progress, elapsed):
+    """ one line progress report """
+    left = progress['pending'] + progress['running']
+    eta = '{0:.1f}h'.format(left / progress['rate']) if progress['rate'] > 0 else '?'
+
+    return '[{0}/{1}] done, {2} failed, {3} running, {4:.1f} scenes/h, eta {5}, {6:.0f}s elapsed'.format(
+        progress['done'], progress['total'], progress['failed'], progress['running'], progress['rate'], eta, elapsed)
+
+
+def run(queue, process, workers=1, permanent=(), lookahead=0, prefetch=None, prepare=None, report_every=REPORT_EVERY):
+    """
+    Process every job of a queue in worker processes, printing progress.
+
+    More workers can join from other machines by calling run (or work)
+    with a JobQueue of the same file.
+
+    Args:
+        workers: worker processes on this machine
+        others: see work()
+
+    Returns:
+        the final JobQueue.progress()
+    """
+    start = time.time()
+
+    processes = [multiprocessing.Process(target=work, args=(queue, process, permanent, lookahead, prefetch, prepare))
+                 for __ in range(workers)]
+    for p in processes:
+        p.start()
+
+    while any(p.is_alive() for p in processes):
+        for p in processes:
+            p.join(timeout=report_every / len(processes))
+        print(report(queue.progress(), time.time() - start), flush=True)
+
+    return queue.progress()
@@ -1,12 +1,17 @@
+import copy
 import math
 import os
+import threading
 
 import numpy
 import datetime
 
 from . import settings
 from . import atmo
-from .download import (url_download, ungzip)
+from .download import (url_download, open_text)
+
+_DATASETS = {}   # (station files, mtimes) -> {Buoy_ID: Buoy}
+_datasets_lock = threading.Lock()
 
 
 class BuoyDataException(Exception):
@@ -159,21 +164,36 @@ def point_in_corners(corners, point):
 
 
 def all_datasets():
-	# TODO memoize
     """
     Get list of all NOAA buoy datasets.
 
+    The station tables are parsed once, and again only when they change.
+    Each call returns its own copies of the buoys.
+
     Return:
-        [[Buoy_ID, lat, lon, thermometer_depth, height], [ ... ]]
+        {Buoy_ID: Buoy}
 
     """
-    buoys, heights, anemometer_height = numpy.genfromtxt(settings.BUOY_TXT, skip_header=7,
+    files = (settings.BUOY_TXT, settings.STATION_TXT)
+    key = tuple((f, os.path.getmtime(f)) for f in files)
+
+    with _datasets_lock:
+        if key not in _DATASETS:
+            _DATASETS.clear()
+            _DATASETS[key] = _read_datasets(*files)
+        stations = _DATASETS[key]
+
+    return {sid: copy.copy(b) for sid, b in stations.items()}
+
+
+def _read_datasets(buoy_txt, station_txt):
+    buoys, heights, anemometer_height = numpy.genfromtxt(buoy_txt, skip_header=7,
                                       usecols=(0, 1, 3), unpack=True)
     buoy_heights = dict(zip(buoys, heights))
 
     buoy_stations = {}
 
-    with open(settings.STATION_TXT, 'r') as f:
+    with open(station_txt, 'r') as f:
         f.readline()
         f.readline()
 
@@ -210,24 +230,26 @@ def all_datasets():
     return buoy_stations
 
 
-def download(id, date, directory=settings.NOAA_DIR):
-    """
-    Download and unzip appripriate buoy data from url.
-
-    Args:
-        url: url to download data from
-    """
+def url(id, date):
+    """ NOAA NDBC url of the buoy data file which covers date. """
     if date.year < 2018:
-        url = settings.NOAA_URLS[0] % (id, date.year)
+        return settings.NOAA_URLS[0] % (id, date.year)
     else:
-        url = settings.NOAA_URLS[1] % (date.strftime('%b'), id, date.strftime('%m'))
+        return settings.NOAA_URLS[1] % (date.strftime('%b'), id, date.strftime('%m'))
 
-    filename = url_download(url, directory)
 
-    if '.gz' in filename:
-        filename = ungzip(filename)
+def download(id, date, directory=None):
+    """
+    Download appripriate buoy data from url.
 
-    return filename
+    The file is kept compressed, load() reads it straight from the gzip stream.
+
+    Args:
+        id: buoy id
+        date: datetime object, selects the year or month file
+        directory: default settings.NOAA_DIR, read when called
+    """
+    return url_download(url(id, date), directory if directory is not None else settings.NOAA_DIR)
 
 
 def skin_temp(file, date, thermometer_depth):
@@ -280,7 +302,7 @@ def load(filename):
 
     Args:
         date: datetime object
-        filename: buoy file to open
+        filename: buoy file to open, plain text or gzipped
 
     Returns:
         data: from file, trimmed to date
@@ -301,7 +323,7 @@ def load(filename):
 
     dates = []
     lines = []
-    with open(filename, 'r') as f:
+    with open_text(filename) as f:
         header = f.readline()
         unit = f.readline()
 
@@ -1,3 +1,4 @@
+import concurrent.futures
 import cv2
 import io
 import urllib.request
@@ -11,35 +12,63 @@ import utm
 from . import (sat, atmo, buoy, settings)
 img = sat.image_processing
 
+PREVIEW_SIZE = 1024   # [pixels], longest side of the image read for landsat previews
+
+# one background thread draws and writes previews, so they stay off the calibration's critical path
+_WRITER = None
+
+
+def preview_async(draw, args, preview_file):
+    """
+    Draw a preview and write it to a jpeg, in a background thread.
+
+    Args:
+        draw: function returning the image, i.e. draw_landsat_preview
+        args: arguments of draw, already downloaded data
+        preview_file: jpeg to write
+
+    Returns:
+        concurrent.futures.Future of the image, raises what draw raised
+    """
+    global _WRITER
+    if _WRITER is None:
+        _WRITER = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _write():
+        image = draw(*args)
+        cv2.imwrite(preview_file, image)
+        return image
+
+    return _WRITER.submit(_write)
+
+
 def modis_preview(scene_id):
     overpass_date, directory, metadata, [granule_filepath, geo_ref_filepath] = sat.modis.download(scene_id)
 
+    return draw_modis_preview(metadata, granule_filepath, geo_ref_filepath)
+
+
+def draw_modis_preview(metadata, granule_filepath, geo_ref_filepath):
+    """ modis_preview of a downloaded granule """
     corners = sat.modis.corners(metadata)
     #print(corners)
     buoys = buoy.datasets_in_corners(corners)
 
     ds = gdal.Open(granule_filepath)
     
-    emissive_bands = gdal.Open(ds.GetSubDatasets()[2][0])
+    emissive_bands = gdal.Open(sat.geoindex.subdataset(ds.GetSubDatasets(), 'EV_1KM_Emissive', 2))
     
     band_names = emissive_bands.GetMetadata()['band_names'].split(',')
     band2idx_map = {int(b):i for i, b in enumerate(band_names)}
 
-    # read data in to numpy array form
-    emissive_data = emissive_bands.ReadAsArray()
+    # read only the band that is drawn in to numpy array form
+    image = emissive_bands.GetRasterBand(band2idx_map[32] + 1).ReadAsArray()
 
-    # geo reference file (matching MOD03 product)       
-    geo_reference_ds = gdal.Open(geo_ref_filepath)
-    geo_reference_sds = geo_reference_ds.GetSubDatasets()
+    # geo reference file (matching MOD03 product)
+    index = sat.geoindex.load(geo_ref_filepath)
 
-    # these are the latitude and longitude sub data sets
-    lat_ds = gdal.Open(geo_reference_sds[12][0])
-    lon_ds = gdal.Open(geo_reference_sds[13][0])
-    lat = lat_ds.ReadAsArray()
-    lon = lon_ds.ReadAsArray()
-
-    buoy_points = [(buoy.all_datasets()[ds].lat, buoy.all_datasets()[ds].lon) for ds in buoys]
-    buoy_pixels = modis_latlon2pixel(lat, lon, buoy_points)
+    buoy_points = [(buoys[ds].lat, buoys[ds].lon) for ds in buoys]
+    buoy_pixels = modis_latlon2pixel(index, buoy_points)
     #print(buoy_points)
     #print(buoy_pixels)
 
@@ -51,11 +80,10 @@ def modis_preview(scene_id):
     mask = numpy.where((lat_min < merra_lat) & (merra_lat < lat_max) & (lon_min < merra_lon) & (merra_lon < lon_max))
     #print(merra_lat[mask].max(), merra_lat[mask].min(), merra_lon[mask].max(), merra_lon[mask].min())
     merra_points = list(zip(merra_lat[mask].flatten(), merra_lon[mask].flatten()))
-    merra_pixels = modis_latlon2pixel(lat, lon, merra_points)
+    merra_pixels = modis_latlon2pixel(index, merra_points)
     #print(merra_pixels[::5])
     #print(merra_points[::5])
 
-    image = emissive_data[band2idx_map[32], :, :]
     rr = int(max(image.shape) / 100)
     #import pdb; pdb.set_trace()
     image[image==0] = image[image!=0].mean()
@@ -69,20 +97,27 @@ def modis_preview(scene_id):
     return image
 
 
-def modis_latlon2pixel(lat, lon, points):
-    pixels = []
-    for lat_oi, lon_oi in points:
-        distances = (lat - lat_oi)**2 + (lon - lon_oi)**2
-        poi_c, poi_r = numpy.unravel_index(numpy.argmin(distances), lat.shape)
-        pixels.append((poi_r, poi_c))
-    return pixels
+def modis_latlon2pixel(index, points):
+    """ closest swath pixel to each (lat, lon) point, as (column, row) for drawing. """
+    if len(points) == 0:
+        return []
+
+    lats, lons = zip(*points)
+    rows, cols, __ = index.query(lats, lons)
+    return [(int(c), int(r)) for r, c in zip(rows, cols)]
 
 
-def landsat_preview(scene_id, buoy_id, source='merra', preview_file='landsat_preview.jpg'):
+def landsat_preview(scene_id, buoy_id, source='merra', preview_file='landsat_preview.jpg', remote=False):
     # get scene visible image
 
-    date, directory, metadata = sat.landsat.download(scene_id, ['10'])
-    image_file = glob.glob('{0}/*_B10.TIF'.format(directory))[0]
+    date, directory, metadata = sat.landsat.download(scene_id, ['10'], remote=remote)
+
+    return draw_landsat_preview(directory, metadata)
+
+
+def draw_landsat_preview(directory, metadata):
+    """ landsat_preview of a downloaded (or remote) scene """
+    image_file = directory + '/' + metadata['FILE_NAME_BAND_10']
     #print(image_file)
 
     # TODO narr or merra
@@ -98,19 +133,29 @@ def landsat_preview(scene_id, buoy_id, source='merra', preview_file='landsat_pre
     #print(corners, buoys)
     #ds = buoy.all_datasets()[buoy_id]
 
-    dataset = gdal.Open(image_file)
+    dataset = sat.landsat.open_image(image_file)
     geotransform = dataset.GetGeoTransform()   # get data transform
-    merra_pixels = [latlon_to_pizel(geotransform, *p, metadata['UTM_ZONE']) for p in points_to_draw]
+
+    # read a reduced resolution image, gdal uses the overviews when there are any,
+    # so a remote image is previewed without fetching the full resolution tiles
+    scale = PREVIEW_SIZE / max(dataset.RasterXSize, dataset.RasterYSize)
+    image = dataset.GetRasterBand(1).ReadAsArray(buf_xsize=int(dataset.RasterXSize * scale),
+                                                 buf_ysize=int(dataset.RasterYSize * scale))
+
+    def _scale(pixels):
+        return [(int(r * scale), int(c * scale)) for r, c in pixels]
+
+    merra_pixels = _scale(latlon_to_pixels(geotransform, points_to_draw, metadata['UTM_ZONE']))
 
     #print(corners)
-    buoy_pixels = [latlon_to_pizel(geotransform, buoy.all_datasets()[ds].lat, buoy.all_datasets()[ds].lon, metadata['UTM_ZONE']) for ds in buoys]
+    buoy_pixels = _scale(latlon_to_pixels(geotransform, [(buoys[ds].lat, buoys[ds].lon) for ds in buoys], metadata['UTM_ZONE']))
     buoy_ids = [ds for ds in buoys]
-    image = cv2.imread(image_file, 0)
+    rr = max(int(100 * scale), 1)
     image[image==0] = image[image!=0].mean()
-    image = cv2.equalizeHist(image)
+    image = cv2.equalizeHist((image / 256).astype(numpy.uint8))  # 16 bits to 8 bits
     image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-    image = draw_points(image, [None]*len(merra_pixels), merra_pixels)
-    image = draw_points(image, buoy_ids, buoy_pixels, color=(0,0,255))
+    image = draw_points(image, [None]*len(merra_pixels), merra_pixels, r=rr)
+    image = draw_points(image, buoy_ids, buoy_pixels, color=(0,0,255), r=rr)
     image = cv2.resize(image, (512,512))
 
     return image
@@ -172,6 +217,21 @@ def latlon_to_pizel(geotransform, lat, lon, zone):
     return row, column
 
 
+def latlon_to_pixels(geotransform, points, zone):
+    """ latlon_to_pizel for a list of (lat, lon) points, with one transform per utm zone. """
+    if len(points) == 0:
+        return []
+
+    lats, lons = zip(*points)
+    l_x, l_y = img.latlon_to_utm_array(lats, lons, zone)
+
+    # calculate pixel locations: http://www.gdal.org/gdal_datamodel.html
+    rows = ((l_x - geotransform[0]) / geotransform[1]).astype(int)   # latitude
+    columns = ((l_y - geotransform[3]) / geotransform[5]).astype(int)   # longitude
+
+    return [(int(r), int(c)) for r, c in zip(rows, columns)]
+
+
 def point_in_corners(corners, point):
     ur_lat, ll_lat, ur_lon, ll_lon = corners
     lat, lon = point
@@ -1,82 +1,253 @@
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import fcntl
+import ftplib
 import gzip
 import os
 import re
 import shutil
 import tarfile
+import threading
 import urllib.error
 import urllib.parse
 import urllib.request
 import warnings
 
-import requests
+from . import (instrument, store)
 
-CHUNK = 1024 * 1024 * 8   # 1 MB
+CHUNK = 1024 * 1024 * 8   # 8 MB
+TIMEOUT = 60   # [s], connect and read timeout for http requests
+POOL_SIZE = 16   # connections kept open per host by the shared session
+WORKERS = 4   # default number of concurrent downloads
 
 
 class RemoteFileException(Exception):
     pass
 
 
+_session = None
+_session_lock = threading.Lock()
+
+# one lock per destination file, so two threads never write the same file
+_file_locks = collections.defaultdict(threading.Lock)
+_file_locks_lock = threading.Lock()
+
+
+def session():
+    """ shared requests session, keeps connections to each host open between downloads. """
+    global _session
+    import requests   # on first use, most runs find their files already downloaded
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+
+    return _session
+
+
+@contextlib.contextmanager
+def file_lock(filepath):
+    """
+    hold an exclusive lock on filepath, between threads and between processes.
+
+    The lock is filepath + '.lock', it only exists while the lock is held.
+    """
+    with _file_locks_lock:
+        thread_lock = _file_locks[filepath]
+
+    lock_path = filepath + '.lock'
+
+    with thread_lock:
+        while True:
+            lock = open(lock_path, 'a')
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            # the last holder removes the lock file on release, a process that was
+            # waiting on the removed file tries again on the current one
+            try:
+                if os.path.samestat(os.fstat(lock.fileno()), os.stat(lock_path)):
+                    break
+            except FileNotFoundError:
+                pass
+            lock.close()
+
+        try:
+            yield
+        finally:
+            os.remove(lock_path)
+            lock.close()   # releases the flock
+
+
+@instrument.timed()
 def url_download(url, out_dir, _filename=None, auth=None):
     """ download a file (ftp or http), optional auth in (user, pass) format """
 
-    if not os.path.exists(out_dir):
-        os.makedirs(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
 
     filename = _filename if _filename else url.split('/')[-1]
     filepath = os.path.join(out_dir, filename)
 
-    if os.path.isfile(filepath):
+    manifest = store.default()
+
+    if os.path.isfile(filepath) and manifest.check(filepath):
+        manifest.use(filepath)
         return filepath
 
-    if url[0:3] == 'ftp':
-        download_ftp(url, filepath)
-    else:
-        download_http(url, filepath, auth)
+    with file_lock(filepath):
+        # another thread or process may have finished it while we waited
+        if os.path.isfile(filepath) and manifest.check(filepath):
+            manifest.use(filepath)
+            return filepath
+
+        # failed verification (i.e. truncated or modified), download again
+        if os.path.isfile(filepath):
+            os.remove(filepath)
+
+        if url[0:3] == 'ftp':
+            download_ftp(url, filepath)
+        else:
+            download_http(url, filepath, auth)
+
+        manifest.record(filepath, url)
+        manifest.use(filepath)
 
     return filepath
 
 
-def download_http(url, filepath, auth=None):
-    """ download a http or https resource using requests. """
-    with requests.Session() as session:
-        req = session.request('get', url)
+def download_many(downloads, workers=WORKERS):
+    """
+    Download many files concurrently with a bounded pool of workers.
+
+    Args:
+        downloads: iterable of (url, out_dir) or (url, out_dir, filename, auth) tuples,
+            the same arguments as url_download
+        workers: maximum number of downloads in flight
+
+    Returns:
+        list of filepaths, in the same order as downloads
+
+    Raises:
+        the first exception raised by a download, after all of them have finished
+    """
+    downloads = list(downloads)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(workers, len(downloads)))) as pool:
+        # in copies of this context, files are pinned to the caller's store.job
+        futures = [pool.submit(contextvars.copy_context().run, url_download, *d) for d in downloads]
+        concurrent.futures.wait(futures)
 
-        if auth:
-            resource = session.get(req.url, auth=auth)
+    return [f.result() for f in futures]
 
-            if resource.status_code != 200:
-                raise RemoteFileException('url: {0} does not exist'.format(url))
+
+def download_http(url, filepath, auth=None, retry=True):
+    """
+    Stream a http or https resource to disk using the shared session.
+
+    The body is written in chunks to filepath + '.part', which is renamed to
+    filepath once complete. A .part file left by an interrupted download is
+    resumed with a Range request. retry: start over once, without the .part,
+    when the server cannot resume it.
+    """
+    part = filepath + '.part'
+    s = session()
+
+    if auth:
+        # data behind a login server (i.e. NASA earthdata) redirects to the login page first,
+        # the credentials are sent there and it redirects back to the data
+        with s.get(url, stream=True, timeout=TIMEOUT) as resp:
+            url = resp.url
+
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    # ask for the bytes as stored, so Content-Length and Range count the bytes written
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = 'bytes={0}-'.format(offset)
+
+    with s.get(url, auth=auth, headers=headers, stream=True, timeout=TIMEOUT) as resp:
+        if resp.status_code == 416 and offset and retry:   # nothing left to send, or a stale .part
+            resp.close()
+            _remove(part)
+            return download_http(url, filepath, auth, retry=False)
+        elif resp.status_code == 206:   # server honored the range, append
+            mode = 'ab'
+        elif resp.status_code == 200:   # whole file, start over
+            mode = 'wb'
         else:
-            if not _remote_file_exists(url, auth):
-                raise RemoteFileException('url: {0} does not exist'.format(url))
+            raise RemoteFileException('url: {0} does not exist'.format(url))
 
-            resource = session.get(req.url)
+        # requests decodes a compressed body, its length is not the Content-Length,
+        # and a range of it cannot be appended to the decoded bytes already written
+        encoded = resp.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+        if encoded and mode == 'ab':
+            if not retry:
+                raise RemoteFileException('url: {0} sent a compressed range'.format(url))
+            resp.close()
+            _remove(part)
+            return download_http(url, filepath, auth, retry=False)
 
-        with open(filepath, 'wb') as f:
-            f.write(resource.content)
+        expected = None if encoded else resp.headers.get('Content-Length')
+
+        with open(part, mode) as f:
+            written = 0
+            for chunk in resp.iter_content(CHUNK):
+                f.write(chunk)
+                written += len(chunk)
+
+    if expected is not None and written != int(expected):
+        raise RemoteFileException('url: {0} download incomplete, {1} of {2} bytes'.format(url, written, expected))
+
+    os.replace(part, filepath)
 
     return filepath
 
 
 def download_ftp(url, filepath):
-    """ download an FTP resource. """
+    """ download an FTP resource, resuming from filepath + '.part' if it exists. """
+    parsed = urllib.parse.urlparse(url)
+    part = filepath + '.part'
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+
     try:
-        request = urllib.request.urlopen(url)
-    except urllib.error.URLError as e:
-        print(url)
-        raise RemoteFileException('url: {0} does not exist'.format(url))
+        with ftplib.FTP(parsed.hostname, timeout=TIMEOUT) as ftp:
+            ftp.login()
+            ftp.voidcmd('TYPE I')   # binary mode, for SIZE and REST
 
-    with open(filepath, 'wb') as fileobj:
-        while True:
-            chunk = request.read(CHUNK)
-            if not chunk:
-                break
-            fileobj.write(chunk)
+            try:
+                size = ftp.size(parsed.path)
+            except ftplib.error_perm:   # no SIZE command, a missing file fails on RETR
+                size = None
+
+            # without a size the .part cannot be checked, start over
+            if size is None or offset > size:
+                offset = 0
+
+            with open(part, 'ab' if offset else 'wb') as fileobj:
+                if size is None or offset < size:
+                    ftp.retrbinary('RETR ' + parsed.path, fileobj.write, blocksize=CHUNK, rest=offset or None)
+    except (ftplib.Error, OSError) as e:
+        raise RemoteFileException('url: {0} does not exist ({1})'.format(url, e))
+
+    if size is not None and os.path.getsize(part) != size:
+        raise RemoteFileException('url: {0} download incomplete'.format(url))
+
+    os.replace(part, filepath)
 
     return filepath
 
 
+def _remove(filepath):
+    """ remove a file, if it is there """
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+
 def ungzip(filepath):
     """ un-gzip a fiile (equivalent `gzip -d filepath`) """
     new_filepath = filepath.replace('.gz', '')
@@ -99,13 +270,66 @@ def untar(filepath, directory):
     return directory
 
 
+def open_text(filepath):
+    """
+    Open a text file for reading, decompressing on the fly if it is gzipped.
+
+    Some NOAA files named .gz are not compressed, so the gzip header is
+    checked rather than the extension.
+    """
+    with open(filepath, 'rb') as f:
+        magic = f.read(2)
+
+    if magic == b'\x1f\x8b':
+        return gzip.open(filepath, 'rt')
+
+    return open(filepath, 'r')
+
+
+def untar_stream(fileobj, directory, suffixes=None):
+    """
+    Extract the members of a tar (or tar.gz) archive while it is being read.
+
+    The archive is read once, front to back, so it can come straight from an
+    http response: no .tar.gz or .tar copy is written, only the members kept.
+
+    Args:
+        fileobj: binary stream of the archive
+        directory: where to write the members (flattened to their file names)
+        suffixes: only extract members whose name ends with one of these, None for all
+
+    Returns:
+        list of the extracted filepaths
+    """
+    os.makedirs(directory, exist_ok=True)
+    extracted = []
+
+    with tarfile.open(fileobj=fileobj, mode='r|*') as tf:
+        for member in tf:
+            name = os.path.basename(member.name)
+
+            if not member.isfile() or (suffixes and not name.endswith(tuple(suffixes))):
+                continue
+
+            filepath = os.path.join(directory, name)
+
+            with tf.extractfile(member) as f_in, open(filepath + '.part', 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, CHUNK)
+            os.replace(filepath + '.part', filepath)
+
+            extracted.append(filepath)
+
+    return extracted
+
+
 def _remote_file_exists(url, auth=None):
     """ Check if remote resource exists. does not work for FTP. """
     if auth:
-        resp = requests.get(url, auth=auth)
+        resp = session().get(url, auth=auth, stream=True, timeout=TIMEOUT)
+        resp.close()
         status = resp.status_code
     else:
-        status = requests.head(url).status_code
+        status = session().head(url, timeout=TIMEOUT).status_code
 
     if status != 200:
         return False
@@ -141,39 +365,53 @@ def connect_earthexplorer_no_proxy(username, password):
     return True
 
 
-def download_earthexplorer(url, filepath):
+@contextlib.contextmanager
+def _earthexplorer(url):
     """ 
-    Slightly lower level downloading implemenation that handles earthexplorer's redirection.
+    Open an earthexplorer download, following its redirection, and check it is an image archive.
     inspired by: https://github.com/olivierhagolle/LANDSAT-Download
     """ 
     try:
         req = urllib.request.urlopen(url)
     
-        #if downloaded file is html
-        if (req.info().get_content_type()=='text/html'):
-            raise RemoteFileException("error : file is in html and not an expected binary file, url: {0}".format(url))
-
-        #if file too small           
-        total_size = int(req.getheader('Content-Length').strip())
-        if (total_size<50000):
-           raise RemoteFileException("Error: The file is too small to be a Landsat Image, url: {0}".format(url))
+        try:
+            #if downloaded file is html
+            if (req.info().get_content_type()=='text/html'):
+                raise RemoteFileException("error : file is in html and not an expected binary file, url: {0}".format(url))
 
-        #download
-        CHUNK = 1024 * 1024 *8
+            #if file too small           
+            total_size = int(req.getheader('Content-Length').strip())
+            if (total_size<50000):
+               raise RemoteFileException("Error: The file is too small to be a Landsat Image, url: {0}".format(url))
 
-        with open(filepath, 'wb') as fp:
-            while True:
-                chunk = req.read(CHUNK)
-                if not chunk: break
-                fp.write(chunk)
+            yield req
+        finally:
+            req.close()
 
     except urllib.error.HTTPError as e:
         if e.code == 500:
             raise RemoteFileException("File doesn't exist url: {0}".format(url))
         else:
-            raise RemoteFileException("HTTP Error:" + e.code + url)
+            raise RemoteFileException("HTTP Error: {1} url: {0}".format(url, e.code))
     
     except urllib.error.URLError as e:
         raise RemoteFileException("URL Error: {1} url: {0}".format(url, e.reason))
 
+
+def download_earthexplorer(url, filepath):
+    """ Download an earthexplorer archive as is. """
+    with _earthexplorer(url) as req, open(filepath, 'wb') as fp:
+        shutil.copyfileobj(req, fp, CHUNK)
+
     return filepath
+
+
+def extract_earthexplorer(url, directory, suffixes=None):
+    """
+    Stream an earthexplorer .tar.gz and extract only the files needed, see untar_stream().
+
+    Returns:
+        list of the extracted filepaths
+    """
+    with _earthexplorer(url) as req:
+        return untar_stream(req, directory, suffixes)
@@ -1,9 +1,10 @@
 import numpy
 
-from . import (modtran, atmo, sat, radiance, settings)
+from . import (modtran, atmo, sat, radiance, settings, instrument)
 from .atmo import merra
 
 
+@instrument.timed()
 def error_bar(scene_id, buoy_id, skin_temp, skin_temp_std, overpass_date, buoy_lat, buoy_lon, rsrs, bands):
     atmos = merra.error_bar_atmos(overpass_date, buoy_lat, buoy_lon)
 
@@ -0,0 +1,375 @@
+"""
+Forward model of the buoys of a scene: landsat8(), modis(), or calibrate()
+by the format of the scene id. forward_model.py is its command line.
+"""
+import concurrent.futures
+import contextvars
+import os
+import warnings
+
+from . import (sat, buoy, atmo, radiance, modtran, settings, download, error_bar, interp, pipeline, instrument, store)
+
+import numpy
+
+# none: no preview, save: write preview_<scene_id>.jpg, show: also display it (needs a display)
+PREVIEW_MODES = ('none', 'save', 'show')
+
+BUOY_WORKERS = 4   # buoys of a scene processed at once, each mostly waits on downloads and MODTRAN
+
+
+def _buoy_stages(p, scene_id, buoy_id, atmo_source, verbose, rsrs, load_rsr, skin_temp_std, image_ltoa, image_code, provider, asynchronous=False):
+    """
+    Add the stages of one buoy to the pipeline of a scene:
+    buoy state -> atmosphere -> MODTRAN -> modeled ltoa, and image ltoa and error.
+
+    Args:
+        p: Pipeline with a 'scene' stage, output (overpass_date, directory, metadata, ...)
+        rsrs: band -> RSR file, in band order
+        load_rsr: function RSR file -> (wavelengths, RSR)
+        skin_temp_std: skin temperature uncertainty, for the error bar
+        image_ltoa: function (scene, buoy_lat, buoy_lon) -> ({band: ltoa}, {band: std of ltoa around the buoy}),
+            the std empty for a sensor without one
+        image_code: modules implementing image_ltoa
+        provider: atmo.provider.AtmosphereProvider, shared by the buoys
+        asynchronous: MODTRAN runs as an asyncio subprocess, for Pipeline.run_async
+    """
+    if atmo_source == 'merra':
+        atmo_module = atmo.merra
+    elif atmo_source == 'narr':
+        atmo_module = atmo.narr
+    else:
+        raise ValueError('atmo_source is not one of (narr, merra)')
+
+    bands = list(rsrs)
+    rsr_files = [rsrs[b] for b in bands]
+
+    def _buoy_file(scene):
+        return buoy.download(buoy_id, scene[0])
+
+    def _buoy_state(scene, buoy_file):
+        return buoy.info(buoy_id, buoy_file, scene[0])
+
+    def _atmosphere(scene, state):
+        return provider.process(atmo_source, scene[0], state[0], state[1], verbose)
+
+    def _modtran(scene, state, atmosphere):
+        buoy_lat, buoy_lon, buoy_depth, bulk_temp, skin_temp, lower_atmo = state
+        modtran_directory = '{0}/{1}_{2}'.format(settings.MODTRAN_DIR, scene_id, buoy_id)
+        return modtran.process(atmosphere, buoy_lat, buoy_lon, scene[0], modtran_directory, skin_temp)
+
+    async def _modtran_async(scene, state, atmosphere):
+        buoy_lat, buoy_lon, buoy_depth, bulk_temp, skin_temp, lower_atmo = state
+        modtran_directory = '{0}/{1}_{2}'.format(settings.MODTRAN_DIR, scene_id, buoy_id)
+        return await modtran.process_async(atmosphere, buoy_lat, buoy_lon, scene[0], modtran_directory, skin_temp)
+
+    def _modeled_ltoa(state, modtran_output):
+        wavelengths, upwell_rad, gnd_reflect, transmission = modtran_output
+        mod_ltoa_spectral = radiance.calc_ltoa_spectral(wavelengths, upwell_rad, gnd_reflect, transmission, state[4])
+
+        mod_ltoa = {}
+        for b in bands:
+            RSR_wavelengths, RSR = load_rsr(rsrs[b])
+            mod_ltoa[b] = radiance.calc_ltoa(wavelengths, mod_ltoa_spectral, RSR_wavelengths, RSR)
+        return mod_ltoa
+
+    def _image_ltoa(scene, state):
+        return image_ltoa(scene, state[0], state[1])
+
+    def _error(scene, state):
+        buoy_lat, buoy_lon, buoy_depth, bulk_temp, skin_temp, lower_atmo = state
+        return error_bar.error_bar(scene_id, buoy_id, skin_temp, skin_temp_std, scene[0], buoy_lat, buoy_lon, rsrs, bands)
+
+    modtran_files = [settings.HEAD_FILE_TEMP, settings.TAIL_FILE_TEMP, settings.STAN_ATMO]
+
+    # the download checks its own cache, it always runs so the buoy state sees a replaced
+    # file (i.e. NDBC realtime data replaced by the historical file)
+    p.add('buoy_file:' + buoy_id, _buoy_file, deps=['scene'], cache=False, output_files=lambda buoy_file: [buoy_file])
+    p.add('buoy_state:' + buoy_id, _buoy_state, deps=['scene', 'buoy_file:' + buoy_id], code=[buoy])
+    p.add('atmosphere:' + buoy_id, _atmosphere, deps=['scene', 'buoy_state:' + buoy_id],
+          params={'source': atmo_source, 'subset': settings.ATMO_SUBSET},
+          code=[atmo_module, atmo.provider, atmo.columns, atmo.data, atmo.funcs, interp])
+    p.add('modtran:' + buoy_id, _modtran_async if asynchronous else _modtran, deps=['scene', 'buoy_state:' + buoy_id, 'atmosphere:' + buoy_id],
+          files=modtran_files, code=[modtran])
+    p.add('modeled_ltoa:' + buoy_id, _modeled_ltoa, deps=['buoy_state:' + buoy_id, 'modtran:' + buoy_id],
+          params={'bands': bands}, files=rsr_files + [settings.WATER_TXT], code=[radiance])
+    p.add('image_ltoa:' + buoy_id, _image_ltoa, deps=['scene', 'buoy_state:' + buoy_id],
+          params={'bands': bands}, code=image_code)
+    p.add('error:' + buoy_id, _error, deps=['scene', 'buoy_state:' + buoy_id],
+          params={'bands': bands, 'skin_temp_std': skin_temp_std},
+          files=rsr_files + modtran_files + [settings.WATER_TXT],
+          code=[error_bar, modtran, radiance, atmo.merra, atmo.columns])
+
+
+def _calibrate_buoy(p, buoy_id, overpass_date):
+    """
+    Run the stages of one buoy, in a worker thread.
+
+    Returns:
+        (result, None), or (None, warning message) when the buoy is skipped
+    """
+    try:
+        buoy_lat, buoy_lon, buoy_depth, bulk_temp, skin_temp, lower_atmo = p.run('buoy_state:' + buoy_id)
+    except download.RemoteFileException:
+        return None, 'Buoy {0} does not have data for this date.'.format(buoy_id)
+    except buoy.BuoyDataException as e:
+        return None, str(e)
+
+    try:
+        img_ltoa, img_ltoa_std = p.run('image_ltoa:' + buoy_id)
+    except RuntimeError as e:
+        return None, str(e)
+
+    mod_ltoa = p.run('modeled_ltoa:' + buoy_id)
+    error = p.run('error:' + buoy_id)
+
+    return (buoy_id, bulk_temp, skin_temp, buoy_lat, buoy_lon, mod_ltoa, error, img_ltoa, img_ltoa_std, overpass_date), None
+
+
+async def _calibrate_buoy_async(p, buoy_id, overpass_date):
+    """ _calibrate_buoy as a coroutine, with Pipeline.run_async """
+    import asyncio   # only the coroutines use the event loop
+
+    try:
+        buoy_lat, buoy_lon, buoy_depth, bulk_temp, skin_temp, lower_atmo = await p.run_async('buoy_state:' + buoy_id)
+    except download.RemoteFileException:
+        return None, 'Buoy {0} does not have data for this date.'.format(buoy_id)
+    except buoy.BuoyDataException as e:
+        return None, str(e)
+
+    try:
+        img_ltoa, img_ltoa_std = await p.run_async('image_ltoa:' + buoy_id)
+    except RuntimeError as e:
+        return None, str(e)
+
+    mod_ltoa, error = await asyncio.gather(p.run_async('modeled_ltoa:' + buoy_id), p.run_async('error:' + buoy_id))
+
+    return (buoy_id, bulk_temp, skin_temp, buoy_lat, buoy_lon, mod_ltoa, error, img_ltoa, img_ltoa_std, overpass_date), None
+
+
+def _add_buoys(p, corners):
+    p.add('buoys', lambda scene: buoy.datasets_in_corners(corners(scene[2])), deps=['scene'],
+          files=[settings.STATION_TXT, settings.BUOY_TXT], code=[buoy])
+
+
+def _collect(buoys, outcomes):
+    """ {buoy_id: result} of the buoys not skipped, from their (result, message), warnings are issued in buoy order """
+    data = {}
+
+    for buoy_id, (result, message) in zip(buoys, outcomes):
+        if message is not None:
+            warnings.warn(message, RuntimeWarning)
+            continue
+
+        data[buoy_id] = result
+
+    return data
+
+
+def _calibrate(p, scene_id, corners, atmo_source, verbose, rsrs, load_rsr, skin_temp_std, image_ltoa, image_code, workers, provider):
+    """
+    Run the stages of every buoy in the scene, workers buoys at once.
+
+    Returns:
+        {buoy_id: (buoy_id, bulk_temp, skin_temp, buoy_lat, buoy_lon, mod_ltoa, error, img_ltoa, overpass_date)}
+        in the order of the buoy list, whatever order the buoys finished in
+    """
+    _add_buoys(p, corners)
+
+    overpass_date = p.run('scene')[0]
+    buoys = p.run('buoys')
+
+    if not buoys:
+        raise buoy.BuoyDataException('no buoys in scene')
+
+    for buoy_id in buoys:
+        _buoy_stages(p, scene_id, buoy_id, atmo_source, verbose, rsrs, load_rsr, skin_temp_std, image_ltoa, image_code, provider)
+
+    # the atmospheres of every buoy are extracted together, when the first one is needed
+    provider.expect(atmo_source, [(overpass_date, buoys[b].lat, buoys[b].lon) for b in buoys])
+
+    # each buoy thread runs in a copy of this context, so its stages are recorded under the caller's instrument.job
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _calibrate_buoy, p, buoy_id, overpass_date)
+                   for buoy_id in buoys]
+
+    # warnings are issued here, in buoy order, not from the worker threads
+    return _collect(buoys, [f.result() for f in futures])
+
+
+async def _calibrate_async(p, scene_id, corners, atmo_source, verbose, rsrs, load_rsr, skin_temp_std, image_ltoa, image_code, provider):
+    """ _calibrate as a coroutine, every buoy at once, with the limits of aio """
+    import asyncio   # only the coroutines use the event loop
+    from . import aio
+
+    _add_buoys(p, corners)
+
+    overpass_date = (await p.run_async('scene'))[0]
+    buoys = await p.run_async('buoys')
+
+    if not buoys:
+        raise buoy.BuoyDataException('no buoys in scene')
+
+    for buoy_id in buoys:
+        _buoy_stages(p, scene_id, buoy_id, atmo_source, verbose, rsrs, load_rsr, skin_temp_std, image_ltoa, image_code,
+                     provider, asynchronous=True)
+
+    provider.expect(atmo_source, [(overpass_date, buoys[b].lat, buoys[b].lon) for b in buoys])
+
+    # the buoy files are fetched together, a missing one fails again in its buoy_state stage
+    await asyncio.gather(*[aio.url_download(buoy.url(b, overpass_date), settings.NOAA_DIR) for b in buoys],
+                         return_exceptions=True)
+
+    outcomes = await asyncio.gather(*[_calibrate_buoy_async(p, buoy_id, overpass_date) for buoy_id in buoys])
+
+    return _collect(buoys, outcomes)
+
+
+def _start_preview(preview, scene_id, draw, *args):
+    """ start drawing the preview of a downloaded scene in the background (draw: a display function name), unless preview is 'none' """
+    if preview not in PREVIEW_MODES:
+        raise ValueError('preview is not one of {0}'.format(PREVIEW_MODES))
+    if preview == 'none':
+        return None
+
+    from . import display   # OpenCV and GDAL, only when there is a preview
+
+    return display.preview_async(getattr(display, draw), args, 'preview_{0}.jpg'.format(scene_id))
+
+
+def _finish_preview(preview, title, future):
+    """ wait for the preview to be written, and show it. A failed preview does not fail the calibration. """
+    if future is None:
+        return
+
+    try:
+        image = future.result()
+    except Exception as e:
+        warnings.warn('preview failed: {0}'.format(e), RuntimeWarning)
+        return
+
+    if preview == 'show':
+        import cv2
+        cv2.imshow(title, image)
+        cv2.waitKey(50)
+
+
+def _modis_scene(scene_id, bands, force):
+    """ pipeline with the 'scene' stage of a MODIS granule, and the sensor arguments of _calibrate """
+    rsrs = {b:settings.RSR_MODIS[b] for b in bands}
+
+    def _image_ltoa(scene, buoy_lat, buoy_lon):
+        overpass_date, directory, metadata, [granule_filepath, geo_ref_filepath] = scene
+        img_ltoa, img_ltoa_std, units = sat.modis.calc_ltoa_direct(granule_filepath, geo_ref_filepath, buoy_lat, buoy_lon, bands)
+        return img_ltoa, img_ltoa_std
+
+    # the download checks its own cache, it always runs so the later stages see changed files
+    p = pipeline.Pipeline(force=force)
+    p.add('scene', lambda: sat.modis.download(scene_id), cache=False, output_files=lambda scene: scene[3])
+
+    return p, {'corners': sat.modis.corners, 'rsrs': rsrs, 'load_rsr': sat.modis.load_rsr, 'skin_temp_std': 0.35,
+               'image_ltoa': _image_ltoa, 'image_code': [sat.modis, sat.geoindex, sat.image_processing]}
+
+
+def _scene_files(scene):
+    """ the downloaded files of a landsat scene, none when its bands are read remotely """
+    directory = scene[1]
+    if not os.path.isdir(directory):
+        return []
+
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory))]
+
+
+def _landsat8_scene(scene_id, bands, remote, force):
+    """ pipeline with the 'scene' stage of a landsat 8 scene, and the sensor arguments of _calibrate """
+    rsrs = {b:settings.RSR_L8[b] for b in bands}
+
+    def _image_ltoa(scene, buoy_lat, buoy_lon):
+        overpass_date, directory, metadata = scene
+        return {b: sat.landsat.calc_ltoa(directory, metadata, buoy_lat, buoy_lon, b) for b in bands}, {}
+
+    # satelite download
+    # [:] thing is to shorthand to make a shallow copy
+    # remote reads only the windows around the buoys from S3, instead of the whole bands
+    p = pipeline.Pipeline(force=force)
+    p.add('scene', lambda: sat.landsat.download(scene_id, bands[:], remote=remote), cache=False, output_files=_scene_files)
+
+    return p, {'corners': sat.landsat.corners, 'rsrs': rsrs, 'load_rsr': lambda f: numpy.loadtxt(f, unpack=True),
+               'skin_temp_std': 0.305, 'image_ltoa': _image_ltoa, 'image_code': [sat.landsat, sat.image_processing]}
+
+
+def modis(scene_id, atmo_source='merra', verbose=False, bands=[31, 32], force=False, preview='show', workers=BUOY_WORKERS, atmosphere=None):
+    # the files of the scene are not evicted from the data store before the match-up is done
+    with store.job(scene_id):
+        return _modis(scene_id, atmo_source, verbose, bands, force, preview, workers, atmosphere)
+
+
+def _modis(scene_id, atmo_source, verbose, bands, force, preview, workers, atmosphere):
+    p, sensor = _modis_scene(scene_id, bands, force)
+
+    # the preview is drawn from the downloaded granule while the buoys are processed
+    overpass_date, directory, metadata, [granule_filepath, geo_ref_filepath] = p.run('scene')
+    future = _start_preview(preview, scene_id, 'draw_modis_preview', metadata, granule_filepath, geo_ref_filepath)
+
+    # every buoy looks up its pixel in the same swath index, build it once before they start
+    sat.geoindex.load(geo_ref_filepath)
+
+    try:
+        data = _calibrate(p, scene_id, atmo_source=atmo_source, verbose=verbose, workers=workers,
+                          provider=atmosphere or atmo.provider.AtmosphereProvider(), **sensor)
+    finally:
+        _finish_preview(preview, 'MODIS Preview', future)
+
+    return data
+
+
+def landsat8(scene_id, atmo_source='merra', verbose=False, bands=[10, 11], remote=False, force=False, preview='show', workers=BUOY_WORKERS, atmosphere=None):
+    # the files of the scene are not evicted from the data store before the match-up is done
+    with store.job(scene_id):
+        return _landsat8(scene_id, atmo_source, verbose, bands, remote, force, preview, workers, atmosphere)
+
+
+def _landsat8(scene_id, atmo_source, verbose, bands, remote, force, preview, workers, atmosphere):
+    p, sensor = _landsat8_scene(scene_id, bands, remote, force)
+
+    # the preview is drawn from the downloaded scene while the buoys are processed
+    overpass_date, directory, metadata = p.run('scene')
+    future = _start_preview(preview, scene_id, 'draw_landsat_preview', directory, metadata)
+
+    try:
+        return _calibrate(p, scene_id, atmo_source=atmo_source, verbose=verbose, workers=workers,
+                          provider=atmosphere or atmo.provider.AtmosphereProvider(), **sensor)
+    finally:
+        _finish_preview(preview, 'Landsat Preview', future)
+
+
+def calibrate(scene_id, atmo_source='merra', verbose=False, bands=None, remote=False, force=False, preview='show', workers=BUOY_WORKERS, atmosphere=None):
+    """ landsat8 or modis, by the format of scene_id, bands default to the thermal bands of the sensor """
+    if scene_id[0:3] in ('LC8', 'LC0'):   # Landsat 8
+        return landsat8(scene_id, atmo_source, verbose, bands or [10, 11], remote, force, preview, workers, atmosphere)
+
+    elif scene_id[0:3] == 'MOD':   # Modis
+        return modis(scene_id, atmo_source, verbose, bands or [31, 32], force=force, preview=preview, workers=workers, atmosphere=atmosphere)
+
+    raise ValueError('Scene ID is not a valid format for (landsat8, modis)')
+
+
+async def calibrate_async(scene_id, atmo_source='merra', verbose=False, bands=None, remote=False, force=False, atmosphere=None):
+    """
+    calibrate() as a coroutine, without a preview. The buoys of the scene
+    run at once, their downloads and MODTRAN runs limited by aio, so several
+    scenes can run together in one event loop:
+
+        data = await asyncio.gather(*[calibrate_async(s) for s in scene_ids])
+    """
+    if scene_id[0:3] in ('LC8', 'LC0'):   # Landsat 8
+        p, sensor = _landsat8_scene(scene_id, bands or [10, 11], remote, force)
+
+    elif scene_id[0:3] == 'MOD':   # Modis
+        p, sensor = _modis_scene(scene_id, bands or [31, 32], force)
+
+    else:
+        raise ValueError('Scene ID is not a valid format for (landsat8, modis)')
+
+    with store.job(scene_id):
+        return await _calibrate_async(p, scene_id, atmo_source=atmo_source, verbose=verbose,
+                                      provider=atmosphere or atmo.provider.AtmosphereProvider(), **sensor)
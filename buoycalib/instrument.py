@@ -0,0 +1,220 @@
+"""
+Timing and resource use of the stages of the forward model.
+
+Functions decorated with @timed() (downloads, atmosphere extraction,
+MODTRAN, image radiance, error bars) record for each call:
+
+    wall: [s] elapsed time
+    cpu: [s] CPU time of the calling thread
+    child_cpu: [s] CPU time of the finished child processes (i.e. MODTRAN),
+        of the whole process: other threads' children are included when
+        stages run concurrently
+    bytes_read: bytes read by the calling thread (rchar of /proc/thread-self/io,
+        files and sockets), None where /proc is not available
+    peak_rss: [bytes] peak resident memory of the process so far
+
+Records are summed by stage, and by job (the scene being processed, see
+job()), and reported as JSON or Prometheus text. A stage called from
+another (i.e. a download during the atmosphere extraction) is counted in both.
+
+Usage:
+    with instrument.job(scene_id):
+        forward_model.landsat8(scene_id)
+    instrument.write('metrics.json')   # or 'metrics.prom'
+"""
+import contextlib
+import contextvars
+import copy
+import functools
+import json
+import resource
+import sys
+import threading
+import time
+
+ENABLED = True
+
+FIELDS = ('wall', 'cpu', 'child_cpu', 'bytes_read')
+
+_JOB = contextvars.ContextVar('job', default=None)
+
+_lock = threading.Lock()
+_stages = {}   # stage -> totals
+_jobs = {}   # job -> stage -> totals
+
+
+def _io_path():
+    for path in ('/proc/thread-self/io', '/proc/self/io'):
+        try:
+            with open(path):
+                return path
+        except OSError:
+            pass
+    return None
+
+
+_IO = _io_path()
+
+
+def bytes_read():
+    """ bytes read so far by this thread (or process, on older kernels), None without /proc """
+    if _IO is None:
+        return None
+
+    with open(_IO) as f:
+        for line in f:
+            if line.startswith('rchar:'):
+                return int(line.split()[1])
+    return None
+
+
+def peak_rss():
+    """ [bytes] peak resident memory of this process """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024   # kB on linux
+
+
+def _totals():
+    return {'count': 0, 'errors': 0, 'wall': 0.0, 'cpu': 0.0, 'child_cpu': 0.0, 'bytes_read': 0, 'peak_rss': 0}
+
+
+def _add(totals, record, failed):
+    totals['count'] += 1
+    totals['errors'] += int(failed)
+    for field in FIELDS:
+        if record[field] is not None:
+            totals[field] += record[field]
+    totals['peak_rss'] = max(totals['peak_rss'], record['peak_rss'])
+
+
+def _child_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextlib.contextmanager
+def job(name):
+    """ attribute the stages run in this block (and in threads started with its context) to job name """
+    token = _JOB.set(name)
+    try:
+        yield
+    finally:
+        _JOB.reset(token)
+
+
+def current_job():
+    return _JOB.get()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """ record the resources used by the block as one call of stage name """
+    if not ENABLED:
+        yield
+        return
+
+    start = (time.perf_counter(), time.thread_time(), _child_cpu(), bytes_read())
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        end = (time.perf_counter(), time.thread_time(), _child_cpu(), bytes_read())
+        record = {'wall': end[0] - start[0], 'cpu': end[1] - start[1], 'child_cpu': end[2] - start[2],
+                  'bytes_read': end[3] - start[3] if start[3] is not None else None, 'peak_rss': peak_rss()}
+
+        with _lock:
+            _add(_stages.setdefault(name, _totals()), record, failed)
+            _add(_jobs.setdefault(_JOB.get(), {}).setdefault(name, _totals()), record, failed)
+
+
+def timed(name=None):
+    """ decorator, record each call of the function as a stage, named module.function by default """
+    def decorator(func):
+        stage_name = name or '{0}.{1}'.format(func.__module__.split('.', 1)[-1], func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    """
+    Returns:
+        {'stages': {stage: totals}, 'jobs': {job: {stage: totals}}, 'peak_rss': bytes}
+        stages run outside of a job are under the job None
+    """
+    with _lock:
+        return {'stages': copy.deepcopy(_stages), 'jobs': copy.deepcopy(_jobs), 'peak_rss': peak_rss()}
+
+
+def reset():
+    """ forget the records so far """
+    with _lock:
+        _stages.clear()
+        _jobs.clear()
+
+
+def merge(reports):
+    """ one report from the reports of several processes, i.e. batch workers """
+    merged = {'stages': {}, 'jobs': {}, 'peak_rss': 0}
+
+    def _merge(into, totals):
+        for field in ('count', 'errors') + FIELDS:
+            into[field] += totals[field]
+        into['peak_rss'] = max(into['peak_rss'], totals['peak_rss'])
+
+    for r in reports:
+        for name, totals in r['stages'].items():
+            _merge(merged['stages'].setdefault(name, _totals()), totals)
+        for j, stages in r['jobs'].items():
+            for name, totals in stages.items():
+                _merge(merged['jobs'].setdefault(j, {}).setdefault(name, _totals()), totals)
+        merged['peak_rss'] = max(merged['peak_rss'], r['peak_rss'])
+
+    return merged
+
+
+def prometheus(r=None):
+    """ a report as Prometheus text exposition, by stage (jobs are left out, there are too many) """
+    r = r if r is not None else report()
+
+    metrics = [
+        ('calls_total', 'count', 'counter', 'Calls of the stage.'),
+        ('errors_total', 'errors', 'counter', 'Calls of the stage that raised.'),
+        ('wall_seconds_total', 'wall', 'counter', 'Elapsed time in the stage.'),
+        ('cpu_seconds_total', 'cpu', 'counter', 'CPU time of the threads running the stage.'),
+        ('child_cpu_seconds_total', 'child_cpu', 'counter', 'CPU time of the child processes finished during the stage.'),
+        ('read_bytes_total', 'bytes_read', 'counter', 'Bytes read by the threads running the stage.'),
+        ('peak_rss_bytes', 'peak_rss', 'gauge', 'Peak resident memory of the process when the stage ended.'),
+    ]
+
+    lines = []
+    for suffix, field, kind, help_ in metrics:
+        metric = 'buoycalib_stage_' + suffix
+        lines.append('# HELP {0} {1}'.format(metric, help_))
+        lines.append('# TYPE {0} {1}'.format(metric, kind))
+        for name in sorted(r['stages']):
+            lines.append('{0}{{stage="{1}"}} {2}'.format(metric, name, r['stages'][name][field]))
+
+    lines.append('# HELP buoycalib_peak_rss_bytes Peak resident memory of the process.')
+    lines.append('# TYPE buoycalib_peak_rss_bytes gauge')
+    lines.append('buoycalib_peak_rss_bytes {0}'.format(r['peak_rss']))
+
+    return '\n'.join(lines) + '\n'
+
+
+def write(filepath, r=None):
+    """ write a report (default: this process's) as Prometheus text if filepath ends in .prom, JSON otherwise """
+    r = r if r is not None else report()
+
+    with open(filepath, 'w') as f:
+        if filepath.endswith('.prom'):
+            f.write(prometheus(r))
+        else:
+            # json keys are strings, the job of stages run outside of a job is "null"
+            json.dump({'stages': r['stages'], 'jobs': {str(j) if j is not None else 'null': s for j, s in r['jobs'].items()},
+                       'peak_rss': r['peak_rss']}, f, indent=2, sort_keys=True)
@@ -1,10 +1,11 @@
 import datetime
 import os
+import shlex
 import subprocess
 
 import numpy
 
-from . import settings
+from . import (instrument, settings)
 
 
 def process(atmosphere, lat, lon, date, directory, temperature):
@@ -33,6 +34,18 @@ def process(atmosphere, lat, lon, date, directory, temperature):
     return wavelengths, upwell_rad, gnd_reflect, transmission
 
 
+async def process_async(atmosphere, lat, lon, date, directory, temperature):
+    """ process() as a coroutine, modtran runs as an asyncio subprocess, see run_async """
+    make_tape5s(atmosphere, lat, lon, date, directory, temperature)
+
+    await run_async(directory)
+    tape6_filename = os.path.join(directory, 'tape6')
+
+    wavelengths, upwell_rad, gnd_reflect, total, transmission = parse_tape6(tape6_filename)
+
+    return wavelengths, upwell_rad, gnd_reflect, transmission
+
+
 def make_tape5s(profile, lat, lon, date, directory, temperature):
     """
     Write the profile to a tape5 file.
@@ -81,23 +94,44 @@ def make_tape5s(profile, lat, lon, date, directory, temperature):
         f.write(tail)
 
 
+@instrument.timed()
 def run(directory):
     """
     Run modtran in the specified directory.
 
+    The working directory of this process is left alone, so several buoys
+    can run modtran at once from different threads.
+
     Args:
         directory: location to run modtran from.
     """
-    current_dir = os.getcwd()
-    os.chdir(directory)
+    _link_data(directory)
 
     try:
-        subprocess.check_call('ln -sf %s' % settings.MODTRAN_DATA, shell=True)
-        subprocess.check_call(settings.MODTRAN_EXE, shell=True)
-    except subprocess.CalledProcessError:  # symlink already exists error
+        subprocess.check_call(settings.MODTRAN_EXE, shell=True, cwd=directory)
+    except subprocess.CalledProcessError:
         pass
 
-    os.chdir(current_dir)
+
+async def run_async(directory):
+    """ run() as a coroutine, at most aio.SUBPROCESSES programs at once in the event loop """
+    from . import aio   # only the coroutines use the event loop
+
+    _link_data(directory)
+
+    try:
+        await aio.run(shlex.split(settings.MODTRAN_EXE), cwd=directory)
+    except subprocess.CalledProcessError:
+        pass
+
+
+def _link_data(directory):
+    # modtran looks for its DATA directory in the directory it runs in
+    data_link = os.path.join(directory, os.path.basename(settings.MODTRAN_DATA))
+    try:
+        os.symlink(settings.MODTRAN_DATA, data_link)
+    except FileExistsError:   # linked by an earlier run
+        pass
 
 
 def parse_tape7scn(directory):
@@ -131,6 +165,7 @@ def parse_tape7scn(directory):
     return upwell_rad, downwell_rad, wvlen, trans, gnd_ref
 
 
+@instrument.timed()
 def parse_tape6(tape6_filename):
     """
     Parse modtran output file into needed quantities.
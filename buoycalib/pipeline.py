@@ -0,0 +1,265 @@
+"""
+A small graph of cached computation stages.
+
+Each stage is a function of the outputs of the stages it depends on. Its
+output is pickled under settings.PIPELINE_DIR, named by a key hashed from:
+
+    - the stage name and its params
+    - the source code of the modules the stage declares it uses, and of the
+      file its function is defined in
+    - the content of the data files it declares it reads
+    - the content hashes of the outputs of the stages it depends on, and the
+      size and mtime of the files those outputs refer to
+
+so a rerun loads every stage whose key did not change, and recomputes only
+what was invalidated, and what depends on it. A recomputed stage whose output
+is unchanged does not invalidate the stages after it.
+
+Usage:
+    p = Pipeline()
+    p.add('atmosphere', lambda state: atmo.merra.process(...), deps=['buoy_state'], code=[atmo.merra])
+    atmosphere = p.run('atmosphere')
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+import threading
+
+from . import settings
+
+
+class PipelineError(Exception):
+    pass
+
+
+class Stage(object):
+    """
+    One node of a Pipeline.
+
+    Args:
+        name: unique name, also the cache directory of the stage
+        func: called with the outputs of deps, in order
+        deps: names of the stages func takes as input
+        params: values func depends on besides its inputs (picklable, part of the key)
+        files: data files func reads (their content is part of the key)
+        code: modules implementing func (their source is part of the key)
+        cache: False to run the stage every time (i.e. downloads, which check
+            their own cache), the output is still hashed for the next stages
+        output_files: function output -> files the output refers to (i.e. downloaded
+            images), their size and mtime are part of the output's hash
+    """
+    def __init__(self, name, func, deps=(), params=None, files=(), code=(), cache=True, output_files=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params if params is not None else {}
+        self.files = list(files)
+        self.code = list(code)
+        self.cache = cache
+        self.output_files = output_files
+
+
+@functools.lru_cache(maxsize=None)
+def _file_hash(filepath, mtime_ns, size):
+    # keyed on mtime and size too, so an edited file is hashed again
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_hash(filepath):
+    """ sha256 of a file's content """
+    stat = os.stat(filepath)
+    return _file_hash(os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+
+
+def code_hash(module):
+    """ sha256 of the source file of a module (or of the source of a function) """
+    try:
+        return file_hash(inspect.getsourcefile(module))
+    except TypeError:
+        return hashlib.sha256(inspect.getsource(module).encode('utf-8')).hexdigest()
+
+
+def func_hash(func):
+    """ code_hash of the file a function is defined in (i.e. the closures of forward.py), '' without source """
+    while isinstance(func, functools.partial):
+        func = func.func
+
+    try:
+        return code_hash(func)
+    except (TypeError, OSError):   # builtins, functions typed in an interpreter
+        return ''
+
+
+def files_stamp(filepaths):
+    """ sha256 of the paths, sizes and mtimes of files, missing files are skipped """
+    h = hashlib.sha256()
+
+    for filepath in filepaths:
+        if os.path.isfile(filepath):
+            stat = os.stat(filepath)
+            h.update('{0}:{1}:{2}\n'.format(os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+class Pipeline(object):
+    """
+    Stages, and the outputs computed so far in this run.
+
+    run() may be called from several threads at once, i.e. one per buoy, a
+    stage shared by them is run once and the others wait for its output.
+
+    Args:
+        directory: where stage outputs are persisted, default settings.PIPELINE_DIR
+        force: ignore persisted outputs, recompute (and save) every stage
+    """
+    def __init__(self, directory=None, force=False):
+        self.directory = directory if directory is not None else settings.PIPELINE_DIR
+        self.force = force
+
+        self.stages = {}
+        self.locks = {}   # name -> lock held while the stage runs
+        self._async_locks = {}   # name -> asyncio lock held while the stage runs, see run_async
+        self.outputs = {}   # name -> output, of the stages run so far
+        self.hashes = {}   # name -> content hash of the output
+        self.computed = []   # names of the stages that were (re)computed, in order
+
+    def add(self, name, func, deps=(), params=None, files=(), code=(), cache=True, output_files=None):
+        """ add a stage, see Stage for the arguments """
+        if name in self.stages:
+            raise PipelineError('stage already exists: {0}'.format(name))
+
+        self.stages[name] = Stage(name, func, deps, params, files, code, cache, output_files)
+        self.locks[name] = threading.Lock()
+        return self
+
+    def key(self, name):
+        """ cache key of a stage, its dependencies must have been run """
+        stage = self.stages[name]
+
+        h = hashlib.sha256()
+        h.update(name.encode('utf-8'))
+        h.update(pickle.dumps(sorted(stage.params.items()), protocol=4))
+        h.update(func_hash(stage.func).encode('utf-8'))
+        for module in stage.code:
+            h.update(code_hash(module).encode('utf-8'))
+        for filepath in stage.files:
+            h.update(file_hash(filepath).encode('utf-8'))
+        for dep in stage.deps:
+            h.update(self.hashes[dep].encode('utf-8'))
+
+        return h.hexdigest()
+
+    def path(self, name, key):
+        # stage names may hold a ':' and an id (i.e. 'modtran:44009'), keep them as directories
+        return os.path.join(self.directory, *name.split(':')) + '_' + key[:32] + '.pickle'
+
+    def run(self, name):
+        """
+        Get the output of a stage, running what it depends on first.
+
+        Outputs are loaded from disk when the stage's key is unchanged,
+        otherwise computed and saved. Exceptions raised by a stage are not
+        cached, they propagate to the caller.
+        """
+        if name in self.outputs:
+            return self.outputs[name]
+
+        if name not in self.stages:
+            raise PipelineError('no such stage: {0}'.format(name))
+
+        stage = self.stages[name]
+        inputs = [self.run(dep) for dep in stage.deps]
+
+        with self.locks[name]:
+            # another thread may have run it while this one waited
+            if name in self.outputs:
+                return self.outputs[name]
+
+            filepath, data = self._cached(name)
+            output = pickle.loads(data) if data is not None else stage.func(*inputs)
+
+            return self._keep(name, filepath, output, data)
+
+    async def run_async(self, name):
+        """
+        run() as a coroutine. The stages a stage depends on run concurrently,
+        stage functions that are coroutine functions are awaited, the others
+        run in a thread (aio.run_blocking). Outputs are loaded and saved like
+        run(), which should not run on the same pipeline at the same time.
+        """
+        import asyncio   # only run_async uses the event loop
+        from . import aio
+
+        if name in self.outputs:
+            return self.outputs[name]
+
+        if name not in self.stages:
+            raise PipelineError('no such stage: {0}'.format(name))
+
+        stage = self.stages[name]
+        inputs = await asyncio.gather(*[self.run_async(dep) for dep in stage.deps])
+
+        async with self._async_locks.setdefault(name, asyncio.Lock()):
+            # another coroutine may have run it while this one waited
+            if name in self.outputs:
+                return self.outputs[name]
+
+            filepath, data = await aio.run_blocking(self._cached, name)
+
+            if data is not None:
+                output = pickle.loads(data)
+            elif inspect.iscoroutinefunction(stage.func):
+                output = await stage.func(*inputs)
+            else:
+                output = await aio.run_blocking(stage.func, *inputs)
+
+            return await aio.run_blocking(self._keep, name, filepath, output, data)
+
+    def _cached(self, name):
+        """ (filepath, pickled output or None) of a stage whose dependencies have run """
+        stage = self.stages[name]
+        filepath = self.path(name, self.key(name))
+
+        if stage.cache and not self.force and os.path.isfile(filepath):
+            with open(filepath, 'rb') as f:
+                return filepath, f.read()
+
+        return filepath, None
+
+    def _keep(self, name, filepath, output, data):
+        """ record the output of a stage, and save it if it was computed (data is None) """
+        if data is None:
+            data = pickle.dumps(output, protocol=4)
+            self.computed.append(name)
+
+            if self.stages[name].cache:
+                # write then rename, so a crash never leaves a half written output,
+                # to a file of this run only, another process may save the same stage
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                fd, part = tempfile.mkstemp(suffix='.part', prefix=os.path.basename(filepath) + '.',
+                                            dir=os.path.dirname(filepath))
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    os.replace(part, filepath)
+                except BaseException:
+                    os.remove(part)
+                    raise
+
+        h = hashlib.sha256(data)
+        if self.stages[name].output_files is not None:
+            # i.e. a download to the same paths, of different files
+            h.update(files_stamp(self.stages[name].output_files(output)).encode('utf-8'))
+
+        self.hashes[name] = h.hexdigest()
+        self.outputs[name] = output
+
+        return output
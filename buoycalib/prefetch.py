@@ -0,0 +1,257 @@
+"""
+Download every input of a batch of scenes ahead of processing.
+
+For each scene the planner fetches the scene metadata first (the landsat MTL
+file or the MODIS granule), and once it is downloaded derives the rest of
+the urls it needs:
+image bands, the MOD03 geolocation, the buoy data file of each buoy in the
+scene and the atmospheric data. Urls shared between scenes (the same NARR
+month, the same buoy year) are only downloaded once.
+
+Downloads run in a pool of threads while the caller processes earlier
+scenes, so the network and the CPU are busy at the same time.
+"""
+import concurrent.futures
+import os
+import threading
+import warnings
+
+from . import (atmo, buoy, download, settings, store)
+from .sat import (landsat, modis)
+
+
+def landsat_downloads(scene_id, bands):
+    """ (url, directory) of each landsat band, plus the MTL file """
+    directory = settings.LANDSAT_DIR + '/' + scene_id
+    bands = [str(b) for b in bands]
+
+    if 'MTL' not in bands:
+        bands.append('MTL')
+
+    return [(landsat.amazon_s3_url(scene_id, band), directory) for band in bands]
+
+
+def atmo_downloads(date, atmo_source, points=()):
+    """
+    (url, directory, filename, auth) of the atmospheric data needed for date
+
+    With settings.ATMO_SUBSET, only the subsets around each (lat, lon) in points.
+    """
+    if settings.ATMO_SUBSET:
+        boxes = list(dict.fromkeys(atmo.subset.bbox(lat, lon) for lat, lon in points))
+
+        # error bars are always computed from MERRA
+        downloads = [atmo.subset.merra_download(date, box) for box in boxes]
+        if atmo_source == 'narr':
+            downloads += [d for box in boxes for d in atmo.subset.narr_downloads(date, box)]
+
+        return downloads
+
+    # error bars are always computed from MERRA
+    downloads = [(atmo.merra.url(date), settings.MERRA_DIR, None, settings.MERRA_LOGIN)]
+
+    if atmo_source == 'narr':
+        downloads += [(url, settings.NARR_DIR, None, None) for url in atmo.narr.urls(date)]
+
+    return downloads
+
+
+def buoy_downloads(buoy_ids, date):
+    """ (url, directory) of the data file of each buoy, for date """
+    return [(buoy.url(buoy_id, date), settings.NOAA_DIR) for buoy_id in buoy_ids]
+
+
+class Prefetcher(object):
+    """
+    Background downloader for a list of scenes.
+
+    Args:
+        scenes: scene ids, in the order they will be processed
+        atmo_source: 'merra' or 'narr'
+        bands: bands to fetch, defaults to the forward model defaults of each sensor
+        workers: concurrent downloads
+        lookahead: how many scenes past the one being processed to plan and download
+        remote: landsat bands are read over http (see landsat.download()), only fetch the MTL
+
+    Each scene is planned when its metadata (the MTL file, or the MODIS
+    granule) has downloaded, independently of the other scenes: the planner
+    only queues the metadata downloads, so a slow scene does not hold back
+    the planning of the next ones.
+
+    Files of a scene are pinned in the data store (so they are not evicted)
+    from when the scene is planned until release(scene_id).
+
+    Usage:
+        prefetcher = Prefetcher(scenes, 'merra').start()
+        for scene_id in scenes:
+            prefetcher.wait(scene_id)
+            ... process scene ...
+            prefetcher.release(scene_id)
+        prefetcher.close()
+    """
+    def __init__(self, scenes, atmo_source='merra', bands=None, workers=download.WORKERS, lookahead=4, remote=False):
+        self.scenes = list(scenes)
+        self.atmo_source = atmo_source
+        self.bands = bands
+        self.remote = remote
+
+        self._downloads = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._planner = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._window = threading.Semaphore(lookahead + 1)
+        self._closed = False
+
+        self._lock = threading.Lock()
+        self._files = {}   # filepath -> future, deduplicates downloads between scenes
+        self._scenes = {}   # scene_id -> future of (overpass date, buoy points, download futures)
+
+    def start(self):
+        for scene_id in self.scenes:
+            if scene_id not in self._scenes:
+                self._scenes[scene_id] = concurrent.futures.Future()
+                self._planner.submit(self._plan, scene_id)
+
+        return self
+
+    def fetch(self, url, out_dir, filename=None, auth=None):
+        """ queue one download (once per destination file), returns its future """
+        filepath = os.path.join(out_dir, filename if filename else url.split('/')[-1])
+
+        with self._lock:
+            if filepath not in self._files:
+                self._files[filepath] = self._downloads.submit(download.url_download, url, out_dir, filename, auth)
+
+            return self._files[filepath]
+
+    def _plan(self, scene_id):
+        """ queue the metadata download of a scene, the rest is planned when it arrives """
+        self._window.acquire()
+        planned = self._scenes[scene_id]
+
+        try:
+            if self._closed:
+                planned.set_result((None, [], []))
+                return
+
+            if scene_id[0:3] in ('LC8', 'LC0'):   # Landsat 8
+                downloads = landsat_downloads(scene_id, [] if self.remote else (self.bands or [10, 11]))
+                metadata = -1   # the MTL is last, it is small
+
+            elif scene_id[0:3] == 'MOD':   # Modis
+                downloads = [(modis.modis_url(scene_id), settings.MODIS_DIR + '/' + scene_id)]
+                metadata = 0   # the granule itself
+
+            else:
+                raise ValueError('Scene ID is not a valid format for (landsat8, modis)')
+
+            self._pin(scene_id, downloads)
+            futures = [self.fetch(*d) for d in downloads]
+        except Exception as e:
+            planned.set_exception(e)
+            return
+
+        futures[metadata].add_done_callback(lambda __: self._plan_buoys(scene_id, futures, futures[metadata]))
+
+    def _plan_buoys(self, scene_id, futures, metadata_future):
+        """ read the downloaded metadata of a scene, then queue the buoy and atmosphere data it needs """
+        planned = self._scenes[scene_id]
+
+        try:
+            if scene_id[0:3] == 'MOD':
+                metadata = modis.read_metadata(metadata_future.result())
+                date = modis.granule_date(scene_id)
+                corners = modis.corners(metadata)
+
+                downloads = [(modis.modis_url(modis.geo_reference(metadata)), settings.MODIS_DIR + '/' + scene_id)]
+            else:
+                metadata = landsat.read_metadata(metadata_future.result())
+                date = metadata['date']
+                corners = landsat.corners(metadata)
+
+                downloads = []
+
+            buoys = buoy.datasets_in_corners(corners)
+            points = [(buoys[b].lat, buoys[b].lon) for b in buoys]
+
+            downloads += buoy_downloads(buoys, date) + atmo_downloads(date, self.atmo_source, points)
+            self._pin(scene_id, downloads)
+            futures = futures + [self.fetch(*d) for d in downloads]
+        except Exception as e:
+            planned.set_exception(e)
+        else:
+            planned.set_result((date, points, futures))
+
+    def _pin(self, scene_id, downloads):
+        paths = [os.path.join(d[1], d[2] if len(d) > 2 and d[2] else d[0].split('/')[-1]) for d in downloads]
+        store.default().pin(paths, 'prefetch:' + scene_id)
+
+    def release(self, scene_id):
+        """ the scene is done, its files may be evicted again """
+        store.default().unpin('prefetch:' + scene_id)
+
+    def planned(self, scene_id):
+        """
+        Future of the plan of scene_id, done once its metadata is downloaded,
+        its result (overpass date, [(buoy lat, buoy lon), ...], download futures).
+
+        Returns:
+            the future, None for a scene not prefetched
+        """
+        return self._scenes.get(scene_id)
+
+    def points(self, scene_id):
+        """
+        Block until scene_id (only) is planned.
+
+        Returns:
+            (overpass date, [(buoy lat, buoy lon), ...]), or (None, []) if planning failed
+        """
+        planned = self.planned(scene_id)
+
+        if planned is None or planned.exception() is not None:
+            return None, []
+
+        return planned.result()[:2]
+
+    def wait(self, scene_id):
+        """
+        Block until every download of scene_id has finished.
+
+        Download errors are not raised here, the forward model will try
+        again (and fall back to other sources) when it runs.
+
+        Returns:
+            list of the exceptions raised by the scene's downloads
+        """
+        errors = []
+
+        if scene_id not in self._scenes:
+            return errors
+
+        try:
+            __, __, futures = self._scenes[scene_id].result()
+        except Exception as e:
+            futures = []
+            errors.append(e)
+        finally:
+            # let the planner move one scene further ahead
+            self._window.release()
+
+        for f in futures:
+            if f.exception() is not None:
+                errors.append(f.exception())
+
+        for e in errors:
+            warnings.warn('prefetch {0}: {1}'.format(scene_id, e), RuntimeWarning)
+
+        return errors
+
+    def close(self):
+        """ stop planning new scenes and wait for queued downloads """
+        self._closed = True
+
+        # unblock a planner waiting on the lookahead window
+        for __ in self.scenes:
+            self._window.release()
+
+        self._planner.shutdown(wait=True)
+        self._downloads.shutdown(wait=True)
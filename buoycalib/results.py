@@ -0,0 +1,305 @@
+"""
+Store of forward model results (match-ups), in SQLite.
+
+One row per (scene, buoy) match-up in `matchups`, and one row per band of
+it in `bands`, so any set of bands fits the same schema. Rows are only ever
+appended: running a scene again adds new rows, and queries return the
+newest match-up of each (scene, buoy, atmosphere source) unless asked for all
+of them.
+
+Each process writing to the store records a row in `runs` with where and
+from which code the results came (host, git commit, command line, settings).
+
+Usage:
+    results = ResultStore('results.sqlite')
+    results.add(scene_id, forward_model.landsat8(scene_id), 'merra', seconds=42.0)
+    rows = results.query(start=datetime.datetime(2017, 1, 1), buoy_id='44009', sensor='landsat8')
+    results.to_csv('results.txt')
+"""
+import contextlib
+import datetime
+import json
+import os
+import platform
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+
+from . import settings
+
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL,
+    host TEXT,
+    git TEXT,
+    argv TEXT,
+    settings TEXT
+);
+CREATE TABLE IF NOT EXISTS matchups (
+    id INTEGER PRIMARY KEY,
+    run INTEGER REFERENCES runs (id),
+    scene_id TEXT NOT NULL,
+    sensor TEXT NOT NULL,
+    date TEXT NOT NULL,
+    buoy_id TEXT NOT NULL,
+    buoy_lat REAL,
+    buoy_lon REAL,
+    bulk_temp REAL,
+    skin_temp REAL,
+    atmo_source TEXT,
+    seconds REAL,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    matchup INTEGER REFERENCES matchups (id),
+    band TEXT NOT NULL,
+    modeled_ltoa REAL,
+    image_ltoa REAL,
+    error REAL,
+    image_ltoa_std REAL,
+    PRIMARY KEY (matchup, band)
+);
+CREATE INDEX IF NOT EXISTS matchups_date ON matchups (date);
+CREATE INDEX IF NOT EXISTS matchups_buoy ON matchups (buoy_id, date);
+CREATE INDEX IF NOT EXISTS matchups_sensor ON matchups (sensor, date);
+CREATE INDEX IF NOT EXISTS matchups_scene ON matchups (scene_id, buoy_id, atmo_source);
+"""
+
+# statements bringing a store of schema version n to n + 1
+MIGRATIONS = {
+    1: ['ALTER TABLE bands ADD COLUMN image_ltoa_std REAL'],
+    2: ['DROP INDEX IF EXISTS matchups_scene',
+        'CREATE INDEX matchups_scene ON matchups (scene_id, buoy_id, atmo_source)'],
+}
+
+# columns of the rows returned by query(), in order
+COLUMNS = ['scene_id', 'sensor', 'date', 'buoy_id', 'buoy_lat', 'buoy_lon', 'bulk_temp', 'skin_temp',
+           'band', 'modeled_ltoa', 'image_ltoa', 'error', 'image_ltoa_std', 'atmo_source', 'seconds', 'run', 'matchup']
+
+CSV_HEADER = 'Scene_ID, Date, Buoy_ID, bulk_temp, skin_temp, buoy_lat, buoy_lon, mod1, mod2, img1, img2, error1, error2, img_std1, img_std2'
+
+
+class ResultStoreError(Exception):
+    pass
+
+
+def sensor(scene_id):
+    """ sensor name of a scene id """
+    if scene_id[0:3] in ('LC8', 'LC0'):
+        return 'landsat8'
+    elif scene_id[0:3] == 'MOD':
+        return 'modis'
+
+    raise ValueError('Scene ID is not a valid format for (landsat8, modis)')
+
+
+def git_commit():
+    """ commit of the checkout this code runs from, None outside of git """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def provenance():
+    """ where and how the results of this process are computed """
+    return {
+        'host': socket.gethostname(),
+        'git': git_commit(),
+        'argv': ' '.join(sys.argv),
+        'settings': {'python': platform.python_version(), 'atmo_subset': settings.ATMO_SUBSET,
+                     'modtran_exe': settings.MODTRAN_EXE},
+    }
+
+
+class ResultStore(object):
+    """
+    SQLite file of the forward model results.
+
+    Args:
+        path: sqlite file, default settings.RESULTS_DB
+    """
+    def __init__(self, path=None):
+        self.path = path if path is not None else settings.RESULTS_DB
+        self._run = None   # runs row of this process, added with the first results
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            db.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)', ('schema_version', str(SCHEMA_VERSION)))
+            version = int(db.execute('SELECT value FROM meta WHERE key = ?', ('schema_version',)).fetchone()[0])
+
+            while version in MIGRATIONS:
+                for statement in MIGRATIONS[version]:
+                    db.execute(statement)
+                version += 1
+                db.execute('UPDATE meta SET value = ? WHERE key = ?', (str(version), 'schema_version'))
+
+        if version != SCHEMA_VERSION:
+            raise ResultStoreError('{0} has schema version {1}, expected {2}'.format(self.path, version, SCHEMA_VERSION))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one short lived connection per call, like store.DataStore, so processes can share the file
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _run_id(self, db):
+        if self._run is not None:
+            return self._run
+
+        info = provenance()
+        return db.execute('INSERT INTO runs (started, host, git, argv, settings) VALUES (?, ?, ?, ?, ?)',
+                          (time.time(), info['host'], info['git'], info['argv'],
+                           json.dumps(info['settings'], sort_keys=True))).lastrowid
+
+    def add(self, scene_id, data, atmo_source, seconds=None):
+        """
+        Append the results of one scene.
+
+        Args:
+            scene_id: landsat or modis scene id
+            data: forward model output, {buoy_id: (buoy_id, bulk_temp, skin_temp, buoy_lat,
+                buoy_lon, mod_ltoa, error, img_ltoa, img_ltoa_std, overpass_date)}, img_ltoa_std
+                may leave out bands (i.e. landsat has none)
+            atmo_source: 'merra' or 'narr'
+            seconds: wall time the forward model of the scene took
+
+        Returns:
+            ids of the match-ups added, i.e. for query(matchup=...)
+        """
+        now = time.time()
+        matchups = []
+
+        with self._connect() as db:
+            run = self._run_id(db)
+
+            for buoy_id, bulk_temp, skin_temp, buoy_lat, buoy_lon, mod_ltoa, error, img_ltoa, img_ltoa_std, date in data.values():
+                matchup = db.execute('INSERT INTO matchups (run, scene_id, sensor, date, buoy_id, buoy_lat, buoy_lon, '
+                                     'bulk_temp, skin_temp, atmo_source, seconds, created) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (run, scene_id, sensor(scene_id), date.isoformat(), str(buoy_id), float(buoy_lat),
+                                      float(buoy_lon), float(bulk_temp), float(skin_temp), atmo_source, seconds,
+                                      now)).lastrowid
+                matchups.append(matchup)
+
+                db.executemany('INSERT INTO bands (matchup, band, modeled_ltoa, image_ltoa, error, image_ltoa_std) '
+                               'VALUES (?, ?, ?, ?, ?, ?)',
+                               [(matchup, str(b), float(mod_ltoa[b]), float(img_ltoa[b]), float(error[b]),
+                                 float(img_ltoa_std[b]) if b in img_ltoa_std else None)
+                                for b in mod_ltoa])
+
+        # only once committed, a failed add does not leave a run id that was rolled back
+        self._run = run
+
+        return matchups
+
+    def query(self, start=None, end=None, buoy_id=None, sensor=None, scene_id=None, band=None, matchup=None, latest=True):
+        """
+        Results matching every filter given, one row per band, by date.
+
+        Args:
+            start, end: datetimes, match-ups with start <= date < end
+            buoy_id, sensor, scene_id, band: a value, or a list of values
+            matchup: match-up ids, a value or a list of values, i.e. the ones add() returned
+            latest: only the newest match-up of each (scene, buoy, atmo_source)
+
+        Returns:
+            list of dicts, keys are COLUMNS, date is a datetime
+        """
+        where, args = [], []
+
+        if start is not None:
+            where.append('m.date >= ?')
+            args.append(start.isoformat())
+        if end is not None:
+            where.append('m.date < ?')
+            args.append(end.isoformat())
+
+        for column, value in (('m.buoy_id', buoy_id), ('m.sensor', sensor), ('m.scene_id', scene_id), ('b.band', band)):
+            if value is None:
+                continue
+            values = [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+            where.append('{0} IN ({1})'.format(column, ', '.join('?' * len(values))))
+            args += values
+
+        if matchup is not None:
+            ids = [int(m) for m in matchup] if isinstance(matchup, (list, tuple, set)) else [int(matchup)]
+            where.append('m.id IN ({0})'.format(', '.join('?' * len(ids))))
+            args += ids
+
+        if latest:
+            where.append('m.id IN (SELECT MAX(id) FROM matchups GROUP BY scene_id, buoy_id, atmo_source)')
+
+        sql = ('SELECT m.scene_id, m.sensor, m.date, m.buoy_id, m.buoy_lat, m.buoy_lon, m.bulk_temp, m.skin_temp, '
+               'b.band, b.modeled_ltoa, b.image_ltoa, b.error, b.image_ltoa_std, m.atmo_source, m.seconds, m.run, m.id '
+               'FROM matchups m JOIN bands b ON b.matchup = m.id')
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY m.date, m.scene_id, m.buoy_id, m.id, b.band'
+
+        with self._connect() as db:
+            rows = db.execute(sql, args).fetchall()
+
+        results = [dict(zip(COLUMNS, row)) for row in rows]
+        for r in results:
+            r['date'] = datetime.datetime.fromisoformat(r['date'])
+
+        return results
+
+    def runs(self):
+        """ provenance of every run that added results, as dicts """
+        with self._connect() as db:
+            rows = db.execute('SELECT id, started, host, git, argv, settings FROM runs ORDER BY id').fetchall()
+
+        return [{'id': i, 'started': started, 'host': host, 'git': git, 'argv': argv, 'settings': json.loads(s)}
+                for i, started, host, git, argv, s in rows]
+
+    def to_csv(self, filepath, **filters):
+        """
+        Write the results matching filters (see query) as the forward model's
+        text output, one line per match-up with its bands in order.
+
+        Returns:
+            number of lines written
+        """
+        with open(filepath, 'w') as f:
+            return write_csv(f, self.query(**filters))
+
+
+def write_csv(f, rows):
+    """ write query() rows to an open file, one line per match-up, see ResultStore.to_csv """
+    matchups = {}
+    for r in rows:
+        matchups.setdefault(r['matchup'], []).append(r)
+
+    print('#' + CSV_HEADER, file=f)
+    for bands in matchups.values():
+        bands = sorted(bands, key=lambda r: int(r['band']) if r['band'].isdigit() else r['band'])
+        r = bands[0]
+        print(r['scene_id'], r['date'].strftime('%Y/%m/%d'), r['buoy_id'], r['bulk_temp'], r['skin_temp'],
+              r['buoy_lat'], r['buoy_lon'], *[b['modeled_ltoa'] for b in bands], *[b['image_ltoa'] for b in bands],
+              *[b['error'] for b in bands], *[_or_nan(b['image_ltoa_std']) for b in bands], file=f, sep=', ')
+
+    return len(matchups)
+
+
+def _or_nan(value):
+    return float('nan') if value is None else value
@@ -1 +1,13 @@
-from . import (landsat, modis, wrs2)
\ No newline at end of file
+import importlib
+
+__all__ = ['geoindex', 'landsat', 'modis', 'wrs2']
+
+
+def __getattr__(name):
+    # submodules on first use, only the sensors used load GDAL
+    try:
+        return importlib.import_module('.' + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != '{0}.{1}'.format(__name__, name):
+            raise
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
@@ -0,0 +1,124 @@
+import collections
+import os
+import threading
+
+import numpy
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6371.0   # [km], mean radius
+
+MAX_INDEXES = 4   # indexes kept in memory, over 100 MB each, the least recently used is dropped
+
+# indexes built in this process, keyed by MOD03 file path, least recently used first
+_INDEXES = collections.OrderedDict()
+_INDEXES_LOCK = threading.Lock()   # buoys of one granule, in different threads, share one index
+
+
+class SwathIndex(object):
+    """
+    Nearest pixel lookup over a swath's geolocation arrays.
+
+    Pixels are stored as 3-D unit vectors in a KD-tree, so the nearest
+    neighbour in euclidean (chord) distance is also the nearest on the
+    sphere, with no trouble at the antimeridian or the poles.
+    """
+    def __init__(self, lat, lon):
+        lat = numpy.asarray(lat, dtype=numpy.float64)
+        lon = numpy.asarray(lon, dtype=numpy.float64)
+
+        self.shape = lat.shape
+
+        # MOD03 marks missing geolocation with -999
+        valid = (numpy.abs(lat) <= 90) & (numpy.abs(lon) <= 180)
+        self.pixels = numpy.flatnonzero(valid)
+        self.tree = cKDTree(latlon_to_xyz(lat.ravel()[self.pixels], lon.ravel()[self.pixels]))
+
+    def query(self, lats, lons):
+        """
+        Find the pixels closest to many points at once.
+
+        Args:
+            lats, lons: scalars or array-likes of latitude and longitude
+
+        Returns:
+            rows, cols: pixel indices of the closest pixels
+            distances: great circle distance to those pixels [km]
+        """
+        chords, idx = self.tree.query(latlon_to_xyz(lats, lons))
+        rows, cols = numpy.unravel_index(self.pixels[idx], self.shape)
+
+        return rows, cols, 2 * EARTH_RADIUS * numpy.arcsin(numpy.clip(chords / 2, 0, 1))
+
+
+def latlon_to_xyz(lats, lons):
+    """ Convert lat/lon [degrees] to an (N, 3) array of unit vectors. """
+    lats = numpy.radians(numpy.atleast_1d(numpy.asarray(lats, dtype=numpy.float64)).ravel())
+    lons = numpy.radians(numpy.atleast_1d(numpy.asarray(lons, dtype=numpy.float64)).ravel())
+
+    cos_lat = numpy.cos(lats)
+    return numpy.column_stack((cos_lat * numpy.cos(lons), cos_lat * numpy.sin(lons), numpy.sin(lats)))
+
+
+def index_path(geo_reference_MOD03):
+    """ Location of the persisted geolocation for a MOD03 file, next to the granule. """
+    return geo_reference_MOD03 + '.geoindex.npz'
+
+
+def read_mod03_latlon(geo_reference_MOD03):
+    """ Read the full Latitude and Longitude subdatasets of a MOD03 file. """
+    from osgeo import gdal   # only to build an index, a persisted one is read with numpy
+
+    geo_reference_ds = gdal.Open(geo_reference_MOD03)
+    geo_reference_sds = geo_reference_ds.GetSubDatasets()
+
+    # these are the latitude and longitude sub data sets
+    lat_ds = gdal.Open(subdataset(geo_reference_sds, 'Latitude', 12))
+    lon_ds = gdal.Open(subdataset(geo_reference_sds, 'Longitude', 13))
+
+    return lat_ds.ReadAsArray(), lon_ds.ReadAsArray()
+
+
+def subdataset(subdatasets, name, default_idx):
+    """ Find a subdataset by variable name, falling back to its usual position. """
+    for sds_name, __ in subdatasets:
+        if sds_name.split(':')[-1] == name:
+            return sds_name
+
+    return subdatasets[default_idx][0]
+
+
+def load(geo_reference_MOD03):
+    """
+    Get the SwathIndex for a MOD03 granule.
+
+    The geolocation arrays are decoded from the HDF file once and saved next
+    to it, so later runs skip the HDF read. The KD-tree itself is built once
+    per process and kept in memory, for the last MAX_INDEXES granules.
+    """
+    key = os.path.abspath(geo_reference_MOD03)
+
+    with _INDEXES_LOCK:
+        if key in _INDEXES:
+            _INDEXES.move_to_end(key)
+            return _INDEXES[key]
+
+        npz_file = index_path(geo_reference_MOD03)
+
+        if os.path.isfile(npz_file):
+            with numpy.load(npz_file) as f:
+                lat, lon = f['lat'], f['lon']
+        else:
+            lat, lon = read_mod03_latlon(geo_reference_MOD03)
+            lat = lat.astype(numpy.float32)
+            lon = lon.astype(numpy.float32)
+
+            # write then rename, so a crash never leaves a half written index
+            tmp_file = npz_file + '.part.npz'
+            numpy.savez(tmp_file, lat=lat, lon=lon)
+            os.replace(tmp_file, npz_file)
+
+        _INDEXES[key] = index = SwathIndex(lat, lon)
+        while len(_INDEXES) > MAX_INDEXES:
+            _INDEXES.popitem(last=False)
+
+        return index
@@ -1,3 +1,6 @@
+import functools
+
+import numpy
 from osgeo import gdal, osr
 import ogr
 import utm
@@ -35,42 +38,116 @@ def find_roi(img_file, lat, lon, zone):
     return x, y
 
 
-def convert_utm_zones(x, y, zone_from, zone_to):
+@functools.lru_cache(maxsize=64)
+def utm_transformer(zone_from, zone_to):
     """
-    Convert lat/lon to appropriate utm zone.
+    Build (once) the coordinate transformation between two northern utm zones.
 
     Args:
-        x, y: lat and lon, projected in zone_from
         zone_from: inital utm projection zone
         zone_to: final utm projection zone
 
     Returns:
-        x, y: lat and lon, projected in zone_to
+        osr.CoordinateTransformation from zone_from to zone_to
     """
+    if not (1 <= int(zone_from) <= 60 and 1 <= int(zone_to) <= 60):
+        raise OutOfRangeError('utm zones must be in [1, 60]: {0} {1}'.format(zone_from, zone_to))
 
     # Spatial Reference System
-    input_epsg = int(float('326' + str(zone_from)))
-    output_epsg = int(float('326' + str(zone_to)))
-
-    # create a geometry from coordinates
-    point = ogr.Geometry(ogr.wkbPoint)
-    point.AddPoint(x, y)
+    input_epsg = 32600 + int(zone_from)
+    output_epsg = 32600 + int(zone_to)
 
-    # create coordinate transformation
     in_spatial_ref = osr.SpatialReference()
     in_spatial_ref.ImportFromEPSG(input_epsg)
 
     out_spatial_ref = osr.SpatialReference()
     out_spatial_ref.ImportFromEPSG(output_epsg)
 
-    coord_trans = osr.CoordinateTransformation(in_spatial_ref, out_spatial_ref)
+    return osr.CoordinateTransformation(in_spatial_ref, out_spatial_ref)
+
+
+def convert_utm_zones(x, y, zone_from, zone_to):
+    """
+    Convert lat/lon to appropriate utm zone.
+
+    Args:
+        x, y: lat and lon, projected in zone_from
+        zone_from: inital utm projection zone
+        zone_to: final utm projection zone
+
+    Returns:
+        x, y: lat and lon, projected in zone_to
+    """
+    # create a geometry from coordinates
+    point = ogr.Geometry(ogr.wkbPoint)
+    point.AddPoint(x, y)
 
     # transform point
-    point.Transform(coord_trans)
+    point.Transform(utm_transformer(zone_from, zone_to))
 
     return point.GetX(), point.GetY()
 
 
+def convert_utm_zones_array(x, y, zone_from, zone_to):
+    """
+    Convert many points from one utm zone to another in a single call.
+
+    Args:
+        x, y: array-likes of easting and northing, projected in zone_from
+        zone_from: inital utm projection zone
+        zone_to: final utm projection zone
+
+    Returns:
+        x, y: numpy arrays of easting and northing, projected in zone_to
+    """
+    x = numpy.asarray(x, dtype=numpy.float64).ravel()
+    y = numpy.asarray(y, dtype=numpy.float64).ravel()
+
+    if x.shape != y.shape:
+        raise ValueError('x and y must have the same length: {0} {1}'.format(x.shape, y.shape))
+
+    if x.size == 0 or zone_from == zone_to:
+        return x.copy(), y.copy()
+
+    points = utm_transformer(zone_from, zone_to).TransformPoints(numpy.column_stack((x, y)).tolist())
+    points = numpy.asarray(points, dtype=numpy.float64)
+
+    return points[:, 0], points[:, 1]
+
+
+def latlon_to_utm_array(lats, lons, zone):
+    """
+    Project many lat/lon points into a single utm zone.
+
+    Points are projected into their own zone first, then each group of points
+    that shares a zone is moved to the target zone with one transform call.
+
+    Args:
+        lats, lons: array-likes of latitude and longitude
+        zone: utm zone to project to
+
+    Returns:
+        x, y: numpy arrays of easting and northing in zone
+    """
+    lats = numpy.asarray(lats, dtype=numpy.float64).ravel()
+    lons = numpy.asarray(lons, dtype=numpy.float64).ravel()
+
+    x = numpy.empty(lats.shape)
+    y = numpy.empty(lats.shape)
+    zones = numpy.empty(lats.shape, dtype=int)
+
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        x[i], y[i], zones[i], __ = utm.from_latlon(lat, lon)
+
+    for z in numpy.unique(zones):
+        if z == zone:
+            continue
+        idx = zones == z
+        x[idx], y[idx] = convert_utm_zones_array(x[idx], y[idx], z, zone)
+
+    return x, y
+
+
 def dc_avg(filename, poi):
     dataset = gdal.Open(filename)   # open image
     image = dataset.ReadAsArray()
@@ -1,32 +1,54 @@
 import datetime
 import glob
+import os
 
+import numpy
 from osgeo import gdal, osr
 import ogr
 import utm
 
-from .. import settings
+from .. import (instrument, settings)
 from ..download import *
 from . import image_processing as img
 
+# GDAL settings for reading bands straight from the S3 mirror with /vsicurl/,
+# only the tiff header and the tiles covering a read are requested
+VSICURL_OPTIONS = {
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'TRUE',   # do not list the bucket when opening a file
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.TIF,.ovr',   # only look for the image and its overviews
+    'VSI_CACHE': 'TRUE',   # keep fetched blocks in memory between reads
+}
 
-def download(scene_id, bands, directory_=settings.LANDSAT_DIR):
+
+def download(scene_id, bands, directory_=settings.LANDSAT_DIR, remote=False):
     """ Download a landsat image and load its metadata.
 
     Amazon S3 is faster but only has images from 2017 - present
     Website: https://aws.amazon.com/public-datasets/landsat/
     EarthExplorer is slower: https://earthexplorer.usgs.gov/
+
+    With remote=True only the MTL file is downloaded, and if the scene is on
+    S3 the returned directory is its /vsicurl/ location, so calc_ltoa() reads
+    windows of the bands over http instead of from whole local files.
+    Scenes that are not on S3 are downloaded as usual.
     """
     directory = directory_ + '/' + scene_id
 
     if 'MTL' not in bands:
         bands.append('MTL')
 
-    try:   
-        for band in bands:
-            # get url for the band
-            url = amazon_s3_url(scene_id, band)   # amazon s3 only has stuff from 2017 on
-            fp = url_download(url, directory)
+    if remote:
+        try:
+            meta_file = url_download(amazon_s3_url(scene_id, 'MTL'), directory)
+            metadata = read_metadata(meta_file)
+
+            return metadata['date'], remote_directory(scene_id), metadata
+        except RemoteFileException:
+            pass
+
+    try:
+        # get url for each band, amazon s3 only has stuff from 2017 on
+        download_many([(amazon_s3_url(scene_id, band), directory) for band in bands])
 
     except RemoteFileException:   # try to use EarthExplorer
 
@@ -35,13 +57,10 @@ def download(scene_id, bands, directory_=settings.LANDSAT_DIR):
                 entity_id = product2entityid(scene_id, version)
                 url = earthexplorer_url(entity_id)
                 try:
-                    targzfile = download_earthexplorer(url, directory+'/'+entity_id+'.tar.gz')
+                    # only the requested bands are written, the archive is never stored
+                    extract_earthexplorer(url, directory, [earthexplorer_suffix(band) for band in bands])
                 except RemoteFileException:
                     continue
-                tarfile = ungzip(targzfile)
-                os.remove(targzfile)
-                directory = untar(tarfile, directory)
-                os.remove(tarfile)
                 break
         else:
             raise RuntimeError('EarthExplorer Authentication Failed. Check username, \
@@ -84,11 +103,77 @@ def amazon_s3_url(scene_id, band):
     return '/'.join([settings.LANDSAT_S3_URL, info['sat'], info['path'], info['row'], info['id'], filename])
 
 
+def remote_directory(scene_id):
+    """ GDAL /vsicurl/ path of a scene's directory on Amazon S3 Landsat. """
+    return '/vsicurl/' + os.path.dirname(amazon_s3_url(scene_id, 'MTL'))
+
+
+def open_image(img_file):
+    """ Open a band with GDAL, local file or /vsicurl/ url. """
+    if img_file.startswith('/vsicurl/'):
+        for key, value in VSICURL_OPTIONS.items():
+            gdal.SetConfigOption(key, value)
+
+    dataset = gdal.Open(img_file)
+
+    if dataset is None:
+        raise RemoteFileException('could not open image: {0}'.format(img_file))
+
+    return dataset
+
+
+def read_window(dataset, img_file, x, y, size=3):
+    """
+    Read a size x size window of digital counts centered on pixel x, y.
+
+    Only the window is read, not the whole band. Windows of /vsicurl/ images
+    are cached as .npy files under settings.LANDSAT_DIR, so a scene is only
+    read over the network once.
+
+    Raises:
+        RuntimeError: if the window is not entirely inside the image
+    """
+    half = size // 2
+
+    if not (half <= x < dataset.RasterXSize - half and half <= y < dataset.RasterYSize - half):
+        raise RuntimeError('buoy falls outside of image')
+
+    cache_file = None
+    if img_file.startswith('/vsicurl/'):
+        scene_dir = os.path.basename(os.path.dirname(img_file))
+        name = os.path.splitext(os.path.basename(img_file))[0]
+        cache_file = '{0}/{1}/windows/{2}_{3}_{4}_{5}.npy'.format(settings.LANDSAT_DIR, scene_dir, name, x, y, size)
+
+        if os.path.isfile(cache_file):
+            return numpy.load(cache_file)
+
+    window = dataset.GetRasterBand(1).ReadAsArray(x - half, y - half, size, size)
+
+    if window is None:
+        raise RemoteFileException('could not read image: {0}'.format(img_file))
+
+    if cache_file:
+        # write then rename, so a crash never leaves a half written window
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        numpy.save(cache_file + '.part.npy', window)
+        os.replace(cache_file + '.part.npy', cache_file)
+
+    return window
+
+
 def earthexplorer_url(scene_id):
     """Format a url to download an image from EarthExplorer. """
     return settings.LANDSAT_EE_URL.format(scene_id)
 
 
+def earthexplorer_suffix(band):
+    """ End of the file name of a band inside an EarthExplorer archive. """
+    if band != 'MTL':
+        return '_B%s.TIF' % band
+    else:
+        return '_MTL.txt'
+
+
 def parse_L8(scene_id):
     parsed = {}
 
@@ -149,11 +234,13 @@ def corners(metadata):
            metadata['CORNER_UR_LON_PRODUCT'], metadata['CORNER_LL_LON_PRODUCT']
 
 
+@instrument.timed()
 def calc_ltoa(directory, metadata, lat, lon, band):
     """
     Calculate image radiance from metadata
 
     Args:
+        directory: scene directory, local or /vsicurl/ (see download())
         metadata: landsat scene metadata
         lat: point of interest latitude
         lon: point of interest longitude
@@ -164,7 +251,7 @@ def calc_ltoa(directory, metadata, lat, lon, band):
     """
     img_file = directory + '/' + metadata['FILE_NAME_BAND_' + str(band)]
 
-    dataset = gdal.Open(img_file)   # open image
+    dataset = open_image(img_file)   # open image
     geotransform = dataset.GetGeoTransform()   # get data transform
 
     # change lat_lon to same projection
@@ -177,13 +264,9 @@ def calc_ltoa(directory, metadata, lat, lon, band):
     x = int((l_x - geotransform[0]) / geotransform[1])   # latitude
     y = int((l_y - geotransform[3]) / geotransform[5])   # longitude
 
-    # TODO check if x, y are within bounds
-
     # calculate digital count average of 3x3 area around poi
     # TODO add ROI width parameter
-    image_data = dataset.ReadAsArray()
-    #print(image_data, image_data.shape, image_data.mean(), y, x)
-    dc_avg = image_data[y-1:y+2, x-1:x+2].mean()
+    dc_avg = read_window(dataset, img_file, x, y, 3).mean()
     
     if dc_avg == 0:
         raise RuntimeError('buoy falls outside of image (in the corner)')
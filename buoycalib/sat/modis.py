@@ -3,15 +3,12 @@ from ftplib import FTP
 
 import gdal
 import numpy
-import glob
-#import skimage.data
-import utm
 
-from .. import settings
+from .. import (instrument, settings)
 from ..download import url_download
-from . import image_processing as img
+from . import geoindex
 from .modis_tile import latlon_to_tile
-from . import mrt_swath
+from . import swath_grid
 
 def download(granule_id, directory_=settings.MODIS_DIR):
     """ download a MODIS scene by granule ID. """
@@ -21,18 +18,31 @@ def download(granule_id, directory_=settings.MODIS_DIR):
     granule_filepath = url_download(url, directory)
 
     # parse metadata
-    ds = gdal.Open(granule_filepath)
-    metadata = ds.GetMetadata()
-    date = datetime.datetime.strptime(granule_id[9:22], 'A%Y%j.%H%M')
+    metadata = read_metadata(granule_filepath)
+    date = granule_date(granule_id)
 
     # also download georeference MOD03
-    geo_reference_MOD03 = metadata['ANCILLARYINPUTPOINTER.1']
-    url = modis_url(geo_reference_MOD03)
+    url = modis_url(geo_reference(metadata))
     geo_ref_filepath = url_download(url, directory)
 
     return date, directory, metadata, [granule_filepath, geo_ref_filepath]
 
 
+def read_metadata(granule_filepath):
+    """ metadata of a downloaded granule, HDF4 granules are not read remotely, so the whole file is needed """
+    return gdal.Open(granule_filepath).GetMetadata()
+
+
+def granule_date(granule_id):
+    """ acquisition time of a granule, from its ID """
+    return datetime.datetime.strptime(granule_id[9:22], 'A%Y%j.%H%M')
+
+
+def geo_reference(metadata):
+    """ granule ID of the MOD03 geolocation of a granule """
+    return metadata['ANCILLARYINPUTPOINTER.1']
+
+
 def modis_url(granule_id):
     info = parse_granule(granule_id)
     url = '/'.join([settings.MODIS_URL, info['product'], info['date'].strftime('%Y/%j'), granule_id])
@@ -94,12 +104,29 @@ def modis_from_landsat(date, lat, lon):
     return matches
 
 
-def calc_ltoa_direct(emmissivities_MOD21KM, geo_reference_MOD03, lat_oi, lon_oi, bands=[31, 32]):
-    """ Calculate the toa radiance from the MOD21KM product directly. """
+def calc_ltoa_direct(emmissivities_MOD21KM, geo_reference_MOD03, lat_oi, lon_oi, bands=[31, 32], roi=3):
+    """
+    Calculate the toa radiance from the MOD21KM product directly.
+
+    Only the requested bands, and only a roi x roi window around the pixel
+    closest to the point of interest, are read from the file.
+
+    Args:
+        emmissivities_MOD21KM: MOD021KM granule file
+        geo_reference_MOD03: matching MOD03 geolocation file
+        lat_oi, lon_oi: point of interest
+        bands: emissive band numbers to calculate
+        roi: width of the square window around the point of interest [pixels]
+
+    Returns:
+        radiance: dict of band: mean radiance in the window
+        radiance_std: dict of band: standard deviation of the radiance in the window
+        radiance_units: units of the radiances
+    """
     ds = gdal.Open(emmissivities_MOD21KM)
-    
-    emissive_bands = gdal.Open(ds.GetSubDatasets()[2][0])
-    
+
+    emissive_bands = gdal.Open(geoindex.subdataset(ds.GetSubDatasets(), 'EV_1KM_Emissive', 2))
+
     band_names = emissive_bands.GetMetadata()['band_names'].split(',')
     radiance_scales = emissive_bands.GetMetadata()['radiance_scales']
     radiance_scales = {int(band_names[i]):float(f) for i, f in enumerate(radiance_scales.split(', '))}
@@ -110,28 +137,30 @@ def calc_ltoa_direct(emmissivities_MOD21KM, geo_reference_MOD03, lat_oi, lon_oi,
     # map from band number to index in the emissive_bands numpy array
     band2idx_map = {int(b):i for i, b in enumerate(band_names)}
 
-    # read data in to numpy array form
-    emissive_data = emissive_bands.ReadAsArray()
+    # find closest point, using the geo reference file (matching MOD03 product)
+    rows, cols, __ = geoindex.load(geo_reference_MOD03).query(lat_oi, lon_oi)
+    poi_r, poi_c = int(rows[0]), int(cols[0])
 
-    # geo reference file (matching MOD03 product)       
-    geo_reference_ds = gdal.Open(geo_reference_MOD03)
-    geo_reference_sds = geo_reference_ds.GetSubDatasets()
-
-    # these are the latitude and longitude sub data sets
-    lat_ds = gdal.Open(geo_reference_sds[12][0])
-    lon_ds = gdal.Open(geo_reference_sds[13][0])
-    lat = lat_ds.ReadAsArray()
-    lon = lon_ds.ReadAsArray()
-
-    # find closest point
-    distances = (lat - lat_oi)**2 + (lon - lon_oi)**2
-    poi_r, poi_c = numpy.unravel_index(numpy.argmin(distances), lat.shape)
+    # window around the closest point, clipped to the swath
+    half = roi // 2
+    r0, c0 = max(poi_r - half, 0), max(poi_c - half, 0)
+    r1 = min(poi_r + half + 1, emissive_bands.RasterYSize)
+    c1 = min(poi_c + half + 1, emissive_bands.RasterXSize)
 
     radiance = {}
+    radiance_std = {}
     for b in bands:
-        radiance[b] = radiance_scales[b] * (emissive_data[band2idx_map[b], poi_r, poi_c] - radiance_offsets[b])
+        band = emissive_bands.GetRasterBand(band2idx_map[b] + 1)   # gdal bands are 1 indexed
+        window = band.ReadAsArray(c0, r0, c1 - c0, r1 - r0).astype(numpy.float64)
+
+        # scaled integers above 32767 are fill values / error flags
+        window[window > 32767] = numpy.nan
+        window = radiance_scales[b] * (window - radiance_offsets[b])
 
-    return radiance, radiance_units
+        radiance[b] = numpy.nanmean(window)
+        radiance_std[b] = numpy.nanstd(window)
+
+    return radiance, radiance_std, radiance_units
 
 
 def load_rsr(fname): 
@@ -139,21 +168,12 @@ def load_rsr(fname):
     return numpy.genfromtxt(fname, skip_header=9, usecols=(2, 3), unpack=True)
 
 
+@instrument.timed()
 def calc_ltoa(emmissivities_MOD21KM, geo_reference_MOD03, lat_oi, lon_oi, bands=[31, 32]):
-    """ convert modis image to a GeoTiff then calc the Ltoa from that image. """
-    
-    # make a parameter file to use with mrt_swath
-    directory = '/'.join(emmissivities_MOD21KM.split('/')[:-1])
-    prm_out = mrt_swath.make_param_file(emmissivities_MOD21KM, geo_reference_MOD03, lat_oi, lon_oi, directory + '/swath.prm')
-
-    # run swath2grid
-    directory = mrt_swath.run_swath2grid(prm_out)
-
-    # then read it out of the geotiff
-    # and offset and scale it
+    """ calc the Ltoa of the UTM grid cell around a point, resampled from the swath (see swath_grid). """
     ds = gdal.Open(emmissivities_MOD21KM)
     
-    emissive_bands = gdal.Open(ds.GetSubDatasets()[2][0])
+    emissive_bands = gdal.Open(geoindex.subdataset(ds.GetSubDatasets(), 'EV_1KM_Emissive', 2))
     
     band_names = emissive_bands.GetMetadata()['band_names'].split(',')
     radiance_scales = emissive_bands.GetMetadata()['radiance_scales']
@@ -162,17 +182,22 @@ def calc_ltoa(emmissivities_MOD21KM, geo_reference_MOD03, lat_oi, lon_oi, bands=
     radiance_offsets = {float(band_names[i]):float(f) for i, f in enumerate(radiance_offsets.split(', '))}
     radiance_units = emissive_bands.GetMetadata()['radiance_units']
 
-    __, __, zone, __ = utm.from_latlon(lat_oi, lon_oi)
+    # map from band number to index in the emissive_bands numpy array
+    band2idx_map = {int(b):i for i, b in enumerate(band_names)}
+
+    # the grid cell of the point of interest, nearest neighbour resampled from the requested bands
+    lats, lons = swath_grid.window(lat_oi, lon_oi)
+    pixels = swath_grid.resample({b: emissive_bands.GetRasterBand(band2idx_map[b] + 1) for b in bands},
+                                 geoindex.load(geo_reference_MOD03), lats, lons)
 
     radiance = {}
     for b in bands:
-        filename = glob.glob(directory+'/blah*{0}*.tif'.format(b-20))[0]
-        poi_r, poi_c = img.find_roi(filename, lat_oi, lon_oi, zone)
-
-        image = skimage.data.load(filename)
+        pixel = pixels[b][0, 0]
 
-        radiance[b] = radiance_scales[b] * (image[poi_r, poi_c] - radiance_offsets[b])
-        print('band: ', b, image[poi_r, poi_c], radiance_scales[b], radiance_offsets[b], radiance[b], filename)
+        # scaled integers above 32767 are fill values / error flags
+        if pixel > 32767:
+            pixel = numpy.nan
 
+        radiance[b] = radiance_scales[b] * (pixel - radiance_offsets[b])
 
     return radiance, radiance_units
\ No newline at end of file
@@ -1,40 +1,85 @@
+import functools
+
 import numpy
 
 from .. import settings
 
-def latlon_to_tile(lat, lon, file_=settings.MODIS_TILE):
-	""" convert lat lon pair to containing MODIS tile
+# MODIS sinusoidal grid: 36 x 18 tiles of 10 degrees at the equator
+SPHERE_RADIUS = 6371007.181   # [m]
+TILE_SIZE = 2 * numpy.pi * SPHERE_RADIUS / 36   # [m]
+N_HORIZ = 36
+N_VERT = 18
 
-	Source: https://earthdatascience.org/tutorials/convert-modis-tile-to-lat-lon/
-	"""
+
+@functools.lru_cache(maxsize=None)
+def load_tile_table(file_=settings.MODIS_TILE):
+	""" load the tile bounding table once, rows are: iv ih lon_min lon_max lat_min lat_max """
 	# first seven rows contain header information
 	# bottom 3 rows are not data
-	data = numpy.loadtxt(file_, skiprows = 7)
+	table = numpy.loadtxt(file_, skiprows = 7)
+	table.setflags(write=False)
+	return table
+
+
+def latlon_to_tile(lat, lon, file_=settings.MODIS_TILE, verify=True):
+	""" convert lat lon pair (or arrays of them) to containing MODIS tile
+
+	The tile is computed directly from the sinusoidal projection, the bounding
+	table is only used to check the result.
+
+	Source: https://earthdatascience.org/tutorials/convert-modis-tile-to-lat-lon/
+	https://modis-land.gsfc.nasa.gov/MODLAND_grid.html
+
+	Returns:
+		vert, horiz: ints for scalar input, int arrays for array input
+	"""
+	scalar = numpy.isscalar(lat) and numpy.isscalar(lon)
+	lat = numpy.asarray(lat, dtype=numpy.float64)
+	lon = numpy.asarray(lon, dtype=numpy.float64)
 
-	in_tile = False
-	i = 0
-	while(not in_tile):
-	    in_tile = lat >= data[i, 4] and lat <= data[i, 5] and lon >= data[i, 2] and lon <= data[i, 3]
-	    i += 1
+	# sinusoidal projection
+	x = SPHERE_RADIUS * numpy.radians(lon) * numpy.cos(numpy.radians(lat))
+	y = SPHERE_RADIUS * numpy.radians(lat)
 
-	vert = data[i-1, 0]
-	horiz = data[i-1, 1]
+	# grid origin is the upper left corner, clip points on the far edges
+	horiz = numpy.clip(numpy.floor((x + N_HORIZ / 2 * TILE_SIZE) / TILE_SIZE), 0, N_HORIZ - 1).astype(int)
+	vert = numpy.clip(numpy.floor((N_VERT / 2 * TILE_SIZE - y) / TILE_SIZE), 0, N_VERT - 1).astype(int)
+
+	if verify:
+		_verify(lat, lon, vert, horiz, load_tile_table(file_))
+
+	if scalar:
+		return int(vert), int(horiz)
 	return vert, horiz
 
+
+def _verify(lat, lon, vert, horiz, table, tolerance=1e-3):
+	""" check computed tiles against the bounding table, where the table has the tile """
+	rows = table[vert * N_HORIZ + horiz]
+	# longitude is meaningless at the poles
+	defined = (rows[..., 2] > -999) & (numpy.abs(lat) < 90 - tolerance)
+
+	inside = (rows[..., 2] - tolerance <= lon) & (lon <= rows[..., 3] + tolerance) & \
+	         (rows[..., 4] - tolerance <= lat) & (lat <= rows[..., 5] + tolerance)
+
+	if numpy.any(defined & ~inside):
+		raise ValueError('Computed MODIS tile does not contain the point, check the tile table: {0}'.format(settings.MODIS_TILE))
+
+
 def tile_to_latlon(vert, horiz, file_=settings.MODIS_TILE):
 	""" convert MODIS tile to containing lat lon
 
 	return format: lon_min    lon_max   lat_min   lat_max
 	"""
-	# first seven rows contain header information
-	# bottom 3 rows are not data
-	data = numpy.loadtxt(file_, skiprows = 7)
+	if not (0 <= vert < N_VERT and 0 <= horiz < N_HORIZ):
+		raise Exception('Tile: {0} {1} not found.'.format(vert, horiz))
 
-	for row in data:
-		if row[0] == vert and row[1] == horiz:
-			return row[2:]
+	row = load_tile_table(file_)[int(vert) * N_HORIZ + int(horiz)]
 
-	raise Exception('Tile: {0} {1} not found.'.format(vert, horiz))
+	if row[0] != vert or row[1] != horiz:
+		raise Exception('Tile: {0} {1} not found.'.format(vert, horiz))
+
+	return row[2:]
 
 if __name__ == '__main__':
 	lat = 40.015
@@ -42,4 +87,3 @@ if __name__ == '__main__':
 	print(latlon_to_tile(lat, lon))
 
 	print(tile_to_latlon(4, 9))
-
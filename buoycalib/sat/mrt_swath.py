@@ -1,11 +1,59 @@
-import utm
+"""
+Reprojection of MODIS swath bands to UTM GeoTIFFs with MRTSwath's swath2grid
+(settings.SWATH2GRID_EXE).
+
+reproject() runs swath2grid in a temporary directory of its own, and moves
+the GeoTIFFs into a cache directory under settings.SWATH_DIR named by the
+granule, its geolocation file, the reprojected box and the bands. Concurrent
+runs (threads or processes) never share files, and a box already
+reprojected is not run again.
+
+modis.calc_ltoa samples the same grid in memory with swath_grid instead, this
+is for whole reprojected GeoTIFFs.
+"""
+import glob
+import hashlib
 import os
+import shutil
 import subprocess
+import tempfile
+
+import utm
 
 from .. import settings
+from ..download import file_lock
+
+EMISSIVE_BANDS = [20, 21, 22, 23, 24, 25, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36]   # layers of EV_1KM_Emissive
+SIZE = 400000   # [m], side of the square reprojected around the point of interest
+PREFIX = 'swath'   # of the GeoTIFFs swath2grid writes
+
+
+class SwathError(Exception):
+    pass
+
+
+def bbox(lat, lon, size=SIZE):
+    """
+    Square centered on a point, in its UTM zone.
+
+    Returns:
+        zone, upper left x, upper left y, lower right x, lower right y [m]
+    """
+    x, y, zone, letter = utm.from_latlon(lat, lon)
+    x, y, half = int(round(x)), int(round(y)), size // 2
+
+    return zone, x - half, y + half, x + half, y - half
 
 
-def make_param_file(ds, georef, lat, lon, prm_out, prefix='blah'):
+def make_param_file(ds, georef, lat, lon, prm_out, prefix='blah', bands=None, size=SIZE):
+    """
+    Write a swath2grid parameter file, for a size x size square around lat, lon.
+
+    Args:
+        ds, georef: MOD021KM granule and MOD03 geolocation files
+        prefix: of the output files, relative to the directory swath2grid runs in
+        bands: emissive bands to reproject, None for all of them
+    """
     with open(settings.SWATH2GRID_PRM, 'r') as fin:
         template = fin.read()
 
@@ -14,12 +62,13 @@ def make_param_file(ds, georef, lat, lon, prm_out, prefix='blah'):
     template = template.replace('{OUTPUT_FILENAME}', prefix)
     template = template.replace('{GEOLOCATION_FILENAME}', georef)
 
-    # convert poi to utm coordinates
-    x, y, zone, letter = utm.from_latlon(lat, lon)
+    if bands is not None:
+        mask = ' '.join('1' if b in bands else '0' for b in EMISSIVE_BANDS)
+        template = template.replace('INPUT_SDS_NAME = EV_1KM_Emissive', 'INPUT_SDS_NAME = EV_1KM_Emissive, ' + mask)
 
-    # then make the output 400,000 m square centered on the poi
-    template = template.replace('{OUTPUT_SPACE_UPPER_LEFT_CORNER}', '{0} {1}'.format(x-200000, y+200000))
-    template = template.replace('{OUTPUT_SPACE_LOWER_RIGHT_CORNER}', '{0} {1}'.format(x+200000, y-200000))
+    zone, ul_x, ul_y, lr_x, lr_y = bbox(lat, lon, size)
+    template = template.replace('{OUTPUT_SPACE_UPPER_LEFT_CORNER}', '{0} {1}'.format(ul_x, ul_y))
+    template = template.replace('{OUTPUT_SPACE_LOWER_RIGHT_CORNER}', '{0} {1}'.format(lr_x, lr_y))
     template = template.replace('{OUTPUT_PROJECTION_ZONE}', str(zone))
 
     with open(prm_out, 'w') as fout:
@@ -29,17 +78,108 @@ def make_param_file(ds, georef, lat, lon, prm_out, prefix='blah'):
 
 
 def run_swath2grid(param_file):
+    """
+    Run swath2grid in the directory of param_file, the working directory of
+    this process is left alone.
+
+    Returns:
+        directory where images are stored
+
+    Raises:
+        SwathError: swath2grid failed
+    """
+    d = os.path.dirname(os.path.abspath(param_file))
+
+    try:
+        subprocess.run([settings.SWATH2GRID_EXE, '-pf={0}'.format(param_file)], cwd=d, check=True,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise SwathError('swath2grid failed on {0}: {1}'.format(param_file, _output_tail(e)))
+
+    return d
 
-    # move to directory
-    cwd = os.getcwd()
-    d = '/'.join(param_file.split('/')[:-1])
-    os.chdir(d)
 
-    # run subprocess
-    subprocess.call('/cis/ugrad/nid4986/repos/Senior_Project/MRTSwath/bin/swath2grid -pf={0}'.format(param_file), shell=True)
+async def run_swath2grid_async(param_file):
+    """ run_swath2grid() as a coroutine, see aio.run """
+    from .. import aio   # only the coroutines use the event loop
 
-    # move back to working directory
-    os.chdir(cwd)
+    d = os.path.dirname(os.path.abspath(param_file))
+
+    try:
+        await aio.run([settings.SWATH2GRID_EXE, '-pf={0}'.format(param_file)], cwd=d)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise SwathError('swath2grid failed on {0}: {1}'.format(param_file, _output_tail(e)))
 
-    # return directory where images are stored
     return d
+
+
+def _output_tail(e):
+    output = getattr(e, 'output', None)
+    return output.decode(errors='replace').strip()[-500:] if output else str(e)
+
+
+def cache_path(granule, georef, box, bands):
+    """ directory of the reprojected bands, named by the files (path, size, mtime), box and bands """
+    h = hashlib.sha256()
+    for filepath in (granule, georef):
+        stat = os.stat(filepath)
+        h.update('{0}:{1}:{2}\n'.format(os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+    h.update(repr((tuple(box), tuple(sorted(bands)))).encode('utf-8'))
+
+    return os.path.join(settings.SWATH_DIR, '{0}_{1}'.format(os.path.basename(granule), h.hexdigest()[:32]))
+
+
+def outputs(directory, bands):
+    """ {band: GeoTIFF} in a directory swath2grid wrote to, None if one is missing """
+    files = {}
+    for b in bands:
+        found = sorted(glob.glob(os.path.join(directory, '{0}*{1}*.tif'.format(PREFIX, b - 20))))
+        if not found:
+            return None
+        files[b] = found[0]
+
+    return files
+
+
+def reproject(granule, georef, lat, lon, bands, size=SIZE):
+    """
+    Reproject bands of a MODIS granule to UTM GeoTIFFs, over a size x size
+    square around lat, lon, or get them from the cache.
+
+    Args:
+        granule: MOD021KM file
+        georef: its MOD03 geolocation file
+        bands: emissive band numbers
+
+    Returns:
+        {band: GeoTIFF filepath}
+    """
+    directory = cache_path(granule, georef, bbox(lat, lon, size), bands)
+
+    files = outputs(directory, bands)
+    if files is not None:
+        return files
+
+    os.makedirs(settings.SWATH_DIR, exist_ok=True)
+
+    # one run per box, threads and processes asking for the same one wait for it
+    with file_lock(directory):
+        files = outputs(directory, bands)
+        if files is not None:
+            return files
+
+        work = tempfile.mkdtemp(prefix='.run_', dir=settings.SWATH_DIR)
+        try:
+            prm = make_param_file(os.path.abspath(granule), os.path.abspath(georef), lat, lon,
+                                  os.path.join(work, 'swath.prm'), PREFIX, bands, size)
+            run_swath2grid(prm)
+
+            if outputs(work, bands) is None:
+                raise SwathError('swath2grid wrote no GeoTIFF of some of bands {0} for {1}'.format(bands, granule))
+
+            shutil.rmtree(directory, ignore_errors=True)   # an incomplete one
+            os.replace(work, directory)
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+    return outputs(directory, bands)
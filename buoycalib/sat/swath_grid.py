@@ -0,0 +1,73 @@
+"""
+Resampling of MODIS swath bands to a UTM grid, in memory, in place of
+MRTSwath's swath2grid (see mrt_swath.py).
+
+The grid is the one swath2grid writes for mrt_swath.make_param_file, but only
+the cells asked for are computed: their centers are looked up in the swath's
+geoindex.SwathIndex and take the value of the nearest swath pixel (the NN
+kernel of swath2grid_template.prm). Only the swath rows and columns around
+those pixels are read, of the bands asked for.
+"""
+import numpy
+import utm
+
+from .mrt_swath import (bbox, SIZE)
+
+PIXEL_SIZE = 1000   # [m], OUTPUT_PIXEL_SIZE of swath2grid_template.prm
+MAX_DISTANCE = 5.0   # [km], cells farther from every swath pixel are off the swath
+
+
+def window(lat, lon, width=1, size=SIZE, pixel_size=PIXEL_SIZE):
+    """
+    Cells of the UTM grid swath2grid makes around a point.
+
+    Args:
+        lat, lon: point of interest, at the center of the grid
+        width: of the square of cells around the cell of the point [cells]
+        size: side of the grid [m], see mrt_swath.bbox
+
+    Returns:
+        lats, lons: (width, width) arrays, the centers of the cells
+    """
+    zone, ul_x, ul_y, __, __ = bbox(lat, lon, size)
+    x, y, __, __ = utm.from_latlon(lat, lon, force_zone_number=zone)
+
+    # cell of the point, as image_processing.find_roi finds it in a GeoTIFF of the grid
+    col, row = int((x - ul_x) / pixel_size), int((ul_y - y) / pixel_size)
+
+    offsets = numpy.arange(width) - width // 2
+    xs, ys = numpy.meshgrid(ul_x + (col + offsets + 0.5) * pixel_size, ul_y - (row + offsets + 0.5) * pixel_size)
+
+    return utm.to_latlon(xs, ys, zone, northern=lat >= 0)
+
+
+def resample(bands, index, lats, lons, max_distance=MAX_DISTANCE):
+    """
+    Nearest neighbour resampling of swath bands at points.
+
+    Args:
+        bands: {key: gdal band of the swath}, anything with ReadAsArray(xoff, yoff, xsize, ysize)
+        index: geoindex.SwathIndex of the swath's geolocation
+        lats, lons: arrays of points, i.e. from window()
+        max_distance: [km] points farther from every swath pixel are nan
+
+    Returns:
+        {key: float64 array shaped like lats}
+    """
+    shape = numpy.shape(lats)
+    rows, cols, distances = index.query(lats, lons)
+    on_swath = distances <= max_distance
+
+    resampled = {key: numpy.full(shape, numpy.nan) for key in bands}
+    if not on_swath.any():
+        return resampled
+
+    # the part of the swath the points fall on
+    rows, cols = rows[on_swath], cols[on_swath]
+    r0, c0 = int(rows.min()), int(cols.min())
+    height, width = int(rows.max()) - r0 + 1, int(cols.max()) - c0 + 1
+
+    for key, band in bands.items():
+        resampled[key].ravel()[on_swath] = band.ReadAsArray(c0, r0, width, height)[rows - r0, cols - c0]
+
+    return resampled
@@ -1,58 +1,248 @@
+import functools
+import os
+
+import numpy
 from osgeo import ogr
-#import shapely.geometry
-#import shapely.wkt
 
 from .. import settings
 
-# credit to here: 
+# credit to here:
 # https://earthdatascience.org/tutorials/convert-landsat-path-row-to-lat-lon/
 # shapefile from here: https://landsat.usgs.gov/pathrow-shapefiles
 
+# the shapefile is only read once, to build a compact index (settings.WRS2_INDEX)
+# of centroids, envelopes and polygon rings, plus a grid of GRID_SIZE degree
+# cells listing the scenes whose envelope touches each cell.
+GRID_SIZE = 1.0   # [degrees]
+
+
 class ogrError(Exception): pass
 
 
-def wrs2_to_latlon(wrs2_path, wrs2_row, shapefile=settings.WRS2):
-    """ Convert a WRS-2 Path and Row to Latitude and Longitude """
+class Wrs2Index(object):
+    """
+    In memory WRS-2 index, see make_index() for the arrays it holds.
+
+    Polygons that cross the antimeridian are stored with longitudes unwrapped
+    past 180, so that every ring is continuous.
+    """
+    def __init__(self, arrays):
+        self.path = arrays['path']
+        self.row = arrays['row']
+        self.centroid = arrays['centroid']   # (N, 2) lat, lon
+        self.envelope = arrays['envelope']   # (N, 4) min lon, max lon, min lat, max lat
+        self.vertices = arrays['vertices']   # (M, 2) lon, lat
+        self.offsets = arrays['offsets']   # (N+1), ring i is vertices[offsets[i]:offsets[i+1]]
+
+        self.keys = {(int(p), int(r)): i for i, (p, r) in enumerate(zip(self.path, self.row))}
+
+        cell_offsets = arrays['cell_offsets']
+        members = arrays['cell_members']
+        self.cells = {(int(lat), int(lon)): members[cell_offsets[i]:cell_offsets[i+1]]
+                      for i, (lat, lon) in enumerate(arrays['cell_keys'])}
+
+    def find(self, wrs2_path, wrs2_row):
+        """ index of a path/row, raises ogrError if it does not exist """
+        try:
+            return self.keys[(int(wrs2_path), int(wrs2_row))]
+        except KeyError:
+            raise ogrError('Path and Row Not Found')
+
+    def ring(self, i):
+        """ (K, 2) lon, lat vertices of polygon i """
+        return self.vertices[self.offsets[i]:self.offsets[i+1]]
+
+    def containing(self, lat, lon):
+        """ indices of every polygon containing the point, in shapefile order """
+        lon = _wrap(lon)
+        candidates = self.cells.get(_cell(lat, lon), ())
+
+        inside = []
+        for i in candidates:
+            # unwrapped polygons may hold the point at lon + 360
+            for test_lon in (lon, lon + 360):
+                min_lon, max_lon, min_lat, max_lat = self.envelope[i]
+                if min_lon <= test_lon <= max_lon and min_lat <= lat <= max_lat and \
+                        point_in_ring(test_lon, lat, self.ring(i)):
+                    inside.append(i)
+                    break
+
+        return sorted(inside)
+
+
+def _wrap(lon):
+    return (lon + 180.0) % 360.0 - 180.0
+
+
+def _cell(lat, lon):
+    return int(numpy.floor(lat / GRID_SIZE)), int(numpy.floor(_wrap(lon) / GRID_SIZE))
+
+
+def point_in_ring(x, y, ring):
+    """ even-odd ray casting test of one point against a polygon ring, (K, 2) x, y vertices """
+    x0, y0 = ring[:, 0], ring[:, 1]
+    x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+
+    crosses = (y0 > y) != (y1 > y)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+
+    return bool(numpy.count_nonzero(crosses & (x < x_cross)) % 2)
+
+
+def make_index(paths, rows, rings):
+    """
+    Build the index arrays from path/row numbers and polygon rings.
+
+    Args:
+        paths, rows: sequences of WRS-2 path and row numbers
+        rings: sequence of (K, 2) arrays of lon, lat vertices
+
+    Returns:
+        dict of numpy arrays, as saved in the npz index
+    """
+    vertices = []
+    offsets = [0]
+    centroids = []
+    envelopes = []
+
+    for ring in rings:
+        ring = numpy.array(ring, dtype=numpy.float64)[:, :2]
+
+        # unwrap rings that cross the antimeridian
+        if ring[:, 0].max() - ring[:, 0].min() > 180:
+            ring[ring[:, 0] < 0, 0] += 360
+
+        vertices.append(ring)
+        offsets.append(offsets[-1] + len(ring))
+        envelopes.append((ring[:, 0].min(), ring[:, 0].max(), ring[:, 1].min(), ring[:, 1].max()))
+
+        # area weighted centroid (shoelace)
+        x, y = ring[:, 0], ring[:, 1]
+        x1, y1 = numpy.roll(x, -1), numpy.roll(y, -1)
+        cross = x * y1 - x1 * y
+        area = cross.sum() / 2
+        if area == 0:
+            cx, cy = x.mean(), y.mean()
+        else:
+            cx = ((x + x1) * cross).sum() / (6 * area)
+            cy = ((y + y1) * cross).sum() / (6 * area)
+        centroids.append((cy, _wrap(cx)))
+
+    envelopes = numpy.array(envelopes, dtype=numpy.float64).reshape(-1, 4)
+
+    # grid cells touched by each envelope
+    cells = {}
+    for i, (min_lon, max_lon, min_lat, max_lat) in enumerate(envelopes):
+        lat_cells = range(int(numpy.floor(min_lat / GRID_SIZE)), int(numpy.floor(max_lat / GRID_SIZE)) + 1)
+        lon_cells = range(int(numpy.floor(min_lon / GRID_SIZE)), int(numpy.floor(max_lon / GRID_SIZE)) + 1)
+        for lat in lat_cells:
+            for lon in lon_cells:
+                cells.setdefault(_cell(lat * GRID_SIZE, lon * GRID_SIZE), []).append(i)
+
+    cell_keys = sorted(cells)
+    cell_offsets = numpy.cumsum([0] + [len(cells[k]) for k in cell_keys])
+    cell_members = [i for k in cell_keys for i in cells[k]]
+
+    return {
+        'path': numpy.asarray(paths, dtype=numpy.int16),
+        'row': numpy.asarray(rows, dtype=numpy.int16),
+        'centroid': numpy.array(centroids, dtype=numpy.float64).reshape(-1, 2),
+        'envelope': envelopes,
+        'vertices': numpy.concatenate(vertices) if vertices else numpy.empty((0, 2)),
+        'offsets': numpy.asarray(offsets, dtype=numpy.int64),
+        'cell_keys': numpy.asarray(cell_keys, dtype=numpy.int32).reshape(-1, 2),
+        'cell_offsets': numpy.asarray(cell_offsets, dtype=numpy.int64),
+        'cell_members': numpy.asarray(cell_members, dtype=numpy.int32),
+    }
+
+
+def build_index(shapefile=settings.WRS2, index_file=settings.WRS2_INDEX):
+    """ Read the WRS-2 shapefile once and save the index next to it. """
     dataSource = ogr.Open(shapefile)
+    if dataSource is None:
+        raise ogrError('Could not open WRS-2 shapefile: {0}'.format(shapefile))
     layer = dataSource.GetLayer()
 
+    paths, rows, rings = [], [], []
     for feature in layer:
-        if feature['PATH'] == wrs2_path and feature['ROW'] == wrs2_row:
-            geom = feature.GetGeometryRef()
-            return geom.Centroid().GetY(), geom.Centroid().GetX()
+        geom = feature.GetGeometryRef()
+        if geom.GetGeometryCount() > 0:   # polygon -> outer ring
+            geom = geom.GetGeometryRef(0)
+        while geom.GetGeometryCount() > 0:   # multipolygon -> first polygon's outer ring
+            geom = geom.GetGeometryRef(0)
+
+        paths.append(feature['PATH'])
+        rows.append(feature['ROW'])
+        rings.append(geom.GetPoints())
 
-    raise ogrError('Path and Row Not Found')
+    arrays = make_index(paths, rows, rings)
+
+    # write then rename, so a crash never leaves a half written index
+    tmp_file = index_file + '.part.npz'
+    numpy.savez(tmp_file, **arrays)
+    os.replace(tmp_file, index_file)
+
+    return index_file
+
+
+@functools.lru_cache(maxsize=4)
+def load_index(shapefile=settings.WRS2, index_file=settings.WRS2_INDEX):
+    """ Load (building it from the shapefile the first time) the WRS-2 index. """
+    if not os.path.isfile(index_file):
+        build_index(shapefile, index_file)
+
+    with numpy.load(index_file) as f:
+        return Wrs2Index({k: f[k] for k in f.files})
+
+
+def wrs2_to_latlon(wrs2_path, wrs2_row, shapefile=settings.WRS2):
+    """ Convert a WRS-2 Path and Row to Latitude and Longitude """
+    index = load_index(shapefile)
+    lat, lon = index.centroid[index.find(wrs2_path, wrs2_row)]
+
+    return lat, lon
 
 
 def wrs2_to_corners(wrs2_path, wrs2_row, shapefile=settings.WRS2):
     """ Convert a WRS-2 Path and Row to Scene Corner Latitude and Longitude """
-    dataSource = ogr.Open(shapefile)
-    layer = dataSource.GetLayer()
+    index = load_index(shapefile)
+    min_lon, max_lon, min_lat, max_lat = index.envelope[index.find(wrs2_path, wrs2_row)]
 
-    for feature in layer:
-        if feature['PATH'] == wrs2_path and feature['ROW'] == wrs2_row:
-            geom = feature.GetGeometryRef()
-            return geom.GetEnvelope()[::-1]
-
-    raise ogrError('Path and Row Not Found')
+    return max_lat, min_lat, _wrap(max_lon), _wrap(min_lon)
 
 
 def latlon_to_wrs2(lat, lon, shapefile=settings.WRS2):
     """ Convert Latitude and Longitude to a WRS-2 Path and Row """
-    dataSource = ogr.Open(shapefile)
-    layer = dataSource.GetLayer()
-    point = shapely.geometry.Point(lon, lat)
+    index = load_index(shapefile)
+    inside = index.containing(lat, lon)
 
-    for feature in layer:
-        geom = feature.GetGeometryRef()
-        shape = shapely.wkt.loads(geom.ExportToWkt())
-        if point.within(shape):
-            return feature['PATH'], feature['ROW']
+    if not inside:
+        raise ogrError('Lat and Lon Not Found')
+
+    i = inside[0]
+    return int(index.path[i]), int(index.row[i])
+
+
+def latlon_to_wrs2_all(lats, lons, shapefile=settings.WRS2):
+    """
+    Find every WRS-2 Path and Row containing each of many points.
+
+    Args:
+        lats, lons: array-likes of latitude and longitude
+
+    Returns:
+        list (one entry per point) of lists of (path, row), empty where no scene covers the point
+    """
+    index = load_index(shapefile)
+    lats = numpy.atleast_1d(lats)
+    lons = numpy.atleast_1d(lons)
 
-    raise ogrError('Lat and Lon Not Found')
+    return [[(int(index.path[i]), int(index.row[i])) for i in index.containing(lat, lon)]
+            for lat, lon in zip(lats, lons)]
 
 
 if __name__ == '__main__':
     print ('Lat, Lon: ', wrs2_to_latlon(13, 33))
-    print ('WRS2: ', latlon_to_wrs2(-73.8077, 38.9073))
+    print ('WRS2: ', latlon_to_wrs2(38.9073, -73.8077))
     print ('Corners: ', wrs2_to_corners(13, 33))
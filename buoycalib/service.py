@@ -0,0 +1,273 @@
+"""
+Calibration service: a long running process that runs the forward model of
+scenes on request, over HTTP on the local machine.
+
+Between requests the process keeps what a new process would load again: the
+imported modules (GDAL, netCDF4, OpenCV), the buoy station tables, the open
+reanalysis column stores (atmo.columns), the swath indexes (sat.geoindex),
+the WRS-2 tiles, and the download session. The column stores and swath
+indexes are kept for the most recently used files only (columns.MAX_STORES,
+geoindex.MAX_INDEXES), so the memory of the process stays bounded. The pipeline stage outputs are
+on disk, so running a scene again only runs the stages whose inputs changed.
+
+API, JSON bodies:
+    POST /matchup {"scene_id": ..., "atmo": "merra", "bands": [10, 11], "remote": false, "force": false, "jobs": 4}
+        -> {"scene_id": ..., "seconds": ..., "rows": [ResultStore.query rows, dates as ISO strings]}
+        400 for a bad request, 422 when the scene has no usable buoys, 503 when the service is busy
+    GET /status -> {"running": n, "waiting": n, "served": n, "failed": n, "jobs": n, "queue": n, "uptime": s}
+    GET /metrics -> instrument report of the service, as Prometheus text
+
+Usage:
+    python -m buoycalib serve
+    python forward_model.py --server http://127.0.0.1:8765 LC08_L1TP_017030_20170703_20170715_01_T1
+"""
+import datetime
+import http.server
+import importlib
+import json
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from . import (buoy, download, instrument, results, settings)
+
+JOBS = 2   # scenes run at once
+QUEUE = 8   # requests waiting for a job slot, more are refused (503)
+
+# imported before the first request, so it does not pay for them
+WARM_MODULES = ['netCDF4', 'cv2', 'buoycalib.display', 'buoycalib.sat.landsat', 'buoycalib.sat.modis',
+                'buoycalib.sat.image_processing', 'buoycalib.sat.geoindex', 'buoycalib.atmo.merra',
+                'buoycalib.atmo.narr', 'buoycalib.atmo.provider', 'buoycalib.error_bar', 'buoycalib.modtran']
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ServiceBusy(ServiceError):
+    pass
+
+
+def warm(modules=WARM_MODULES):
+    """ import the modules and read the tables that every scene needs """
+    for name in modules:
+        importlib.import_module(name)
+
+    buoy.all_datasets()
+    download.session()
+
+
+class Service(object):
+    """
+    Runs the forward model of the requested scenes, jobs at once, and
+    appends their results to a ResultStore.
+
+    Args:
+        calibrate: function (scene_id, atmo_source, bands=, remote=, force=, preview=, workers=) -> forward
+            model output, i.e. forward.calibrate
+        db: result store file, default settings.RESULTS_DB
+        jobs: scenes run at once
+        queue: requests waiting for a job, more are refused
+    """
+    def __init__(self, calibrate, db=None, jobs=JOBS, queue=QUEUE):
+        self.calibrate = calibrate
+        self.store = results.ResultStore(db)
+        self.jobs = jobs
+        self.queue = queue
+        self.started = time.time()
+
+        self._slots = threading.BoundedSemaphore(jobs)
+        self._lock = threading.Lock()
+        self._counts = {'running': 0, 'waiting': 0, 'served': 0, 'failed': 0}
+        self._scenes = {}   # scene_id -> [lock, requests], runs of a scene share its MODTRAN and stage files
+
+    def status(self):
+        with self._lock:
+            status = dict(self._counts)
+        status.update(jobs=self.jobs, queue=self.queue, uptime=time.time() - self.started)
+        return status
+
+    def matchup(self, request):
+        """
+        Run the forward model of one scene.
+
+        Args:
+            request: dict, scene_id and optionally atmo, bands, remote, force, jobs (buoys at once)
+
+        Returns:
+            {'scene_id', 'seconds', 'rows'}, rows as ResultStore.query
+
+        Raises:
+            ValueError: bad request
+            ServiceBusy: jobs scenes are running and queue more are waiting
+            buoy.BuoyDataException: no buoys in the scene
+        """
+        scene_id = request.get('scene_id')
+        atmo_source = request.get('atmo', 'merra')
+        if not isinstance(scene_id, str) or not scene_id:
+            raise ValueError('scene_id is missing')
+        if atmo_source not in ('merra', 'narr'):
+            raise ValueError('atmo is not one of (narr, merra)')
+
+        bands = request.get('bands')
+        options = {'bands': [int(b) for b in bands] if bands else None, 'remote': bool(request.get('remote', False)),
+                   'force': bool(request.get('force', False)), 'preview': 'none'}
+        if request.get('jobs'):
+            options['workers'] = int(request['jobs'])
+
+        with self._lock:
+            if self._counts['running'] + self._counts['waiting'] >= self.jobs + self.queue:
+                raise ServiceBusy('{0} scenes running, {1} waiting'.format(self._counts['running'], self._counts['waiting']))
+            self._counts['waiting'] += 1
+            scene = self._scenes.setdefault(scene_id, [threading.Lock(), 0])
+            scene[1] += 1
+
+        try:
+            # requests for one scene (i.e. merra and narr, or a client retrying) take turns
+            with scene[0]:
+                rows, seconds = self._run(scene_id, atmo_source, options)
+        finally:
+            with self._lock:
+                scene[1] -= 1
+                if scene[1] == 0:
+                    del self._scenes[scene_id]
+
+        return {'scene_id': scene_id, 'seconds': seconds, 'rows': [dict(r, date=r['date'].isoformat()) for r in rows]}
+
+    def _run(self, scene_id, atmo_source, options):
+        """ run one scene in a job slot, (rows, seconds) """
+        self._slots.acquire()
+        with self._lock:
+            self._counts['waiting'] -= 1
+            self._counts['running'] += 1
+
+        outcome = 'failed'
+        try:
+            start = time.time()
+            with instrument.job(scene_id):
+                data = self.calibrate(scene_id, atmo_source, **options)
+            seconds = time.time() - start
+
+            added = self.store.add(scene_id, data, atmo_source, seconds=seconds)
+            rows = self.store.query(matchup=added, latest=False)   # not the buoys of earlier runs
+            outcome = 'served'
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._counts['running'] -= 1
+                self._counts[outcome] += 1
+
+        return rows, seconds
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def _reply(self, code, body, content_type='application/json'):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if code == 503:
+            self.send_header('Retry-After', '30')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+
+        if self.path == '/status':
+            self._reply(200, service.status())
+        elif self.path == '/metrics':
+            self._reply(200, instrument.prometheus(), 'text/plain; version=0.0.4')
+        else:
+            self._reply(404, {'error': 'no such path: {0}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/matchup':
+            self._reply(404, {'error': 'no such path: {0}'.format(self.path)})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode() or '{}')
+            if not isinstance(request, dict):
+                raise ValueError('request is not a JSON object')
+            self._reply(200, self.server.service.matchup(request))
+        except ServiceBusy as e:
+            self._reply(503, {'error': str(e)})
+        except buoy.BuoyDataException as e:
+            self._reply(422, {'error': str(e)})
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            traceback.print_exc()
+            self._reply(500, {'error': '{0}: {1}'.format(type(e).__name__, e)})
+
+
+def make_server(service, url=None):
+    """ http server of service, on the host and port of url (default settings.SERVICE_URL), not started """
+    address = urllib.parse.urlsplit(url or settings.SERVICE_URL)
+    port = address.port if address.port is not None else 80
+    server = http.server.ThreadingHTTPServer((address.hostname, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(service, url=None):
+    """ serve requests until interrupted """
+    server = make_server(service, url)
+    host, port = server.server_address[:2]
+    print('serving on http://{0}:{1}, {2} scenes at once'.format(host, port, service.jobs), flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# client
+
+def _request(url, body=None, timeout=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))   # a local service, never through a proxy
+
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            return json.loads(response.read().decode())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read().decode())['error']
+        except (ValueError, KeyError):
+            message = e.reason
+        raise (ServiceBusy if e.code == 503 else ServiceError)('{0} {1}: {2}'.format(e.code, url, message))
+    except urllib.error.URLError as e:
+        raise ServiceError('no calibration service at {0}: {1}'.format(url, e.reason))
+
+
+def matchup(url, scene_id, timeout=None, **options):
+    """
+    Run the forward model of a scene on the service at url.
+
+    Args:
+        options: atmo, bands, remote, force, jobs, see Service.matchup
+
+    Returns:
+        the results of the scene, as ResultStore.query rows
+    """
+    response = _request(url.rstrip('/') + '/matchup', dict(options, scene_id=scene_id), timeout)
+
+    rows = response['rows']
+    for r in rows:
+        r['date'] = datetime.datetime.fromisoformat(r['date'])
+    return rows
+
+
+def status(url, timeout=10):
+    """ the counts of the service at url, see Service.status """
+    return _request(url.rstrip('/') + '/status', timeout=timeout)
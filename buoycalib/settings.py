@@ -24,6 +24,7 @@ RSR_MODIS = {i:join(STATIC, 'modis', 'rsr.{0}.inb.final'.format(i)) for i in ran
 
 # shapefile-like things
 WRS2 = join(STATIC, 'wrs2', 'wrs2_descending.shp')
+WRS2_INDEX = join(STATIC, 'wrs2', 'wrs2_descending_index.npz')   # built from WRS2 on first use
 MODIS_TILE = join(STATIC, 'modis', 'sn_bound_10deg.txt')
 SWATH2GRID_PRM = join(STATIC, 'modis', 'swath2grid_template.prm')
 
@@ -35,9 +36,30 @@ NOAA_DIR = join(DATA_BASE, 'noaa')
 LANDSAT_DIR = join(DATA_BASE, 'landsat')
 MODIS_DIR = join(DATA_BASE, 'modis')
 MODTRAN_DIR = join(DATA_BASE, 'modtran')
+SUBSET_DIR = join(DATA_BASE, 'subset')   # reanalysis subsets, see atmo/subset.py
+COLUMN_DIR = join(DATA_BASE, 'columns')   # reanalysis column stores, see atmo/columns.py
+PIPELINE_DIR = join(DATA_BASE, 'pipeline')   # forward model stage outputs, see pipeline.py
+SWATH_DIR = join(DATA_BASE, 'swath')   # MODIS bands reprojected by swath2grid, see sat/mrt_swath.py
+
+# manifest of downloaded files, and the most bytes they may use (None is unlimited)
+MANIFEST = join(DATA_BASE, 'manifest.sqlite')
+DATA_BUDGET = None
+
+# the most bytes the column stores under COLUMN_DIR may use (None is unlimited), see atmo/columns.py
+COLUMN_BUDGET = None
+
+# forward model results, see results.py
+RESULTS_DB = 'results.sqlite'
+
+# calibration service, see service.py, local only
+SERVICE_URL = 'http://127.0.0.1:8765'
+
+# download only the reanalysis data around the buoys, instead of whole files
+ATMO_SUBSET = False
 
 MODTRAN_DATA = '/dirs/pkg/Mod4v3r1/DATA'
 MODTRAN_EXE = '/dirs/pkg/Mod4v3r1/Mod4v3r1.exe'
+SWATH2GRID_EXE = '/cis/ugrad/nid4986/repos/Senior_Project/MRTSwath/bin/swath2grid'
 
 # urls
 # TODO switch to new format strings
@@ -45,6 +67,8 @@ MERRA_URL = 'https://goldsmr5.sci.gsfc.nasa.gov/data/s4pa/MERRA2/M2I3NPASM.5.12.
 NARR_URLS = ['ftp://ftp.cdc.noaa.gov/Datasets/NARR/pressure/air.%s.nc',
              'ftp://ftp.cdc.noaa.gov/Datasets/NARR/pressure/hgt.%s.nc',
              'ftp://ftp.cdc.noaa.gov/Datasets/NARR/pressure/shum.%s.nc']
+MERRA_OPENDAP_URL = 'https://goldsmr5.gesdisc.eosdis.nasa.gov/opendap/MERRA2/M2I3NPASM.5.12.4/%s/%s/MERRA2_400.inst3_3d_asm_Np.%s.nc4'
+NARR_NCSS_URL = 'https://psl.noaa.gov/thredds/ncss/grid/Datasets/NARR/pressure/%s.%s.nc'
 NOAA_URLS = ['http://www.ndbc.noaa.gov/data/historical/stdmet/%sh%s.txt.gz',
              'http://www.ndbc.noaa.gov/data/stdmet/%s%s%s2017.txt.gz']
 LANDSAT_S3_URL = 'https://landsat-pds.s3.amazonaws.com'
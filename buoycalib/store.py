@@ -0,0 +1,273 @@
+import contextlib
+import contextvars
+import hashlib
+import itertools
+import os
+import sqlite3
+import time
+import urllib.parse
+
+from . import settings
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    url TEXT,
+    source TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT,
+    created REAL,
+    last_access REAL
+);
+CREATE TABLE IF NOT EXISTS pins (
+    path TEXT,
+    job TEXT,
+    created REAL,
+    PRIMARY KEY (path, job)
+);
+"""
+
+
+_JOB = contextvars.ContextVar('store_job', default=None)   # pins of the job running in this context, see job()
+_job_ids = itertools.count()
+
+
+class DataStoreException(Exception):
+    pass
+
+
+def sha256(filepath, chunk=1024 * 1024 * 8):
+    """ hex sha256 digest of a file """
+    h = hashlib.sha256()
+
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+class DataStore(object):
+    """
+    Manifest of the files downloaded into settings.DATA_BASE.
+
+    Each downloaded file is recorded with its url, source host, size, mtime
+    and sha256. Files are verified when they are reused: a file whose size
+    or mtime changed since it was recorded is checksummed again. When a byte
+    budget is set, the least recently used files are deleted to stay under
+    it, except files pinned by an active job.
+
+    Only files downloaded through download.url_download are tracked.
+
+    Args:
+        manifest: sqlite file holding the manifest, default settings.MANIFEST
+        budget: maximum bytes of tracked files, default settings.DATA_BUDGET (None for no limit)
+    """
+    def __init__(self, manifest=None, budget=None):
+        self.manifest = manifest if manifest is not None else settings.MANIFEST
+        self.budget = budget if budget is not None else settings.DATA_BUDGET
+        manifest = self.manifest
+
+        directory = os.path.dirname(manifest)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one short lived connection per call, so threads and processes can share the manifest
+        db = sqlite3.connect(self.manifest, timeout=60)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def record(self, filepath, url=None, checksum=None):
+        """ add (or replace) the manifest entry of a freshly downloaded file """
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+        now = time.time()
+
+        if checksum is None:
+            checksum = sha256(path)
+
+        source = urllib.parse.urlparse(url).hostname if url else None
+
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                       (path, url, source, stat.st_size, stat.st_mtime_ns, checksum, now, now))
+
+    def check(self, filepath, full=False):
+        """
+        Verify a cached file before it is reused, and mark it as used.
+
+        Args:
+            filepath: file to verify
+            full: always compare the checksum, even if size and mtime are unchanged
+
+        Returns:
+            True if the file is good, False if it is missing or does not match its
+            manifest entry (the entry is kept until the file is recorded again,
+            so later checks keep failing). Files without an entry,
+            downloaded before the manifest existed, are recorded and trusted.
+        """
+        path = os.path.abspath(filepath)
+
+        with self._connect() as db:
+            row = db.execute('SELECT size, mtime_ns, sha256 FROM files WHERE path = ?', (path,)).fetchone()
+
+        if not os.path.isfile(path):
+            self.forget(path)
+            return False
+
+        if row is None:
+            self.record(path)
+            return True
+
+        size, mtime_ns, checksum = row
+        stat = os.stat(path)
+
+        if stat.st_size != size:
+            good = False
+        elif full or stat.st_mtime_ns != mtime_ns:
+            good = sha256(path) == checksum
+        else:
+            good = True
+
+        if not good:
+            return False
+
+        with self._connect() as db:
+            db.execute('UPDATE files SET last_access = ? WHERE path = ?', (time.time(), path))
+
+        return True
+
+    def forget(self, filepath):
+        """ remove the manifest entry (not the file) """
+        with self._connect() as db:
+            db.execute('DELETE FROM files WHERE path = ?', (os.path.abspath(filepath),))
+
+    def total_size(self):
+        with self._connect() as db:
+            return db.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+
+    def pin(self, filepaths, job):
+        """ protect files from eviction until unpin(job) """
+        now = time.time()
+
+        with self._connect() as db:
+            db.executemany('INSERT OR IGNORE INTO pins VALUES (?, ?, ?)',
+                           [(os.path.abspath(f), job, now) for f in filepaths])
+
+    def unpin(self, job):
+        with self._connect() as db:
+            db.execute('DELETE FROM pins WHERE job = ?', (job,))
+
+    def use(self, filepath):
+        """ pin a file for the job running in this context (see job()), if any """
+        pins = _JOB.get()
+        if pins is not None:
+            self.pin([filepath], pins)
+
+    @contextlib.contextmanager
+    def pinned(self, filepaths, job):
+        """ files are pinned for the duration of the with block """
+        self.pin(filepaths, job)
+        try:
+            yield
+        finally:
+            self.unpin(job)
+
+    def evict(self, budget=None):
+        """
+        Delete least recently used, unpinned files until the tracked total is under budget.
+
+        Returns:
+            list of the deleted paths
+        """
+        budget = self.budget if budget is None else budget
+        if budget is None:
+            return []
+
+        with self._connect() as db:
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+            candidates = db.execute('SELECT path, size FROM files WHERE path NOT IN (SELECT path FROM pins) '
+                                    'ORDER BY last_access ASC').fetchall()
+
+        removed = []
+        for path, size in candidates:
+            if total <= budget:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            self.forget(path)
+            removed.append(path)
+            total -= size
+
+        return removed
+
+
+_default = None
+
+
+@contextlib.contextmanager
+def job(name):
+    """
+    Run a job (i.e. the match-up of a scene) in the with block.
+
+    The files download.url_download returns in the block, and in threads
+    started with its context, are pinned until it ends, so a job never
+    loses the inputs it has not read yet. When it ends, the store is
+    evicted down to its budget: eviction only happens between jobs.
+    """
+    pins = 'job:{0}:{1}:{2}'.format(name, os.getpid(), next(_job_ids))
+    token = _JOB.set(pins)
+    try:
+        yield
+    finally:
+        _JOB.reset(token)
+        default().unpin(pins)
+        default().evict()
+
+
+def default():
+    """ the DataStore for settings.DATA_BASE, shared by the whole process """
+    global _default
+
+    if _default is None:
+        _default = DataStore()
+
+    return _default
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Inspect and trim the downloaded data store.')
+    parser.add_argument('-m', '--manifest', default=None, help='Default: settings.MANIFEST.')
+    parser.add_argument('-e', '--evict', type=float, help='Evict least recently used files down to this many GB.')
+    parser.add_argument('-v', '--verify', default=False, action='store_true', help='Checksum every tracked file.')
+
+    args = parser.parse_args()
+    store = DataStore(args.manifest)
+
+    if args.verify:
+        with store._connect() as db:
+            paths = [r[0] for r in db.execute('SELECT path FROM files')]
+        for path in paths:
+            if not store.check(path, full=True):
+                print('BAD: ', path)
+
+    if args.evict is not None:
+        for path in store.evict(int(args.evict * 1e9)):
+            print('evicted: ', path)
+
+    print('tracked: {0:.3f} GB'.format(store.total_size() / 1e9))
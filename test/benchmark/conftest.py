@@ -0,0 +1,78 @@
+"""
+Offline benchmarks of the forward model hot paths, on the synthetic inputs of fixtures.py.
+
+Needs pytest-benchmark (skipped without it). Run from the repository root:
+
+    python -m pytest test/benchmark --benchmark-autosave
+
+Every run is saved under .benchmarks/ with the commit it ran on, a later run
+is compared against the last saved one, and fails when a benchmark slowed down:
+
+    python -m pytest test/benchmark --benchmark-compare --benchmark-compare-fail=mean:15%
+"""
+import os
+import shutil
+import tempfile
+import types
+
+import pytest
+
+from buoycalib import (settings, store)
+from buoycalib.atmo import columns
+
+from . import fixtures
+
+# settings pointed at the synthetic data for the session
+PATCHED = ['NOAA_DIR', 'MERRA_DIR', 'NARR_DIR', 'LANDSAT_DIR', 'MODIS_DIR', 'MODTRAN_DIR', 'COLUMN_DIR',
+           'PIPELINE_DIR', 'MANIFEST', 'MODTRAN_EXE', 'MODTRAN_DATA', 'ATMO_SUBSET']
+
+
+@pytest.fixture(scope='session')
+def data():
+    """ the synthetic inputs, written once, in the directories the forward model downloads to """
+    directory = tempfile.mkdtemp(prefix='buoycalib_benchmark_')
+    saved = {name: getattr(settings, name) for name in PATCHED}
+
+    for name in PATCHED[:8]:
+        setattr(settings, name, os.path.join(directory, name.lower()[:-4]))
+        os.makedirs(getattr(settings, name), exist_ok=True)
+    settings.MANIFEST = os.path.join(directory, 'manifest.sqlite')
+    settings.MODTRAN_DATA = os.path.join(directory, 'DATA')
+    settings.ATMO_SUBSET = False
+    os.makedirs(settings.MODTRAN_DATA)
+
+    store._default = store.DataStore(settings.MANIFEST)
+    columns._STORES.clear()
+
+    tape6 = fixtures.write_tape6(os.path.join(directory, 'tape6'))
+    settings.MODTRAN_EXE = fixtures.write_modtran_exe(directory, tape6)
+
+    yield types.SimpleNamespace(
+        directory=directory,
+        ndbc=fixtures.write_ndbc(settings.NOAA_DIR),
+        merra=fixtures.write_merra(settings.MERRA_DIR),
+        narr=fixtures.write_narr(settings.NARR_DIR),
+        tape6=tape6,
+        mod03=fixtures.write_mod03_geolocation(settings.MODIS_DIR),
+    )
+
+    for name, value in saved.items():
+        setattr(settings, name, value)
+    store._default = None
+    columns._STORES.clear()
+    shutil.rmtree(directory)
+
+
+@pytest.fixture(scope='session')
+def landsat(data):
+    """ directory and metadata of the synthetic landsat scene, skipped without a working GDAL """
+    gdal = pytest.importorskip('osgeo.gdal')
+    if not hasattr(gdal, 'GetDriverByName') or gdal.GetDriverByName('GTiff') is None:
+        pytest.skip('GDAL has no GTiff driver')
+
+    from buoycalib.sat import landsat as landsat_
+
+    directory = os.path.join(settings.LANDSAT_DIR, fixtures.SCENE_ID)
+    mtl = fixtures.write_landsat(directory)
+
+    return directory, landsat_.read_metadata(mtl)
@@ -0,0 +1,225 @@
+"""
+Synthetic stand-ins for the downloaded inputs of the forward model.
+
+Each function writes files shaped like the real ones (same formats, names,
+variables and a realistic size for one buoy match-up), filled with plausible
+values from a fixed seed, so benchmarks run offline and are repeatable.
+"""
+import datetime
+import gzip
+import os
+import stat
+
+import numpy
+import netCDF4
+
+BUOY_ID = '44009'   # DELAWARE BAY, 38.461 N 74.703 W
+BUOY_LAT, BUOY_LON = 38.461, -74.703
+DATE = datetime.datetime(2017, 7, 3, 15, 40, 12)
+SCENE_ID = 'LC08_L1TP_014033_20170703_20170715_01_T1'
+MOD03_ID = 'MOD03.A2017184.1540.006.2017185011013.hdf'
+
+NDBC_HEADER = ('#YY  MM DD hh mm WDIR WSPD GST  WVHT   DPD   APD MWD   PRES  ATMP  WTMP  DEWP  VIS  TIDE\n'
+               '#yr  mo dy hr mn degT m/s  m/s     m   sec   sec degT   hPa  degC  degC  degC  nmi    ft\n')
+
+
+def write_ndbc(directory, buoy_id=BUOY_ID, year=DATE.year):
+    """ a year of hourly NDBC standard meteorological data, gzipped like the historical files """
+    rng = numpy.random.RandomState(0)
+    filepath = os.path.join(directory, '{0}h{1}.txt.gz'.format(buoy_id, year))
+
+    start = datetime.datetime(year, 1, 1)
+    hours = (datetime.datetime(year + 1, 1, 1) - start).days * 24
+
+    with gzip.open(filepath, 'wt') as f:
+        f.write(NDBC_HEADER)
+        for h in range(hours):
+            d = start + datetime.timedelta(hours=h, minutes=50)
+            season = numpy.sin(2 * numpy.pi * (h / hours - 0.3))
+            wtmp = 16 + 8 * season + rng.normal(0, 0.2)
+            atmp = wtmp + rng.normal(0, 1)
+            f.write('{0:%Y %m %d %H %M} {1:3d} {2:4.1f} {3:4.1f} {4:5.2f} {5:5.2f} {6:5.2f} {7:3d} {8:6.1f} {9:5.1f} '
+                    '{10:5.1f} {11:5.1f} 99.0 99.00\n'.format(
+                        d, rng.randint(0, 360), rng.uniform(3, 6), rng.uniform(6, 9), rng.uniform(0.5, 2),
+                        rng.uniform(4, 9), rng.uniform(3, 6), rng.randint(0, 360), rng.normal(1015, 5),
+                        atmp, wtmp, atmp - rng.uniform(1, 5)))
+
+    return filepath
+
+
+def _profiles(rng, shape, levels):
+    """ temperature [K], relative humidity [%] and height [m] on pressure levels [hPa], plus noise """
+    height = 44330.0 * (1 - (levels / 1013.25) ** 0.1903)   # standard atmosphere
+    temp = numpy.maximum(288.15 - 0.0065 * height, 216.65)
+    relhum = numpy.clip(80 * (levels / 1000.0) ** 2, 1, 100)
+
+    def _field(profile, noise):
+        return profile[None, :, None, None] + rng.normal(0, noise, shape).astype(numpy.float32)
+
+    return _field(temp, 1.0), numpy.clip(_field(relhum, 5.0), 0, 100), _field(height, 10.0)
+
+
+def write_merra(directory, date=DATE, lats=(30, 45), lons=(-80, -65)):
+    """ a MERRA-2 inst3_3d_asm_Np day, over a region around the buoy, at the real grid spacing """
+    rng = numpy.random.RandomState(1)
+    filepath = os.path.join(directory, 'MERRA2_400.inst3_3d_asm_Np.{0:%Y%m%d}.nc4'.format(date))
+
+    lat = numpy.arange(lats[0], lats[1] + 0.25, 0.5)
+    lon = numpy.arange(lons[0], lons[1], 0.625)
+    lev = numpy.array([1000, 975, 950, 925, 900, 875, 850, 825, 800, 775, 750, 725, 700, 650, 600, 550, 500,
+                       450, 400, 350, 300, 250, 200, 150, 100, 70, 50, 40, 30, 20, 10, 7, 5, 4, 3, 2, 1, 0.7,
+                       0.5, 0.4, 0.3, 0.1], dtype=numpy.float64)
+    shape = (8, len(lev), len(lat), len(lon))
+
+    with netCDF4.Dataset(filepath, 'w', format='NETCDF4') as ds:
+        for name, values in (('time', numpy.arange(8) * 180), ('lev', lev), ('lat', lat), ('lon', lon)):
+            ds.createDimension(name, len(values))
+            ds.createVariable(name, 'f8', (name,))[:] = values
+        ds.variables['time'].units = 'minutes since {0:%Y-%m-%d} 00:00:00'.format(date)
+
+        for name, values in zip(('T', 'RH', 'H'), _profiles(rng, shape, lev)):
+            var = ds.createVariable(name, 'f4', ('time', 'lev', 'lat', 'lon'), fill_value=1e15, zlib=True)
+            values = numpy.ma.masked_array(values)
+            values[:, :2, :4, :4] = numpy.ma.masked   # below the surface, over land
+            var[:] = values
+
+    return filepath
+
+
+def write_narr(directory, date=DATE, days=2):
+    """ NARR monthly air, hgt and shum files (the first days of the month), on a curvilinear grid """
+    rng = numpy.random.RandomState(2)
+
+    level = numpy.array([1000, 975, 950, 925, 900, 875, 850, 825, 800, 775, 750, 725, 700, 650, 600, 550, 500,
+                         450, 400, 350, 300, 275, 250, 225, 200, 175, 150, 125, 100], dtype=numpy.float64)
+    y, x = numpy.meshgrid(numpy.arange(50), numpy.arange(60), indexing='ij')
+    lat = 28 + 0.3 * y + 0.02 * x   # rotated, like the lambert conformal grid
+    lon = -85 + 0.4 * x - 0.03 * y
+    times = numpy.arange(days * 8) * 3.0
+
+    temp, relhum, height = _profiles(rng, (len(times), len(level), 50, 60), level)
+    shum = (relhum / 100.0 * 0.01 * (level / 1000.0)[None, :, None, None]).astype(numpy.float32)
+
+    files = []
+    for name, values in (('air', temp), ('hgt', height), ('shum', shum)):
+        filepath = os.path.join(directory, '{0}.{1:%Y%m}.nc'.format(name, date))
+
+        with netCDF4.Dataset(filepath, 'w', format='NETCDF4') as ds:
+            ds.createDimension('time', len(times))
+            ds.createDimension('level', len(level))
+            ds.createDimension('y', 50)
+            ds.createDimension('x', 60)
+            ds.createVariable('time', 'f8', ('time',))[:] = times
+            ds.variables['time'].units = 'hours since {0:%Y-%m}-01 00:00:00'.format(date)
+            ds.createVariable('level', 'f4', ('level',))[:] = level
+            ds.createVariable('lat', 'f4', ('y', 'x'))[:] = lat
+            ds.createVariable('lon', 'f4', ('y', 'x'))[:] = lon
+            ds.createVariable(name, 'f4', ('time', 'level', 'y', 'x'), zlib=True)[:] = values
+
+        files.append(filepath)
+
+    return files
+
+
+def write_tape6(filepath):
+    """ the spectral radiance table of a MODTRAN tape6, 710 to 1120 cm-1 every 1 cm-1 """
+    freq = numpy.arange(710.0, 1121.0)
+    wavlen = 1e4 / freq
+
+    # smooth, plausible over water in summer: [W cm-2 sr-1 um-1], transmission [0-1]
+    trans = 0.55 + 0.3 * numpy.exp(-((wavlen - 10.8) / 1.5) ** 2)
+    path_thermal = (1 - trans) * 8e-4
+    ground_refl = 1e-5 * (1 - trans)
+    total = path_thermal + trans * 9.5e-4 + ground_refl
+
+    with open(filepath, 'w') as f:
+        f.write(' ****** MODTRAN canned output, see test/benchmark/fixtures.py ******\n\n')
+        f.write('  FREQ   WAVLEN   PATH THERMAL      SURFACE EMISSION      SOLAR SCATTER    GROUND REFLECT    '
+                '      TOTAL RADIANCE     INTEGRAL     TOTAL\n')
+        f.write(' (CM-1)  (MICRN)  (W CM-2 SR-1 / CM-1) (W CM-2 SR-1 / MICRN) ...\n\n')
+        for i in range(len(freq)):
+            row = [freq[i], wavlen[i], path_thermal[i] * wavlen[i] ** 2 / 1e4, path_thermal[i], 0.0, 0.0, 0.0, 0.0,
+                   ground_refl[i] * wavlen[i] ** 2 / 1e4, ground_refl[i], 0.0, total[i] * wavlen[i] ** 2 / 1e4,
+                   total[i], 0.0, trans[i]]
+            f.write('{0:8.2f} {1:9.4f} '.format(*row[:2]) + ' '.join('{0:.6E}'.format(v) for v in row[2:]) + '\n')
+
+    return filepath
+
+
+def write_modtran_exe(directory, tape6):
+    """ a stand-in for the MODTRAN executable, which copies the canned tape6 where it runs """
+    exe = os.path.join(directory, 'modtran.sh')
+
+    with open(exe, 'w') as f:
+        f.write('#!/bin/sh\ncp {0} tape6\n'.format(tape6))
+    os.chmod(exe, stat.S_IRWXU)
+
+    return exe
+
+
+def write_landsat(directory, scene_id=SCENE_ID, date=DATE, size=1024):
+    """
+    Landsat 8 bands 10 and 11 (uint16 GeoTIFFs, 30 m UTM grid) around the buoy, and the MTL file.
+    Needs GDAL.
+    """
+    from osgeo import gdal, osr
+    import utm
+
+    rng = numpy.random.RandomState(3)
+    os.makedirs(directory, exist_ok=True)
+
+    x, y, zone, __ = utm.from_latlon(BUOY_LAT, BUOY_LON)
+    ulx, uly = x - size * 15, y + size * 15   # buoy in the middle
+
+    srs = osr.SpatialReference()
+    srs.SetUTM(zone, True)
+    srs.SetWellKnownGeogCS('WGS84')
+
+    driver = gdal.GetDriverByName('GTiff')
+    names = {}
+    for band in (10, 11):
+        names[band] = '{0}_B{1}.TIF'.format(scene_id, band)
+        ds = driver.Create(os.path.join(directory, names[band]), size, size, 1, gdal.GDT_UInt16, ['TILED=YES'])
+        ds.SetGeoTransform((ulx, 30.0, 0.0, uly, 0.0, -30.0))
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).WriteArray(rng.normal(30000, 300, (size, size)).astype(numpy.uint16))
+        ds = None
+
+    ul_lat, ul_lon = utm.to_latlon(ulx, uly, zone, northern=True)
+    lr_lat, lr_lon = utm.to_latlon(ulx + size * 30, uly - size * 30, zone, northern=True)
+
+    mtl = os.path.join(directory, '{0}_MTL.txt'.format(scene_id))
+    with open(mtl, 'w') as f:
+        f.write('GROUP = L1_METADATA_FILE\n  GROUP = PRODUCT_METADATA\n')
+        f.write('    DATE_ACQUIRED = {0:%Y-%m-%d}\n    SCENE_CENTER_TIME = "{0:%H:%M:%S}.0000000Z"\n'.format(date))
+        f.write('    CORNER_UR_LAT_PRODUCT = {0:.5f}\n    CORNER_UR_LON_PRODUCT = {1:.5f}\n'.format(ul_lat, lr_lon))
+        f.write('    CORNER_LL_LAT_PRODUCT = {0:.5f}\n    CORNER_LL_LON_PRODUCT = {1:.5f}\n'.format(lr_lat, ul_lon))
+        for band in (10, 11):
+            f.write('    FILE_NAME_BAND_{0} = "{1}"\n'.format(band, names[band]))
+        f.write('  END_GROUP = PRODUCT_METADATA\n  GROUP = RADIOMETRIC_RESCALING\n')
+        for band in (10, 11):
+            f.write('    RADIANCE_MULT_BAND_{0} = 3.3420E-04\n    RADIANCE_ADD_BAND_{0} = 0.10000\n'.format(band))
+        f.write('  END_GROUP = RADIOMETRIC_RESCALING\n  GROUP = PROJECTION_PARAMETERS\n')
+        f.write('    UTM_ZONE = {0}\n  END_GROUP = PROJECTION_PARAMETERS\nEND_GROUP = L1_METADATA_FILE\nEND\n'.format(zone))
+
+    return mtl
+
+
+def write_mod03_geolocation(directory, granule=MOD03_ID, rows=2030, cols=1354):
+    """
+    The geolocation of a MOD03 granule as geoindex persists it (granule + '.geoindex.npz'),
+    a 1 km swath over the buoy, so geoindex.load skips the HDF read.
+    """
+    r, c = numpy.meshgrid(numpy.arange(rows), numpy.arange(cols), indexing='ij')
+
+    # along track northward, across track widening towards the swath edges (the bow tie)
+    scan = (c - cols / 2.0) / (cols / 2.0)
+    lat = 28.0 + r * 0.009 + 0.1 * scan ** 2
+    lon = BUOY_LON + scan * 11.5 * (1 + 0.3 * scan ** 2) / numpy.cos(numpy.radians(lat))
+    lat[:, :3] = lon[:, :3] = -999.0   # missing geolocation
+
+    filepath = os.path.join(directory, granule)
+    open(filepath, 'w').close()
+    numpy.savez(filepath + '.geoindex.npz', lat=lat.astype(numpy.float32), lon=lon.astype(numpy.float32))
+
+    return filepath
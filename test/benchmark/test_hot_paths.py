@@ -0,0 +1,85 @@
+import numpy
+import pytest
+
+from buoycalib import (buoy, interp, modtran, radiance, settings)
+from buoycalib.atmo import (columns, funcs, merra, narr)
+from buoycalib.sat import geoindex
+
+from . import fixtures
+
+pytest.importorskip('pytest_benchmark')
+
+# the 10 buoys of a busy scene, around the fixture buoy
+LATS = fixtures.BUOY_LAT + numpy.linspace(-2, 2, 10)
+LONS = fixtures.BUOY_LON + numpy.linspace(-3, 3, 10)
+
+
+def test_buoy_load(benchmark, data):
+    values, headers, dates, units = benchmark(buoy.load, data.ndbc)
+    assert len(dates) == 365 * 24 and 'WTMP' in headers
+
+
+def test_choose_points(benchmark, data):
+    store = columns.load('merra', data.merra)
+    idxs, coordinates = benchmark(funcs.choose_points, store.lat, store.lon, fixtures.BUOY_LAT, fixtures.BUOY_LON)
+    assert len(coordinates) == 4
+
+
+def test_columns_around_many(benchmark, data):
+    store = columns.load('merra', data.merra)
+    results = benchmark(store.around_many, [fixtures.DATE] * len(LATS), LATS, LONS)
+    assert len(results) == len(LATS)
+
+
+def test_idw(benchmark, data):
+    store = columns.load('merra', data.merra)
+    coordinates, __, profiles = store.around(fixtures.DATE, fixtures.BUOY_LAT, fixtures.BUOY_LON)
+
+    temp = benchmark(interp.idw, profiles['T'][0], coordinates, [fixtures.BUOY_LAT, fixtures.BUOY_LON])
+    assert temp.shape == (len(store.levels),)
+
+
+def test_merra_process(benchmark, data):
+    height, press, temp, relhum = benchmark(merra.process, fixtures.DATE, fixtures.BUOY_LAT, fixtures.BUOY_LON)
+    assert len(height) == len(temp)
+
+
+def test_narr_process(benchmark, data):
+    height, press, temp, relhum = benchmark(narr.process, fixtures.DATE.replace(day=1), fixtures.BUOY_LAT,
+                                            fixtures.BUOY_LON)
+    assert len(height) == len(temp)
+
+
+def test_parse_tape6(benchmark, data):
+    wavelengths, path_thermal, ground_refl, total, trans = benchmark(modtran.parse_tape6, data.tape6)
+    assert len(wavelengths) == 411 and numpy.all(numpy.diff(wavelengths) > 0)
+
+
+def test_modeled_ltoa(benchmark, data):
+    wavelengths, path_thermal, ground_refl, total, trans = modtran.parse_tape6(data.tape6)
+    rsr_wavelengths, rsr = numpy.loadtxt(settings.RSR_L8[10], unpack=True)
+
+    def _ltoa():
+        spectral = radiance.calc_ltoa_spectral(wavelengths, path_thermal, ground_refl, trans, 295.0)
+        return radiance.calc_ltoa(wavelengths, spectral, rsr_wavelengths, rsr)
+
+    assert 5 < benchmark(_ltoa) < 15
+
+
+def test_landsat_calc_ltoa(benchmark, landsat):
+    from buoycalib.sat import landsat as landsat_
+
+    directory, metadata = landsat
+    ltoa = benchmark(landsat_.calc_ltoa, directory, metadata, fixtures.BUOY_LAT, fixtures.BUOY_LON, 10)
+    assert 9 < ltoa < 11
+
+
+def test_swath_index(benchmark, data):
+    with numpy.load(geoindex.index_path(data.mod03)) as f:
+        lat, lon = f['lat'], f['lon']
+
+    def _lookup():
+        return geoindex.SwathIndex(lat, lon).query(LATS, LONS)
+
+    rows, cols, distances = benchmark(_lookup)
+    assert numpy.all(distances < 2.0)
@@ -0,0 +1,49 @@
+import os
+
+import numpy
+import pytest
+
+from buoycalib import (buoy, modtran, radiance, settings)
+from buoycalib.atmo import merra
+
+from . import fixtures
+
+pytest.importorskip('pytest_benchmark')
+
+
+def matchup(buoy_id, date, directory):
+    """ modeled radiance of one buoy: buoy data -> atmosphere -> MODTRAN -> band radiances """
+    buoy_file = buoy.download(buoy_id, date, settings.NOAA_DIR)
+    lat, lon, depth, bulk_temp, skin_temp, lower_atmo = buoy.info(buoy_id, buoy_file, date)
+
+    atmosphere = merra.process(date, lat, lon)
+    wavelengths, upwell_rad, gnd_reflect, transmission = modtran.process(atmosphere, lat, lon, date, directory, skin_temp)
+    spectral = radiance.calc_ltoa_spectral(wavelengths, upwell_rad, gnd_reflect, transmission, skin_temp)
+
+    ltoa = {}
+    for b in (10, 11):
+        rsr_wavelengths, rsr = numpy.loadtxt(settings.RSR_L8[b], unpack=True)
+        ltoa[b] = radiance.calc_ltoa(wavelengths, spectral, rsr_wavelengths, rsr)
+
+    return ltoa
+
+
+def test_matchup(benchmark, data):
+    directory = os.path.join(settings.MODTRAN_DIR, '{0}_{1}'.format(fixtures.SCENE_ID, fixtures.BUOY_ID))
+    ltoa = benchmark(matchup, fixtures.BUOY_ID, fixtures.DATE, directory)
+
+    assert all(5 < ltoa[b] < 15 for b in ltoa)
+
+
+def test_matchup_with_image(benchmark, data, landsat):
+    from buoycalib.sat import landsat as landsat_
+
+    scene_directory, metadata = landsat
+    directory = os.path.join(settings.MODTRAN_DIR, '{0}_{1}'.format(fixtures.SCENE_ID, fixtures.BUOY_ID))
+
+    def _matchup():
+        modeled = matchup(fixtures.BUOY_ID, fixtures.DATE, directory)
+        image = {b: landsat_.calc_ltoa(scene_directory, metadata, fixtures.BUOY_LAT, fixtures.BUOY_LON, b) for b in modeled}
+        return {b: image[b] - modeled[b] for b in modeled}
+
+    assert len(benchmark(_matchup)) == 2
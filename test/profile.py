@@ -3,17 +3,25 @@ import os, sys
 from os import path
 
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
-import bin.BuoyCalib as bc
-
-def do_buoycalib_things():
-    LID = 'LC80130332013145LGN00'
-    x = bc.CalibrationController(LID, None, '/dirs/home/ugrad/nid4986/Landsat_Buoy_Calibration/data/scenes',verbose=False)  # initialize
-    x.calc_all()
-    print str(x)   # sorry, str() necesary for now. calculate and assign
-    
+import forward_model
+from buoycalib import instrument
+
+SCENE_ID = 'LC08_L1TP_017030_20170703_20170715_01_T1'
+
+
+def do_buoycalib_things(scene_id=SCENE_ID):
+    with instrument.job(scene_id):
+        ret = forward_model.landsat8(scene_id, preview='none')
+    print(ret)
+
+
 if __name__ == '__main__':
-    cProfile.run('do_buoycalib_things()', 'profileresults')
+    scene_id = sys.argv[1] if len(sys.argv) > 1 else SCENE_ID
+
+    cProfile.run('do_buoycalib_things(scene_id)', 'profileresults')
     p = pstats.Stats('profileresults')
-    
+
     p.sort_stats('cumulative').print_stats(50)
-    
+
+    # time and resources by stage, see buoycalib/instrument.py
+    print(instrument.prometheus())
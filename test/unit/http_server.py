@@ -0,0 +1,102 @@
+""" Local stand-in HTTP server for tests, serves in memory files and honors Range requests. """
+import gzip
+import http.server
+import re
+import threading
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def _respond(self, body):
+        server = self.server
+        server.requests.append((self.command, self.path, dict(self.headers)))
+
+        path = self.path.split('?')[0]
+        if server.handler is not None:
+            data = server.handler(self)
+            if data is None:   # handler already answered
+                return
+        elif path in server.files:
+            data = server.files[path]
+        else:
+            self.send_error(404)
+            return
+
+        if server.encoding == 'gzip':   # whatever the client accepts
+            data = gzip.compress(data)
+
+        start, end = 0, len(data) - 1
+        status = 200
+
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match and server.ranges:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(len(data)))
+                self.end_headers()
+                return
+            end = min(end, len(data) - 1)
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes' if server.ranges else 'none')
+        if server.encoding:
+            self.send_header('Content-Encoding', server.encoding)
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, len(data)))
+        self.end_headers()
+
+        if body:
+            self.wfile.write(data[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(object):
+    """
+    Context manager running a threaded HTTP server on localhost.
+
+    Args:
+        files: dict of url path -> bytes to serve
+        ranges: honor Range headers (206 responses)
+        handler: optional callable(request_handler) -> bytes, used instead of files
+        encoding: 'gzip' to send every file compressed, with a Content-Encoding header
+    """
+    def __init__(self, files=None, ranges=True, handler=None, encoding=None):
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.httpd.files = files if files is not None else {}
+        self.httpd.ranges = ranges
+        self.httpd.handler = handler
+        self.httpd.encoding = encoding
+        self.httpd.requests = []
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}'.format(self.httpd.server_address[1])
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def files(self):
+        return self.httpd.files
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from buoycalib import (aio, download, store)
+
+from .http_server import LocalServer
+
+
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        store._default = store.DataStore(os.path.join(self.directory, 'manifest.sqlite'))
+        self.limits = aio.PER_HOST, aio.SUBPROCESSES
+
+    def tearDown(self):
+        aio.PER_HOST, aio.SUBPROCESSES = self.limits
+        store._default = None
+        shutil.rmtree(self.directory)
+
+    def test_download_many_per_host(self):
+        aio.PER_HOST = 2
+        files = {'/{0}.bin'.format(i): os.urandom(1000 + i) for i in range(8)}
+        lock = threading.Lock()
+        in_flight = [0, 0]   # now, most
+
+        def _slow(handler):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return files[handler.path]
+
+        with LocalServer(handler=_slow) as server:
+            paths = asyncio.run(aio.download_many([(server.url + name, self.directory) for name in sorted(files)]))
+
+        self.assertEqual(in_flight[1], 2)
+        for name, path in zip(sorted(files), paths):
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), files[name])
+
+    def test_download_many_raises(self):
+        with LocalServer({'/a.bin': b'a'}) as server:
+            downloads = [(server.url + '/missing.bin', self.directory), (server.url + '/a.bin', self.directory)]
+            self.assertRaises(download.RemoteFileException, asyncio.run, aio.download_many(downloads))
+
+        self.assertTrue(os.path.isfile(os.path.join(self.directory, 'a.bin')))   # the others finished
+
+    def test_run(self):
+        aio.SUBPROCESSES = 2
+
+        async def _runs():
+            return await asyncio.gather(*[aio.run(['sh', '-c', 'sleep 0.2; pwd -P'], cwd=self.directory) for __ in range(4)])
+
+        start = time.time()
+        outputs = asyncio.run(_runs())
+
+        self.assertGreaterEqual(time.time() - start, 0.4)   # two at a time
+        self.assertEqual(set(outputs), {os.path.realpath(self.directory).encode() + b'\n'})
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            asyncio.run(aio.run(['sh', '-c', 'exit 3']))
@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from buoycalib import batch
+
+
+class NoBuoys(Exception):
+    pass
+
+
+def process(scene_id):
+    """ stand-in forward model: 'flaky' scenes fail the first time, 'empty' ones always """
+    if scene_id.startswith('empty'):
+        raise NoBuoys('no buoys in scene')
+
+    if scene_id.startswith('flaky'):
+        marker = os.path.join(os.environ['BATCH_TEST_DIR'], scene_id)
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            raise IOError('connection reset')
+
+    return {'scene': scene_id, 'pid': os.getpid()}
+
+
+def claim_all(queue_path, claimed):
+    queue = batch.JobQueue(queue_path)
+    while True:
+        scenes = queue.claim(batch.worker_name())
+        if not scenes:
+            return
+        claimed.extend(scenes)
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.environ['BATCH_TEST_DIR'] = self.directory
+        self.path = os.path.join(self.directory, 'jobs.sqlite')
+        self.queue = batch.JobQueue(self.path, backoff=0.0)
+
+    def tearDown(self):
+        del os.environ['BATCH_TEST_DIR']
+        shutil.rmtree(self.directory)
+
+    def test_add_keeps_order(self):
+        self.assertEqual(self.queue.add(['c', 'a', 'c', '', 'b', 'a']), 3)
+        self.assertEqual(self.queue.add(['a', 'd']), 1)   # resumed batch, only the new scene
+
+        self.assertEqual(self.queue.claim('w', 10), ['c', 'a', 'b', 'd'])
+        self.assertEqual(self.queue.claim('w', 10), [])
+
+    def test_claims_group_together(self):
+        scenes = ['a1', 'b1', 'a2', 'c1', 'b2', 'a3']
+        self.queue.add(scenes, group=lambda scene_id: scene_id[0])
+
+        self.assertEqual(self.queue.claim('w', 2), ['a1', 'a2'])
+        self.assertEqual(self.queue.claim('w', 3), ['b1', 'b2'])   # never more than one group
+        self.assertEqual(self.queue.claim('w', 3), ['c1'])
+        self.assertEqual(self.queue.claim('w', 3), ['a3'])
+
+    def test_retry_with_backoff(self):
+        queue = batch.JobQueue(self.path, retries=2, backoff=60.0)
+        queue.add(['a'])
+
+        queue.claim('w')
+        queue.fail('a', 'connection reset')
+        self.assertEqual(queue.claim('w'), [])   # waiting on the backoff
+        self.assertEqual(queue.progress()['pending'], 1)
+
+        queue.retry_failed()   # no effect, it has not failed yet
+        queue.backoff = 0.0
+        with queue._transaction() as db:
+            db.execute('UPDATE jobs SET not_before = 0')
+
+        self.assertEqual(queue.claim('w'), ['a'])
+        queue.fail('a', 'connection reset')
+        self.assertEqual(queue.progress()['failed'], 1)
+        self.assertEqual(queue.errors(), [('a', 2, 'connection reset')])
+
+        self.assertEqual(queue.retry_failed(), 1)
+        self.assertEqual(queue.claim('w'), ['a'])
+
+    def test_stale_job_claimed_again(self):
+        queue = batch.JobQueue(self.path, stale_after=0.5)
+        queue.add(['a', 'b'])
+
+        self.assertEqual(queue.claim('crashed', 2), ['a', 'b'])
+        self.assertEqual(queue.claim('w'), [])
+
+        time.sleep(0.6)
+        queue.heartbeat('crashed')   # still alive after all
+        self.assertEqual(queue.claim('w'), [])
+
+        time.sleep(0.6)
+        self.assertEqual(queue.claim('w'), ['a'])
+
+    def test_claims_between_processes(self):
+        scenes = ['scene{0:03d}'.format(i) for i in range(200)]
+        self.queue.add(scenes)
+
+        with multiprocessing.Manager() as manager:
+            claimed = manager.list()
+            workers = [multiprocessing.Process(target=claim_all, args=(self.path, claimed)) for __ in range(4)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+
+            self.assertEqual(sorted(claimed), scenes)   # each scene exactly once
+
+    def test_run_and_resume(self):
+        scenes = ['a', 'flaky1', 'empty', 'b', 'flaky2', 'c']
+        self.queue.add(scenes[:4])
+
+        progress = batch.run(self.queue, process, workers=2, permanent=(NoBuoys,), report_every=0.1)
+
+        self.assertEqual((progress['done'], progress['failed'], progress['total']), (3, 1, 4))
+        self.assertEqual([s for s, r in self.queue.results()], ['a', 'flaky1', 'b'])
+        self.assertEqual(self.queue.errors()[0][:2], ('empty', 1))   # not retried
+
+        # resumed with more scenes, only the new ones run
+        self.queue.add(scenes)
+        before = dict(self.queue.results())
+        batch.work(self.queue, process)
+
+        results = self.queue.results()
+        self.assertEqual([s for s, r in results], ['a', 'flaky1', 'b', 'flaky2', 'c'])
+        self.assertEqual(dict(results)['a'], before['a'])
+        self.assertGreater(self.queue.progress()['rate'], 0)
+
+    def test_heartbeat_while_processing(self):
+        queue = batch.JobQueue(self.path, stale_after=0.4)
+        queue.add(['slow', 'b'], group=lambda scene_id: '')
+        other = batch.JobQueue(self.path, stale_after=0.4)
+        claimed = []
+
+        def slow(scene_id):
+            if scene_id == 'slow':
+                time.sleep(1.0)   # longer than stale_after, kept alive by the heartbeat
+                claimed.extend(other.claim('other'))
+            return scene_id
+
+        batch.work(queue, slow, lookahead=1)
+
+        self.assertEqual(claimed, [])
+        self.assertEqual([s for s, r in queue.results()], ['slow', 'b'])
+
+    def test_failed_hooks(self):
+        self.queue.add(['a', 'b'])
+
+        def broken(*args):
+            raise IOError('connection reset')
+
+        with self.assertWarnsRegex(RuntimeWarning, 'connection reset'):
+            batch.work(self.queue, process, lookahead=1, prefetch=broken, prepare=broken)
+
+        self.assertEqual([s for s, r in self.queue.results()], ['a', 'b'])
+
+    def test_interrupted_jobs_released(self):
+        self.queue.add(['a', 'b', 'c'], group=lambda scene_id: '')
+
+        def interrupted(scene_id):
+            if scene_id == 'b':
+                raise KeyboardInterrupt
+            return scene_id
+
+        self.assertRaises(KeyboardInterrupt, batch.work, self.queue, interrupted, lookahead=2)
+
+        # pending again at once, without an attempt counted
+        self.assertEqual(self.queue.progress()['pending'], 2)
+        self.assertEqual(self.queue.claim('w', 3), ['b', 'c'])
+        with self.queue._connect() as db:
+            self.assertEqual(db.execute('SELECT SUM(attempts) FROM jobs').fetchone()[0], 0)
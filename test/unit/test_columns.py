@@ -0,0 +1,154 @@
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy
+import netCDF4
+
+from buoycalib import settings
+from buoycalib.atmo import (columns, funcs)
+
+LAT = numpy.arange(30, 45.5, 0.5)
+LON = numpy.arange(-80, -65, 0.625)
+LEV = numpy.linspace(1000, 0.1, 42)
+
+
+def write_merra(filepath, offset=0.0):
+    """ small synthetic MERRA-2 day, with the lowest level missing over part of the grid """
+    rng = numpy.random.RandomState(0)
+
+    with netCDF4.Dataset(filepath, 'w', format='NETCDF4') as ds:
+        for name, values in (('time', numpy.arange(8) * 180), ('lev', LEV), ('lat', LAT), ('lon', LON)):
+            ds.createDimension(name, len(values))
+            ds.createVariable(name, 'f8', (name,))[:] = values
+        ds.variables['time'].units = 'minutes since 2017-07-03 00:00:00'
+
+        dims = ('time', 'lev', 'lat', 'lon')
+        shape = (8, len(LEV), len(LAT), len(LON))
+        for name in ('T', 'RH', 'H'):
+            var = ds.createVariable(name, 'f4', dims, fill_value=1e15)
+            values = numpy.ma.masked_array(rng.uniform(0, 300, shape) + offset)
+            values[:, 0, :5, :5] = numpy.ma.masked
+            var[:] = values
+
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.column_dir = settings.COLUMN_DIR
+        settings.COLUMN_DIR = os.path.join(self.directory, 'columns')
+
+        self.filename = os.path.join(self.directory, 'MERRA2_400.inst3_3d_asm_Np.20170703.nc4')
+        write_merra(self.filename)
+
+    def tearDown(self):
+        settings.COLUMN_DIR = self.column_dir
+        columns._STORES.clear()
+        shutil.rmtree(self.directory)
+
+    def test_profiles_match_netcdf(self):
+        store = columns.load('merra', self.filename)
+
+        lat, lon = numpy.meshgrid(LAT, LON, indexing='ij')
+        idxs, __ = funcs.choose_points(lat, lon, 38.9, -73.8)
+
+        with netCDF4.Dataset(self.filename) as ds:
+            for name in ('T', 'RH', 'H'):
+                for t in (0, 5):
+                    expected = ds.variables[name][t][:, idxs[0], idxs[1]].T
+                    numpy.testing.assert_array_almost_equal(store.profiles(name, t, idxs), expected, 4)
+
+        numpy.testing.assert_array_equal(store.levels, LEV)
+        numpy.testing.assert_array_equal(store.lat, lat)
+
+    def test_missing_values_masked(self):
+        store = columns.load('merra', self.filename)
+        profiles = store.profiles('T', 3, ([0, 10], [0, 10]))
+
+        self.assertTrue(profiles.mask[0, 0])
+        self.assertFalse(profiles.mask[1].any())
+
+    def test_around(self):
+        store = columns.load('merra', self.filename)
+        data_coor, (t1, t2), profiles = store.around(datetime.datetime(2017, 7, 3, 14), 38.9, -73.8)
+
+        self.assertEqual(len(data_coor), 4)
+        self.assertEqual((t1.hour, t2.hour), (12, 15))
+        self.assertEqual(profiles['T'][0].shape, (4, len(LEV)))
+
+    def test_built_once(self):
+        store = columns.load('merra', self.filename)
+        self.assertIs(columns.load('merra', self.filename), store)
+
+        # a new process opens the store on disk instead of rebuilding it
+        columns._STORES.clear()
+        meta = os.path.join(columns.store_path('merra', [self.filename]), 'meta.json')
+        mtime = os.stat(meta).st_mtime_ns
+        columns.load('merra', self.filename)
+        self.assertEqual(os.stat(meta).st_mtime_ns, mtime)
+
+    def test_least_recently_used_dropped(self):
+        other = os.path.join(self.directory, 'MERRA2_400.inst3_3d_asm_Np.20170704.nc4')
+        write_merra(other)
+        max_stores, columns.MAX_STORES = columns.MAX_STORES, 1
+        try:
+            columns.load('merra', self.filename)
+            store = columns.load('merra', other)
+        finally:
+            columns.MAX_STORES = max_stores
+
+        self.assertEqual(list(columns._STORES), [columns.store_path('merra', [other])])
+        self.assertIs(columns.load('merra', other), store)
+
+    def test_evicted_over_budget(self):
+        other = os.path.join(self.directory, 'MERRA2_400.inst3_3d_asm_Np.20170704.nc4')
+        write_merra(other)
+        first, second = columns.store_path('merra', [self.filename]), columns.store_path('merra', [other])
+
+        budget, settings.COLUMN_BUDGET = settings.COLUMN_BUDGET, 1
+        try:
+            columns.load('merra', self.filename)
+            self.assertTrue(os.path.isdir(first))   # open, kept over the budget
+
+            columns._STORES.clear()   # i.e. a later process
+            columns.load('merra', other)
+            self.assertFalse(os.path.isdir(first))
+            self.assertTrue(os.path.isdir(second))
+
+            # built again when used again
+            columns._STORES.clear()
+            self.assertEqual(columns.load('merra', self.filename).profiles('T', 0, ([10], [10])).shape, (1, len(LEV)))
+            self.assertEqual(os.listdir(settings.COLUMN_DIR), [os.path.basename(first)])
+        finally:
+            settings.COLUMN_BUDGET = budget
+
+        self.assertEqual(columns.evict(), [])   # no budget
+
+    def test_rebuilt_when_file_changes(self):
+        before = columns.load('merra', self.filename).profiles('T', 0, ([10], [10]))
+
+        time.sleep(0.01)
+        write_merra(self.filename, offset=1000.0)
+        after = columns.load('merra', self.filename).profiles('T', 0, ([10], [10]))
+
+        numpy.testing.assert_array_almost_equal(after, before + 1000.0, 3)
+
+    def test_around_many_matches_single_points(self):
+        store = columns.load('merra', self.filename)
+        dates = [datetime.datetime(2017, 7, 3, 14), datetime.datetime(2017, 7, 3, 2), datetime.datetime(2017, 7, 3, 14)]
+        lats, lons = [38.9, 31.2, 42.0], [-73.8, -79.1, -66.3]
+        lat, lon = numpy.meshgrid(LAT, LON, indexing='ij')
+
+        for (coor, (t1, t2), profiles), point in zip(store.around_many(dates, lats, lons), zip(dates, lats, lons)):
+            idxs, expected_coor = funcs.choose_points(lat, lon, point[1], point[2])
+            self.assertEqual(coor, expected_coor)
+            self.assertEqual((t1.hour, t2.hour), (12, 15) if point[0].hour == 14 else (0, 3))
+
+            for name in ('T', 'RH', 'H'):
+                hours = [int(numpy.where(store.time == 60 * t.hour)[0][0]) for t in (t1, t2)]
+                for p, t in zip(profiles[name], hours):
+                    numpy.testing.assert_array_equal(p, store.profiles(name, t, idxs))
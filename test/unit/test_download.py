@@ -1,35 +1,89 @@
-from buoycalib import download
+from buoycalib import (download, store)
+import ftplib
+import gzip
+import io
 import unittest
 import os
-import netCDF4
-import skimage.io
+import shutil
+import tarfile
+import tempfile
+
+from .http_server import LocalServer
+
+
+class FTP(object):
+    """ stand-in ftplib.FTP serving FILES, without the SIZE command, counts the open connections """
+    FILES = {}
+    connections = 0
+
+    def __init__(self, host, timeout=None):
+        FTP.connections += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        FTP.connections -= 1
+
+    def login(self):
+        pass
+
+    def voidcmd(self, cmd):
+        pass
+
+    def size(self, path):
+        return None
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        path = cmd.split(' ', 1)[1]
+        if path not in FTP.FILES:
+            raise ftplib.error_perm('550 {0}: No such file or directory'.format(path))
+        callback(FTP.FILES[path][rest or 0:])
+
+# the tests against the real servers download whole files, they only run when asked for
+NETWORK = os.environ.get('BUOYCALIB_NETWORK_TESTS')
+
 
 class TestDownload(unittest.TestCase):
 
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        store._default = store.DataStore(os.path.join(self.directory, 'manifest.sqlite'))
+
+    def tearDown(self):
+        store._default = None
+        shutil.rmtree(self.directory)
+
+    @unittest.skipUnless(NETWORK, 'set BUOYCALIB_NETWORK_TESTS to download from the real servers')
     def test_good_ftp(self):
         """ Test good ftp / test narr download """
         url = 'ftp://ftp.cdc.noaa.gov/Datasets/NARR/pressure/air.199611.nc'
-        save_loc = '.'
+        save_loc = self.directory
+        import netCDF4
         save_loc__ = download.url_download(url, save_loc)
         ds = netCDF4.Dataset(save_loc__)
         os.remove(save_loc__)
         self.assertTrue(True)
 
+    @unittest.skipUnless(NETWORK, 'set BUOYCALIB_NETWORK_TESTS to download from the real servers')
     def test_good_http_with_auth(self):
         """ Test good http with auth / test merra download """
         url = 'https://goldsmr5.sci.gsfc.nasa.gov/data/s4pa/MERRA2/M2I3NPASM.5.12.4/2014/04/MERRA2_400.inst3_3d_asm_Np.20140401.nc4'
         username = "nid4986"
         password = "Anamorph1c"
-        save_loc = '.'
+        save_loc = self.directory
+        import netCDF4
         save_loc__ = download.url_download(url, save_loc, auth=(username, password))
         ds = netCDF4.Dataset(save_loc__)
         os.remove(save_loc__)
         self.assertTrue(True)
 
+    @unittest.skipUnless(NETWORK, 'set BUOYCALIB_NETWORK_TESTS to download from the real servers')
     def test_good_http(self):
         """ Test good http / test landsat download from aws """
         url = 'https://landsat-pds.s3.amazonaws.com/c1/L8/139/045/LC08_L1TP_139045_20170304_20170316_01_T1/LC08_L1TP_139045_20170304_20170316_01_T1_B8.TIF'
-        save_loc = '.'
+        save_loc = self.directory
+        import skimage.io
         save_loc__ = download.url_download(url, save_loc)
         image = skimage.io.imread(save_loc__)
         os.remove(save_loc__)
@@ -46,4 +100,227 @@ class TestDownload(unittest.TestCase):
         
     def test_bad_url(self):
         self.fail("Not implemented yet")
-    
+
+
+class TestLocalDownload(unittest.TestCase):
+    """ downloads against a local stand-in server """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        store._default = store.DataStore(os.path.join(self.directory, 'manifest.sqlite'))
+
+    def tearDown(self):
+        store._default = None
+        shutil.rmtree(self.directory)
+
+    def test_download(self):
+        with LocalServer({'/a.bin': self.data}) as server:
+            filepath = download.url_download(server.url + '/a.bin', self.directory)
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(filepath + '.part'))
+
+    def test_existing_file_not_downloaded(self):
+        with open(os.path.join(self.directory, 'a.bin'), 'wb') as f:
+            f.write(b'cached')
+
+        with LocalServer({'/a.bin': self.data}) as server:
+            download.url_download(server.url + '/a.bin', self.directory)
+
+            self.assertEqual(server.requests, [])
+
+    def test_corrupt_cached_file_downloaded_again(self):
+        with LocalServer({'/a.bin': self.data}) as server:
+            filepath = download.url_download(server.url + '/a.bin', self.directory)
+            with open(filepath, 'r+b') as f:
+                f.truncate(10)
+
+            download.url_download(server.url + '/a.bin', self.directory)
+
+            self.assertEqual(len(server.requests), 2)
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_resume_partial(self):
+        filepath = os.path.join(self.directory, 'a.bin')
+        with open(filepath + '.part', 'wb') as f:
+            f.write(self.data[:1000])
+
+        with LocalServer({'/a.bin': self.data}) as server:
+            download.url_download(server.url + '/a.bin', self.directory)
+
+            self.assertEqual(server.requests[0][2].get('Range'), 'bytes=1000-')
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_resume_without_range_support(self):
+        filepath = os.path.join(self.directory, 'a.bin')
+        with open(filepath + '.part', 'wb') as f:
+            f.write(b'garbage')
+
+        with LocalServer({'/a.bin': self.data}, ranges=False) as server:
+            download.url_download(server.url + '/a.bin', self.directory)
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_content_encoding(self):
+        data = b'2017 01 01 00 00 220\n' * 5000
+
+        with LocalServer({'/a.txt': data}, encoding='gzip') as server:
+            filepath = download.url_download(server.url + '/a.txt', self.directory)
+
+            self.assertEqual(server.requests[0][2].get('Accept-Encoding'), 'identity')
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_resume_content_encoding(self):
+        data = b'2017 01 01 00 00 220\n' * 5000
+        filepath = os.path.join(self.directory, 'a.txt')
+        with open(filepath + '.part', 'wb') as f:
+            f.write(data[:1000])
+
+        # a range of the compressed body does not follow the decoded bytes, start over
+        with LocalServer({'/a.txt': data}, encoding='gzip') as server:
+            download.url_download(server.url + '/a.txt', self.directory)
+
+            self.assertEqual([r[2].get('Range') for r in server.requests], ['bytes=1000-', None])
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_lock_removed(self):
+        filepath = os.path.join(self.directory, 'a.bin')
+
+        with download.file_lock(filepath):
+            self.assertTrue(os.path.isfile(filepath + '.lock'))
+        self.assertFalse(os.path.exists(filepath + '.lock'))
+
+        with LocalServer({'/a.bin': self.data}) as server:
+            download.download_many([(server.url + '/a.bin', self.directory)] * 4)
+
+        self.assertEqual(sorted(f for f in os.listdir(self.directory) if f.startswith('a.bin')), ['a.bin'])
+
+    def test_unsatisfiable_range(self):
+        def refuse(request):
+            request.send_response(416)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+
+        # no .part to resume, not a retry
+        with LocalServer(handler=refuse) as server:
+            self.assertRaises(download.RemoteFileException, download.url_download, server.url + '/a.bin', self.directory)
+            self.assertEqual(len(server.requests), 1)
+
+        # a .part the server keeps refusing, started over once
+        with open(os.path.join(self.directory, 'a.bin.part'), 'wb') as f:
+            f.write(self.data[:1000])
+        with LocalServer(handler=refuse) as server:
+            self.assertRaises(download.RemoteFileException, download.url_download, server.url + '/a.bin', self.directory)
+            self.assertEqual([r[2].get('Range') for r in server.requests], ['bytes=1000-', None])
+
+    def test_ftp_without_size(self):
+        FTP.FILES = {'/pub/a.bin': self.data}
+        ftp = download.ftplib.FTP
+        download.ftplib.FTP = FTP
+        try:
+            # the .part cannot be checked against a size, downloaded again
+            with open(os.path.join(self.directory, 'a.bin.part'), 'wb') as f:
+                f.write(b'garbage')
+            filepath = download.url_download('ftp://127.0.0.1/pub/a.bin', self.directory)
+
+            self.assertRaises(download.RemoteFileException, download.url_download,
+                              'ftp://127.0.0.1/pub/missing.bin', self.directory)
+        finally:
+            download.ftplib.FTP = ftp
+
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(FTP.connections, 0)   # closed after the error too
+
+    def test_missing(self):
+        with LocalServer() as server:
+            self.assertRaises(download.RemoteFileException, download.url_download,
+                              server.url + '/missing.bin', self.directory)
+
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'missing.bin')))
+
+    def test_download_many(self):
+        files = {'/{0}.bin'.format(i): os.urandom(1000 + i) for i in range(8)}
+
+        with LocalServer(files) as server:
+            paths = download.download_many([(server.url + name, self.directory) for name in sorted(files)], workers=3)
+
+        for name, path in zip(sorted(files), paths):
+            self.assertEqual(os.path.basename(path), name[1:])
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), files[name])
+
+    def test_download_many_raises(self):
+        with LocalServer({'/a.bin': self.data}) as server:
+            self.assertRaises(download.RemoteFileException, download.download_many,
+                              [(server.url + '/a.bin', self.directory), (server.url + '/b.bin', self.directory)])
+
+        # the good file still finished
+        self.assertTrue(os.path.isfile(os.path.join(self.directory, 'a.bin')))
+
+
+class TestStreamingDecompression(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.members = {
+            'LC80130332017001LGN00_B10.TIF': os.urandom(40000),
+            'LC80130332017001LGN00_B11.TIF': os.urandom(40000),
+            'LC80130332017001LGN00_B4.TIF': os.urandom(40000),
+            'LC80130332017001LGN00_MTL.txt': b'GROUP = L1_METADATA_FILE\n',
+        }
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w:gz') as tf:
+            for name, data in self.members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+        self.archive = archive.getvalue()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_untar_stream_suffixes(self):
+        paths = download.untar_stream(io.BytesIO(self.archive), self.directory, ['_B10.TIF', '_MTL.txt'])
+
+        self.assertEqual(sorted(os.path.basename(p) for p in paths),
+                         ['LC80130332017001LGN00_B10.TIF', 'LC80130332017001LGN00_MTL.txt'])
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted(os.path.basename(p) for p in paths))
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.members[os.path.basename(path)])
+
+    def test_extract_earthexplorer(self):
+        with LocalServer({'/scene.tar.gz': self.archive}) as server:
+            paths = download.extract_earthexplorer(server.url + '/scene.tar.gz', self.directory, ['_B11.TIF'])
+
+        self.assertEqual([os.path.basename(p) for p in paths], ['LC80130332017001LGN00_B11.TIF'])
+        self.assertEqual(os.listdir(self.directory), ['LC80130332017001LGN00_B11.TIF'])
+
+    def test_open_text(self):
+        text = '#YY  MM DD hh mm WDIR\n2017 01 01 00 00 220\n'
+
+        gz_file = os.path.join(self.directory, 'a.txt.gz')
+        with gzip.open(gz_file, 'wt') as f:
+            f.write(text)
+
+        # NOAA sometimes serves plain text under a .gz name
+        plain_file = os.path.join(self.directory, 'b.txt.gz')
+        with open(plain_file, 'w') as f:
+            f.write(text)
+
+        for filepath in (gz_file, plain_file):
+            with download.open_text(filepath) as f:
+                self.assertEqual(f.read(), text)
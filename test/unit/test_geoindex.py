@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from buoycalib.sat import geoindex
+
+
+def synthetic_swath(shape=(40, 30)):
+    """ a small, slightly rotated lat/lon swath straddling the antimeridian """
+    r, c = numpy.mgrid[0:shape[0], 0:shape[1]]
+    lat = 40.0 + 0.01 * r + 0.002 * c
+    lon = 179.9 + 0.01 * c - 0.002 * r
+    lon = (lon + 180) % 360 - 180
+    return lat, lon
+
+
+class TestSwathIndex(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        lat, lon = synthetic_swath()
+        index = geoindex.SwathIndex(lat, lon)
+
+        lats = [40.05, 40.2, 40.33]
+        lons = [179.95, -179.85, 179.99]
+        rows, cols, __ = index.query(lats, lons)
+
+        xyz = geoindex.latlon_to_xyz(lat, lon)
+        for i, (lat_oi, lon_oi) in enumerate(zip(lats, lons)):
+            d = ((xyz - geoindex.latlon_to_xyz(lat_oi, lon_oi))**2).sum(axis=1)
+            r, c = numpy.unravel_index(numpy.argmin(d), lat.shape)
+            self.assertEqual((rows[i], cols[i]), (r, c))
+
+    def test_exact_pixel_has_zero_distance(self):
+        lat, lon = synthetic_swath()
+        index = geoindex.SwathIndex(lat, lon)
+
+        rows, cols, dist = index.query(lat[10, 20], lon[10, 20])
+
+        self.assertEqual((rows[0], cols[0]), (10, 20))
+        self.assertAlmostEqual(dist[0], 0.0, places=3)
+
+    def test_fill_values_ignored(self):
+        lat, lon = synthetic_swath()
+        lat[0, 0] = lon[0, 0] = -999
+        index = geoindex.SwathIndex(lat, lon)
+
+        rows, cols, __ = index.query(-90, 0)
+
+        self.assertNotEqual((rows[0], cols[0]), (0, 0))
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mod03 = os.path.join(self.directory, 'MOD03.A2011154.1650.006.hdf')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        geoindex._INDEXES.clear()
+
+    def test_load_from_persisted_index(self):
+        lat, lon = synthetic_swath()
+        numpy.savez(geoindex.index_path(self.mod03), lat=lat, lon=lon)
+
+        index = geoindex.load(self.mod03)
+
+        self.assertEqual(index.shape, lat.shape)
+        self.assertIs(geoindex.load(self.mod03), index)
+
+    def test_least_recently_used_dropped(self):
+        lat, lon = synthetic_swath()
+        mod03s = [os.path.join(self.directory, 'MOD03.A2011154.{0:04d}.006.hdf'.format(i))
+                  for i in range(geoindex.MAX_INDEXES + 1)]
+        for mod03 in mod03s:
+            numpy.savez(geoindex.index_path(mod03), lat=lat, lon=lon)
+
+        first = geoindex.load(mod03s[0])
+        for mod03 in mod03s[1:-1]:
+            geoindex.load(mod03)
+        self.assertIs(geoindex.load(mod03s[0]), first)   # used again, kept
+
+        geoindex.load(mod03s[-1])
+
+        self.assertEqual(len(geoindex._INDEXES), geoindex.MAX_INDEXES)
+        self.assertNotIn(os.path.abspath(mod03s[1]), geoindex._INDEXES)
+        self.assertIs(geoindex.load(mod03s[0]), first)
@@ -1,6 +1,6 @@
 import unittest
 
-from buoycalib import image_processing as img
+from buoycalib.sat import image_processing as img
 
 TEST_IMAGE = 'test/unit/assets/LC80410372013149LGN00_B10.TIF'
 
@@ -48,6 +48,42 @@ class TestConvertUTMZones(unittest.TestCase):
         self.assertRaises(img.OutOfRangeError, img.convert_utm_zones, utm_proj[0], utm_proj[1], 112312, 12)
 
 
+class TestConvertUTMZonesArray(unittest.TestCase):
+
+    def test_matches_single_point_conversion(self):
+        import utm
+        points = [utm.from_latlon(33.1 + i * 0.1, -119.3 + i * 0.1)[:2] for i in range(5)]
+        xs, ys = zip(*points)
+
+        new_xs, new_ys = img.convert_utm_zones_array(xs, ys, 11, 12)
+
+        for x, y, new_x, new_y in zip(xs, ys, new_xs, new_ys):
+            expected = img.convert_utm_zones(x, y, 11, 12)
+            self.assertAlmostEqual(new_x, expected[0], places=6)
+            self.assertAlmostEqual(new_y, expected[1], places=6)
+
+    def test_same_zone_is_identity(self):
+        new_xs, new_ys = img.convert_utm_zones_array([500000.0], [3600000.0], 11, 11)
+
+        self.assertEqual(list(new_xs), [500000.0])
+        self.assertEqual(list(new_ys), [3600000.0])
+
+    def test_transformer_is_cached(self):
+        self.assertIs(img.utm_transformer(11, 12), img.utm_transformer(11, 12))
+
+    def test_latlon_to_utm_array_mixed_zones(self):
+        import utm
+        lats = [33.1, 33.2]
+        lons = [-119.3, -113.5]   # zones 11 and 12
+
+        xs, ys = img.latlon_to_utm_array(lats, lons, 11)
+
+        self.assertAlmostEqual(xs[0], utm.from_latlon(33.1, -119.3)[0], places=6)
+        expected = img.convert_utm_zones(*utm.from_latlon(33.2, -113.5)[:2], 12, 11)
+        self.assertAlmostEqual(xs[1], expected[0], places=6)
+        self.assertAlmostEqual(ys[1], expected[1], places=6)
+
+
 class TestFindROI(unittest.TestCase):
     """
     Test the find_roi function in image_processing.
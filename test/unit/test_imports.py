@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# modules that must only be loaded by the code paths that use them
+HEAVY = ('cv2', 'osgeo', 'gdal', 'ogr', 'netCDF4', 'requests', 'utm', 'scipy')
+
+
+def loaded_after(code):
+    """ heavy modules in sys.modules after running code in a fresh interpreter """
+    check = code + '\nimport sys\nprint(" ".join(m for m in {0!r} if m in sys.modules))'.format(HEAVY)
+    output = subprocess.check_output([sys.executable, '-c', check], cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT))
+    return output.decode().split()
+
+
+def script_help(script):
+    return ('import runpy, sys\n'
+            'sys.argv = [{0!r}, "--help"]\n'
+            'sys.stdout = open("/dev/null", "w")\n'
+            'try:\n'
+            '    runpy.run_path({0!r}, run_name="__main__")\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'sys.stdout = sys.__stdout__\n').format(script)
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_package(self):
+        self.assertEqual(loaded_after('import buoycalib'), [])
+
+    def test_buoy(self):
+        self.assertEqual(loaded_after('import buoycalib\nbuoycalib.buoy.calc_skin_temp\nbuoycalib.atmo.data.calc_rh'), [])
+
+    def test_atmosphere(self):
+        self.assertEqual(loaded_after('from buoycalib.atmo import (merra, narr, provider)'), [])
+        self.assertEqual(loaded_after('from buoycalib import atmo\natmo.process'), [])
+
+    def test_forward(self):
+        # the service and the tools share the forward model of the package, not the script
+        check = 'from buoycalib import forward\nimport sys\nassert "forward_model" not in sys.modules'
+        self.assertEqual(loaded_after(check), [])
+
+        # the event loop only with the coroutines, i.e. calibrate_async
+        check = 'from buoycalib import (forward, pipeline)\nimport sys\nassert "asyncio" not in sys.modules'
+        self.assertEqual(loaded_after(check), [])
+
+    def test_swath_index(self):
+        # GDAL only reads MOD03 files, the index and the in-memory resampling do not need it
+        self.assertNotIn('osgeo', loaded_after('from buoycalib.sat import (geoindex, swath_grid)'))
+
+    def test_script_help(self):
+        self.assertEqual(loaded_after(script_help('forward_model.py')), [])
+        self.assertEqual(loaded_after(script_help('buoy_model.py')), [])
+
+    def test_loaded_on_use(self):
+        self.assertIn('requests', loaded_after('from buoycalib import download\ndownload.session()'))
+        self.assertIn('netCDF4', loaded_after('from buoycalib.atmo import data\ndata.closest_hours'
+                                              '\ntry:\n    data.open_netcdf4("missing.nc")\nexcept IOError:\n    pass'))
+
+    def test_missing_attribute(self):
+        import buoycalib
+        with self.assertRaises(AttributeError):
+            buoycalib.no_such_module
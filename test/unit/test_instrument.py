@@ -0,0 +1,108 @@
+import concurrent.futures
+import contextvars
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from buoycalib import instrument
+
+
+@instrument.timed('read')
+def _read(filepath):
+    with open(filepath, 'rb') as f:
+        return len(f.read())
+
+
+@instrument.timed('spin')
+def _spin(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+@instrument.timed('child')
+def _child():
+    subprocess.check_call(['sh', '-c', 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done'])
+
+
+@instrument.timed('fails')
+def _fails():
+    raise IOError('connection reset')
+
+
+class TestInstrument(unittest.TestCase):
+
+    def setUp(self):
+        instrument.reset()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        instrument.reset()
+        shutil.rmtree(self.directory)
+
+    def test_stage_resources(self):
+        filepath = os.path.join(self.directory, 'band10.TIF')
+        with open(filepath, 'wb') as f:
+            f.write(b'\0' * 1000000)
+
+        with instrument.job('LC08_scene'):
+            _read(filepath)
+            _read(filepath)
+            _spin(0.05)
+        self.assertRaises(IOError, _fails)
+
+        r = instrument.report()
+        read = r['stages']['read']
+        self.assertEqual((read['count'], read['errors']), (2, 0))
+        if instrument.bytes_read() is not None:
+            self.assertGreaterEqual(read['bytes_read'], 2000000)
+        self.assertGreater(read['peak_rss'], 0)
+
+        self.assertGreaterEqual(r['stages']['spin']['cpu'], 0.05)
+        self.assertGreaterEqual(r['stages']['spin']['wall'], 0.05)
+        self.assertEqual(r['stages']['fails']['errors'], 1)
+
+        self.assertEqual(set(r['jobs']['LC08_scene']), {'read', 'spin'})
+        self.assertEqual(list(r['jobs'][None]), ['fails'])
+
+    def test_stage_names(self):
+        def parse_tape6():
+            return 'tape6'
+        parse_tape6.__module__ = 'buoycalib.modtran'
+
+        self.assertEqual(instrument.timed()(parse_tape6)(), 'tape6')
+        self.assertEqual(list(instrument.report()['stages']), ['modtran.parse_tape6'])
+
+    def test_child_processes(self):
+        _child()
+        self.assertGreater(instrument.report()['stages']['child']['child_cpu'], 0)
+
+    def test_job_in_threads(self):
+        with instrument.job('MOD021KM_scene'):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, _spin, 0.01) for __ in range(4)]
+        [f.result() for f in futures]
+
+        self.assertEqual(instrument.report()['jobs']['MOD021KM_scene']['spin']['count'], 4)
+
+    def test_reports(self):
+        _spin(0.01)
+        _spin(0.01)
+
+        json_file = os.path.join(self.directory, 'metrics.json')
+        instrument.write(json_file)
+        with open(json_file) as f:
+            r = json.load(f)
+        self.assertEqual(r['jobs']['null']['spin']['count'], 2)
+
+        merged = instrument.merge([r, r])
+        self.assertEqual(merged['stages']['spin']['count'], 4)
+        self.assertAlmostEqual(merged['stages']['spin']['cpu'], 2 * r['stages']['spin']['cpu'])
+
+        text = instrument.prometheus(merged)
+        self.assertIn('# TYPE buoycalib_stage_wall_seconds_total counter', text)
+        self.assertIn('buoycalib_stage_calls_total{stage="spin"} 4\n', text)
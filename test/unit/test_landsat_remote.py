@@ -0,0 +1,107 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import numpy
+from osgeo import gdal, osr
+import utm
+
+from buoycalib import settings
+from buoycalib.sat import landsat
+
+from .http_server import LocalServer
+
+SCENE_ID = 'LC08_L1TP_013033_20170701_20170715_01_T1'
+BUOY_LAT, BUOY_LON = 38.9073, -73.8077
+
+
+def write_band(filepath, data, x0, y0, zone):
+    """ tiled, compressed 30m geotiff, laid out like the S3 landsat bands """
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(filepath, data.shape[1], data.shape[0], 1, gdal.GDT_UInt16,
+                            ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE'])
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(32600 + zone)
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.SetGeoTransform((x0, 30, 0, y0, 0, -30))
+    dataset.GetRasterBand(1).WriteArray(data)
+    dataset.FlushCache()
+    dataset = None
+
+
+class TestRemoteWindow(unittest.TestCase):
+    """ reads of image windows through /vsicurl/, against a local range server """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.landsat_dir = settings.LANDSAT_DIR
+        settings.LANDSAT_DIR = os.path.join(self.directory, 'landsat')
+
+        buoy_x, buoy_y, zone, __ = utm.from_latlon(BUOY_LAT, BUOY_LON)
+        self.filename = SCENE_ID + '_B10.TIF'
+        self.metadata = {
+            'FILE_NAME_BAND_10': self.filename,
+            'UTM_ZONE': zone,
+            'RADIANCE_MULT_BAND_10': 3.342e-4,
+            'RADIANCE_ADD_BAND_10': 0.1,
+        }
+
+        # buoy near pixel (1000, 700)
+        self.data = numpy.random.RandomState(0).randint(1, 60000, (2048, 2048)).astype(numpy.uint16)
+        self.local_dir = os.path.join(self.directory, SCENE_ID)
+        os.makedirs(self.local_dir)
+        write_band(os.path.join(self.local_dir, self.filename), self.data,
+                   buoy_x - 1000 * 30 - 10, buoy_y + 700 * 30 + 10, zone)
+
+        with open(os.path.join(self.local_dir, self.filename), 'rb') as f:
+            self.image = f.read()
+
+    def tearDown(self):
+        settings.LANDSAT_DIR = self.landsat_dir
+        shutil.rmtree(self.directory)
+
+    def bytes_requested(self, server):
+        total = 0
+        for command, path, headers in server.requests:
+            match = re.match(r'bytes=(\d+)-(\d+)', headers.get('Range', ''))
+            if command == 'GET':
+                total += int(match.group(2)) - int(match.group(1)) + 1 if match else len(self.image)
+        return total
+
+    def test_same_as_local(self):
+        local = landsat.calc_ltoa(self.local_dir, self.metadata, BUOY_LAT, BUOY_LON, 10)
+
+        expected = self.data[699:702, 999:1002].mean() * 3.342e-4 + 0.1
+        self.assertAlmostEqual(local, expected, places=6)
+
+        with LocalServer({'/' + SCENE_ID + '/' + self.filename: self.image}) as server:
+            remote_dir = '/vsicurl/' + server.url + '/' + SCENE_ID
+            remote = landsat.calc_ltoa(remote_dir, self.metadata, BUOY_LAT, BUOY_LON, 10)
+
+            # header and one tile, not the image
+            self.assertLess(self.bytes_requested(server), len(self.image) / 4)
+
+        self.assertAlmostEqual(remote, local, places=6)
+
+    def test_window_cached(self):
+        with LocalServer({'/' + SCENE_ID + '/' + self.filename: self.image}) as server:
+            img_file = '/vsicurl/' + server.url + '/' + SCENE_ID + '/' + self.filename
+            dataset = landsat.open_image(img_file)
+            window = landsat.read_window(dataset, img_file, 1000, 700)
+
+        cache_dir = os.path.join(settings.LANDSAT_DIR, SCENE_ID, 'windows')
+        self.assertEqual(os.listdir(cache_dir), [SCENE_ID + '_B10_1000_700_3.npy'])
+
+        # the server is gone, the window comes from the cache
+        numpy.testing.assert_array_equal(landsat.read_window(dataset, img_file, 1000, 700), window)
+        numpy.testing.assert_array_equal(window, self.data[699:702, 999:1002])
+
+    def test_outside_image(self):
+        img_file = os.path.join(self.local_dir, self.filename)
+        dataset = landsat.open_image(img_file)
+
+        self.assertRaises(RuntimeError, landsat.read_window, dataset, img_file, 0, 700)
+        self.assertRaises(RuntimeError, landsat.read_window, dataset, img_file, 1000, 2047)
@@ -0,0 +1,71 @@
+import unittest
+
+import numpy
+
+from buoycalib.sat import (geoindex, modis)
+
+from .test_swath_grid import (BUOY_LAT, BUOY_LON, Band, synthetic_swath)
+
+FILL = 65535   # above 32767, a fill value of the scaled integers
+
+
+class Dataset(object):
+    """ stand-in gdal dataset of a MOD021KM granule and of its EV_1KM_Emissive subdataset """
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.RasterYSize, self.RasterXSize = bands[31].shape
+
+    def GetSubDatasets(self):
+        return [('HDF4_EOS:EOS_SWATH:"granule.hdf":MODIS_SWATH_Type_L1B:EV_1KM_Emissive', '')]
+
+    def GetMetadata(self):
+        return {'band_names': '31,32', 'radiance_scales': '0.5, 0.25', 'radiance_offsets': '100.0, 200.0',
+                'radiance_units': 'Watts/m^2/micrometer/steradian'}
+
+    def GetRasterBand(self, i):
+        return Band(self.bands[[31, 32][i - 1]])
+
+
+class Gdal(object):
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def Open(self, filepath):
+        return self.dataset
+
+
+class TestCalcLtoa(unittest.TestCase):
+
+    def setUp(self):
+        lat, lon, __ = synthetic_swath()
+        self.index = geoindex.SwathIndex(lat, lon)
+        rows, cols, __ = self.index.query(BUOY_LAT, BUOY_LON)
+
+        # band 31 good but for a fill value at the buoy pixel, band 32 all fill values
+        self.bands = {31: numpy.full(lat.shape, 1000, dtype=numpy.uint16),
+                      32: numpy.full(lat.shape, FILL, dtype=numpy.uint16)}
+        self.bands[31][rows[0], cols[0]] = FILL
+
+        self.saved = modis.gdal, geoindex.load
+        modis.gdal = Gdal(Dataset(self.bands))
+        geoindex.load = lambda geo_reference_MOD03: self.index
+
+    def tearDown(self):
+        modis.gdal, geoindex.load = self.saved
+
+    def test_fill_values_masked(self):
+        self.bands[31][:] = 1000
+        radiance, units = modis.calc_ltoa('granule.hdf', 'MOD03.hdf', BUOY_LAT, BUOY_LON)
+
+        self.assertAlmostEqual(radiance[31], 0.5 * (1000 - 100.0))
+        self.assertTrue(numpy.isnan(radiance[32]))
+
+    def test_fill_values_masked_direct(self):
+        radiance, radiance_std, units = modis.calc_ltoa_direct('granule.hdf', 'MOD03.hdf', BUOY_LAT, BUOY_LON)
+
+        # the rest of the window only
+        self.assertAlmostEqual(radiance[31], 0.5 * (1000 - 100.0))
+        self.assertEqual(radiance_std[31], 0.0)
+        self.assertTrue(numpy.isnan(radiance[32]))
@@ -0,0 +1,37 @@
+import unittest
+
+import numpy
+
+from buoycalib.sat import modis_tile
+
+
+class TestLatLonToTile(unittest.TestCase):
+
+    def test_boulder(self):
+        self.assertEqual(modis_tile.latlon_to_tile(40.015, -105.2705), (4, 9))
+
+    def test_vectorized_matches_scalar(self):
+        lats = numpy.array([40.015, 42.5, -33.9, 0.5, 89.0, -89.0])
+        lons = numpy.array([-105.2705, -70.2, 151.2, 179.9, 10.0, -170.0])
+
+        vert, horiz = modis_tile.latlon_to_tile(lats, lons)
+
+        for i in range(len(lats)):
+            self.assertEqual((vert[i], horiz[i]), modis_tile.latlon_to_tile(lats[i], lons[i]))
+
+    def test_agrees_with_table(self):
+        numpy.random.seed(0)
+        lats = numpy.random.uniform(-89.9, 89.9, 10000)
+        lons = numpy.random.uniform(-180, 180, 10000)
+
+        # raises if any tile disagrees with the bounding table
+        modis_tile.latlon_to_tile(lats, lons, verify=True)
+
+    def test_tile_to_latlon(self):
+        lon_min, lon_max, lat_min, lat_max = modis_tile.tile_to_latlon(4, 9)
+
+        self.assertTrue(lon_min <= -105.2705 <= lon_max)
+        self.assertTrue(lat_min <= 40.015 <= lat_max)
+
+    def test_tile_out_of_range(self):
+        self.assertRaises(Exception, modis_tile.tile_to_latlon, 18, 0)
@@ -0,0 +1,58 @@
+import asyncio
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from buoycalib import (modtran, settings)
+
+
+class TestRun(unittest.TestCase):
+    """ modtran.run with a stand-in executable """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = settings.MODTRAN_EXE, settings.MODTRAN_DATA
+
+        settings.MODTRAN_DATA = os.path.join(self.directory, 'DATA')
+        os.makedirs(settings.MODTRAN_DATA)
+
+        # writes where it ran, and whether it found its data
+        settings.MODTRAN_EXE = os.path.join(self.directory, 'modtran.sh')
+        with open(settings.MODTRAN_EXE, 'w') as f:
+            f.write('#!/bin/sh\npwd -P > tape6\ntest -d DATA && echo DATA >> tape6\n')
+        os.chmod(settings.MODTRAN_EXE, stat.S_IRWXU)
+
+    def tearDown(self):
+        settings.MODTRAN_EXE, settings.MODTRAN_DATA = self.settings
+        shutil.rmtree(self.directory)
+
+    def test_runs_in_directory(self):
+        cwd = os.getcwd()
+
+        for name in ['44009', '44017']:
+            run_dir = os.path.join(self.directory, name)
+            os.makedirs(run_dir)
+            modtran.run(run_dir)
+            modtran.run(run_dir)   # again, the data link exists
+
+            with open(os.path.join(run_dir, 'tape6')) as f:
+                self.assertEqual(f.read().split(), [os.path.realpath(run_dir), 'DATA'])
+
+        # the process working directory is not changed, other threads rely on it
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_run_async(self):
+        run_dirs = [os.path.join(self.directory, name) for name in ['44009', '44017']]
+        for d in run_dirs:
+            os.makedirs(d)
+
+        async def _runs():
+            await asyncio.gather(*[modtran.run_async(d) for d in run_dirs])
+
+        asyncio.run(_runs())
+
+        for d in run_dirs:
+            with open(os.path.join(d, 'tape6')) as f:
+                self.assertEqual(f.read().split(), [os.path.realpath(d), 'DATA'])
@@ -0,0 +1,93 @@
+import concurrent.futures
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from buoycalib import settings
+from buoycalib.sat import mrt_swath
+
+# stand-in swath2grid: reads -pf=<file>, writes <OUTPUT_FILENAME>_EV_1KM_Emissive_b<band - 20>.tif for the
+# layers of INPUT_SDS_NAME in the directory it runs in, and logs its run next to itself
+STUB = """#!{python}
+import os, sys, time
+prm = dict(line.split(' = ', 1) for line in open(sys.argv[1][4:]).read().splitlines() if ' = ' in line)
+layers = [20, 21, 22, 23, 24, 25, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36]
+mask = prm['INPUT_SDS_NAME'].split(', ')[1].split()
+with open(os.path.join(os.path.dirname(sys.argv[0]), 'runs.log'), 'a') as f:
+    f.write(os.getcwd() + '\\n')
+time.sleep(0.1)
+for band, keep in zip(layers, mask):
+    if keep == '1':
+        open('{{0}}_EV_1KM_Emissive_b{{1}}.tif'.format(prm['OUTPUT_FILENAME'], band - 20), 'w').write(prm['OUTPUT_SPACE_UPPER_LEFT_CORNER'])
+"""
+
+
+class TestReproject(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = settings.SWATH2GRID_EXE, settings.SWATH_DIR
+
+        settings.SWATH_DIR = os.path.join(self.directory, 'swath')
+        settings.SWATH2GRID_EXE = os.path.join(self.directory, 'swath2grid')
+        with open(settings.SWATH2GRID_EXE, 'w') as f:
+            f.write(STUB.format(python=sys.executable))
+        os.chmod(settings.SWATH2GRID_EXE, stat.S_IRWXU)
+
+        self.granule = os.path.join(self.directory, 'MOD021KM.A2017184.1540.006.hdf')
+        self.georef = os.path.join(self.directory, 'MOD03.A2017184.1540.006.hdf')
+        for filepath in (self.granule, self.georef):
+            open(filepath, 'w').close()
+
+    def tearDown(self):
+        settings.SWATH2GRID_EXE, settings.SWATH_DIR = self.settings
+        shutil.rmtree(self.directory)
+
+    def runs(self):
+        log = os.path.join(self.directory, 'runs.log')
+        return open(log).read().split() if os.path.isfile(log) else []
+
+    def test_reproject_cached(self):
+        cwd = os.getcwd()
+
+        files = mrt_swath.reproject(self.granule, self.georef, 38.461, -74.703, [31, 32])
+        self.assertEqual(sorted(files), [31, 32])
+        self.assertTrue(files[31].endswith('_b11.tif'))
+        self.assertEqual(os.path.dirname(files[31]), mrt_swath.cache_path(
+            self.granule, self.georef, mrt_swath.bbox(38.461, -74.703), [31, 32]))
+        self.assertEqual(os.getcwd(), cwd)
+
+        # same box and bands: cached, another box or band set: run again
+        self.assertEqual(mrt_swath.reproject(self.granule, self.georef, 38.461, -74.703, [32, 31]), files)
+        self.assertEqual(len(self.runs()), 1)
+
+        mrt_swath.reproject(self.granule, self.georef, 40.0, -70.0, [31, 32])
+        mrt_swath.reproject(self.granule, self.georef, 38.461, -74.703, [31])
+        self.assertEqual(len(self.runs()), 3)
+
+        # every run had its own directory, none left behind
+        self.assertEqual(len(set(self.runs())), 3)
+        self.assertEqual([d for d in os.listdir(settings.SWATH_DIR) if d.startswith('.run_')], [])
+
+    def test_concurrent(self):
+        points = [(38.461, -74.703)] * 4 + [(40.0, -70.0)] * 4
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda p: mrt_swath.reproject(self.granule, self.georef, p[0], p[1], [31]), points))
+
+        self.assertEqual(len(self.runs()), 2)   # one per box
+        self.assertEqual(len({r[31] for r in results}), 2)
+        with open(results[0][31]) as f, open(results[-1][31]) as g:
+            self.assertNotEqual(f.read(), g.read())
+
+    def test_failure_not_cached(self):
+        with open(settings.SWATH2GRID_EXE, 'w') as f:
+            f.write('#!/bin/sh\necho cannot read geolocation\nexit 1\n')
+
+        with self.assertRaisesRegex(mrt_swath.SwathError, 'cannot read geolocation'):
+            mrt_swath.reproject(self.granule, self.georef, 38.461, -74.703, [31])
+
+        self.assertEqual(os.listdir(settings.SWATH_DIR), [])
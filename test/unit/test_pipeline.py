@@ -0,0 +1,184 @@
+import asyncio
+import concurrent.futures
+import importlib.util
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from buoycalib import pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rsr = os.path.join(self.directory, 'rsr.txt')
+        self.write_rsr('1 0.5\n2 1.0\n')
+
+        self.skin_offset = 0.2
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_rsr(self, text):
+        with open(self.rsr, 'w') as f:
+            f.write(text)
+
+    def build(self, **kwargs):
+        """ scene -> state -> modtran -> ltoa, a small copy of the forward model graph """
+        p = pipeline.Pipeline(os.path.join(self.directory, 'pipeline'), **kwargs)
+
+        def _ltoa(modtran):
+            with open(self.rsr) as f:
+                weight = sum(float(line.split()[1]) for line in f)
+            return modtran * weight
+
+        p.add('scene', lambda: ('2017-07-03', 'LC08'), cache=False)
+        p.add('buoy_state:44009', lambda scene: {'skin_temp': 290.0 + self.skin_offset},
+              deps=['scene'], params={'offset': self.skin_offset})
+        p.add('modtran:44009', lambda scene, state: round(state['skin_temp']) * 0.01,
+              deps=['scene', 'buoy_state:44009'])
+        p.add('modeled_ltoa:44009', _ltoa, deps=['modtran:44009'], files=[self.rsr])
+
+        return p
+
+    def test_rerun_loads_outputs(self):
+        first = self.build()
+        ltoa = first.run('modeled_ltoa:44009')
+        self.assertEqual(first.computed, ['scene', 'buoy_state:44009', 'modtran:44009', 'modeled_ltoa:44009'])
+
+        second = self.build()
+        self.assertEqual(second.run('modeled_ltoa:44009'), ltoa)
+        self.assertEqual(second.computed, ['scene'])   # not cached, always runs
+
+    def test_changed_file_invalidates_stage(self):
+        self.build().run('modeled_ltoa:44009')
+        self.write_rsr('1 0.5\n2 0.25\n')
+
+        p = self.build()
+        self.assertAlmostEqual(p.run('modeled_ltoa:44009'), 2.9 * 0.75)
+        self.assertEqual(p.computed, ['scene', 'modeled_ltoa:44009'])
+
+    def test_changed_param_early_cutoff(self):
+        self.build().run('modeled_ltoa:44009')
+
+        # a new skin temperature model, modtran's output is the same so ltoa is not recomputed
+        self.skin_offset = 0.3
+        p = self.build()
+        p.run('modeled_ltoa:44009')
+        self.assertEqual(p.computed, ['scene', 'buoy_state:44009', 'modtran:44009'])
+
+        # a change that reaches modtran's output
+        self.skin_offset = 1.0
+        p = self.build()
+        p.run('modeled_ltoa:44009')
+        self.assertEqual(p.computed, ['scene', 'buoy_state:44009', 'modtran:44009', 'modeled_ltoa:44009'])
+
+    def test_changed_stage_source_invalidates_stage(self):
+        # the stage function lives in its own file, like the closures of forward.py
+        source = os.path.join(self.directory, 'stages.py')
+
+        def _build(text):
+            with open(source, 'w') as f:
+                f.write(text)
+            spec = importlib.util.spec_from_file_location('stages', source)
+            stages = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(stages)
+
+            p = pipeline.Pipeline(os.path.join(self.directory, 'pipeline'))
+            p.add('ltoa', stages.ltoa)
+            return p
+
+        self.assertEqual(_build('def ltoa():\n    return 1\n').run('ltoa'), 1)
+        self.assertEqual(_build('def ltoa():\n    return 1\n').computed, [])
+
+        p = _build('def ltoa():\n    return 2   # fixed\n')
+        self.assertEqual(p.run('ltoa'), 2)
+        self.assertEqual(p.computed, ['ltoa'])
+
+    def test_changed_output_file_invalidates_next_stages(self):
+        image = os.path.join(self.directory, 'B10.TIF')
+
+        def _build():
+            p = pipeline.Pipeline(os.path.join(self.directory, 'pipeline'))
+            p.add('scene', lambda: ('2017-07-03', image), cache=False, output_files=lambda scene: [scene[1]])
+            p.add('image_ltoa', lambda scene: open(scene[1]).read(), deps=['scene'])
+            return p
+
+        with open(image, 'w') as f:
+            f.write('9.1')
+        _build().run('image_ltoa')
+
+        # downloaded again to the same path, the scene's output is unchanged but not its file
+        time.sleep(0.01)
+        with open(image, 'w') as f:
+            f.write('9.25')
+        p = _build()
+        self.assertEqual(p.run('image_ltoa'), '9.25')
+        self.assertEqual(p.computed, ['scene', 'image_ltoa'])
+
+    def test_force(self):
+        self.build().run('modeled_ltoa:44009')
+
+        p = self.build(force=True)
+        p.run('modeled_ltoa:44009')
+        self.assertEqual(len(p.computed), 4)
+
+    def test_exception_not_cached(self):
+        p = pipeline.Pipeline(os.path.join(self.directory, 'pipeline'))
+        p.add('fails', lambda: 1 / 0)
+
+        self.assertRaises(ZeroDivisionError, p.run, 'fails')
+        self.assertRaises(ZeroDivisionError, p.run, 'fails')
+        self.assertRaises(pipeline.PipelineError, p.run, 'missing')
+        self.assertRaises(pipeline.PipelineError, p.add, 'fails', lambda: 2)
+
+    def test_threads_share_stage(self):
+        p = pipeline.Pipeline(os.path.join(self.directory, 'pipeline'))
+        calls = []
+
+        def _slow():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'atmosphere'
+
+        p.add('shared', _slow)
+        for i in range(8):
+            p.add('buoy:{0}'.format(i), lambda shared, i=i: (shared, i), deps=['shared'])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(p.run, ['buoy:{0}'.format(i) for i in range(8)]))
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [('atmosphere', i) for i in range(8)])
+
+    def test_run_async(self):
+        calls = []
+
+        def _modtran(i):
+            async def _run(shared):
+                calls.append(i)
+                await asyncio.sleep(0.01)
+                return (shared, i)
+            return _run
+
+        def _build():
+            p = pipeline.Pipeline(os.path.join(self.directory, 'pipeline'))
+            p.add('shared', lambda: calls.append('shared') or 'atmosphere')
+            for i in range(4):
+                p.add('buoy:{0}'.format(i), _modtran(i), deps=['shared'], params={'i': i})
+            return p
+
+        async def _all(p):
+            return await asyncio.gather(*[p.run_async('buoy:{0}'.format(i)) for i in range(4)])
+
+        p = _build()
+        self.assertEqual(asyncio.run(_all(p)), [('atmosphere', i) for i in range(4)])
+        self.assertEqual(calls.count('shared'), 1)
+
+        # the outputs are saved like run() saves them
+        p = _build()
+        self.assertEqual(p.run('buoy:2'), ('atmosphere', 2))
+        self.assertEqual(p.computed, [])
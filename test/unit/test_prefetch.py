@@ -0,0 +1,116 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from buoycalib import (prefetch, settings, store)
+from buoycalib.sat import landsat
+
+from .http_server import LocalServer
+
+
+class TestPlanning(unittest.TestCase):
+
+    def test_landsat_downloads(self):
+        downloads = prefetch.landsat_downloads('LC08_L1TP_017030_20170703_20170715_01_T1', [10, 11])
+
+        self.assertEqual(len(downloads), 3)
+        self.assertTrue(downloads[0][0].endswith('_B10.TIF'))
+        self.assertTrue(downloads[-1][0].endswith('_MTL.txt'))
+
+    def test_atmo_downloads_narr_includes_merra(self):
+        downloads = prefetch.atmo_downloads(datetime.datetime(2017, 7, 3, 15), 'narr')
+        urls = [d[0] for d in downloads]
+
+        self.assertEqual(len(urls), 4)
+        self.assertTrue(any('MERRA2' in u for u in urls))
+        self.assertTrue(all('201707' in u for u in urls[1:]))
+
+    def test_atmo_downloads_subset(self):
+        settings.ATMO_SUBSET = True
+        try:
+            # two buoys in the same box share the subsets
+            downloads = prefetch.atmo_downloads(datetime.datetime(2017, 7, 3, 15), 'narr',
+                                                [(38.9, -73.8), (38.5, -74.1)])
+        finally:
+            settings.ATMO_SUBSET = False
+
+        self.assertEqual(len(downloads), 4)
+        self.assertTrue(all(d[1] == settings.SUBSET_DIR for d in downloads))
+        self.assertIn('.nc4?', downloads[0][0])
+
+
+class TestPrefetcherFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        store._default = store.DataStore(os.path.join(self.directory, 'manifest.sqlite'))
+
+    def tearDown(self):
+        store._default = None
+        shutil.rmtree(self.directory)
+
+    def test_shared_urls_downloaded_once(self):
+        with LocalServer({'/month.nc': b'x' * 1000}) as server:
+            prefetcher = prefetch.Prefetcher([])
+            first = prefetcher.fetch(server.url + '/month.nc', self.directory)
+            second = prefetcher.fetch(server.url + '/month.nc', self.directory)
+            prefetcher.close()
+
+            self.assertIs(first, second)
+            self.assertEqual(len(server.requests), 1)
+            self.assertTrue(os.path.isfile(first.result()))
+
+    def test_wait_unknown_scene(self):
+        prefetcher = prefetch.Prefetcher([])
+        self.assertEqual(prefetcher.wait('LC08_L1TP_017030_20170703_20170715_01_T1'), [])
+        prefetcher.close()
+
+
+class TestPrefetcherPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        store._default = store.DataStore(os.path.join(self.directory, 'manifest.sqlite'))
+
+        self.release = threading.Event()
+        self.server = LocalServer(handler=self._mtl).__enter__()
+
+        # the scenes' MTL files come from the local server, no buoy or atmosphere data
+        self.saved = prefetch.landsat_downloads, prefetch.buoy_downloads, prefetch.atmo_downloads, \
+            landsat.read_metadata, landsat.corners
+        prefetch.landsat_downloads = lambda scene_id, bands: [(self.server.url + '/' + scene_id + '_MTL.txt', self.directory)]
+        prefetch.buoy_downloads = lambda buoys, date: []
+        prefetch.atmo_downloads = lambda date, atmo_source, points=(): []
+        landsat.read_metadata = lambda filepath: {'date': datetime.datetime(2017, 7, 3, 15, 40)}
+        landsat.corners = lambda metadata: (39.5, 37.5, -73.5, -75.5)
+
+    def tearDown(self):
+        self.release.set()
+        prefetch.landsat_downloads, prefetch.buoy_downloads, prefetch.atmo_downloads, \
+            landsat.read_metadata, landsat.corners = self.saved
+        self.server.__exit__()
+        store._default = None
+        shutil.rmtree(self.directory)
+
+    def _mtl(self, handler):
+        if 'SLOW' in handler.path:
+            self.release.wait(10)
+        return b'GROUP = L1_METADATA_FILE\n'
+
+    def test_scenes_planned_independently(self):
+        scenes = ['LC08_L1TP_014033_20170703_20170715_01_SLOW', 'LC08_L1TP_014033_20170703_20170715_01_T1']
+        prefetcher = prefetch.Prefetcher(scenes, lookahead=1).start()
+
+        # the second scene is planned while the metadata of the first is still downloading
+        date, points, __ = prefetcher.planned(scenes[1]).result(timeout=10)
+        self.assertEqual(date, datetime.datetime(2017, 7, 3, 15, 40))
+        self.assertIn((38.461, -74.703), points)   # 44009
+        self.assertFalse(prefetcher.planned(scenes[0]).done())
+
+        self.release.set()
+        self.assertEqual(prefetcher.wait(scenes[0]), [])
+        self.assertEqual(prefetcher.points(scenes[0])[0], date)
+        prefetcher.close()
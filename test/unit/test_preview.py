@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy
+
+from buoycalib import display
+
+
+class TestPreviewAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_written_in_background(self):
+        preview_file = os.path.join(self.directory, 'preview.jpg')
+
+        def _draw(value, shape):
+            return numpy.full(shape + (3,), value, dtype=numpy.uint8)
+
+        future = display.preview_async(_draw, (200, (32, 48)), preview_file)
+        image = future.result()
+
+        self.assertEqual(image.shape, (32, 48, 3))
+        self.assertEqual(cv2.imread(preview_file).shape, (32, 48, 3))
+
+    def test_failure_in_future(self):
+        preview_file = os.path.join(self.directory, 'preview.jpg')
+
+        def _draw():
+            raise RuntimeError('no band 10')
+
+        future = display.preview_async(_draw, (), preview_file)
+
+        self.assertRaises(RuntimeError, future.result)
+        self.assertFalse(os.path.exists(preview_file))
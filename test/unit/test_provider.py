@@ -0,0 +1,97 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy
+
+from buoycalib import settings
+from buoycalib.atmo import (columns, merra, provider)
+
+from test.unit.test_columns import write_merra
+
+DATE = datetime.datetime(2017, 7, 3, 15, 40)
+POINTS = [(DATE, 38.9, -73.8), (DATE, 31.2, -79.1), (DATE, 42.0, -66.3)]
+
+
+class TestProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.column_dir = settings.COLUMN_DIR
+        settings.COLUMN_DIR = os.path.join(self.directory, 'columns')
+
+        self.filename = os.path.join(self.directory, 'MERRA2_400.inst3_3d_asm_Np.20170703.nc4')
+        write_merra(self.filename)
+
+        # the synthetic day stands in for the download
+        self.download_for = merra.download_for
+        merra.download_for = lambda date, lat_oi, lon_oi: self.filename
+
+    def tearDown(self):
+        merra.download_for = self.download_for
+        settings.COLUMN_DIR = self.column_dir
+        columns._STORES.clear()
+        shutil.rmtree(self.directory)
+
+    def assertAtmosphereEqual(self, first, second):
+        for a, b in zip(first, second):
+            numpy.testing.assert_array_almost_equal(a, b)
+
+    def test_process_many_matches_process(self):
+        for atmosphere, point in zip(merra.process_many(POINTS), POINTS):
+            self.assertAtmosphereEqual(atmosphere, merra.process(*point))
+
+    def test_expected_points_extracted_once(self):
+        calls = []
+        process_many = merra.process_many
+
+        def _counted(points, verbose=False):
+            calls.append(list(points))
+            return process_many(points, verbose)
+
+        merra.process_many = _counted
+        try:
+            p = provider.AtmosphereProvider()
+            p.expect('merra', POINTS[:2])
+            p.expect('merra', POINTS[2:])   # i.e. a second scene of the same day
+
+            atmospheres = [p.process('merra', *point) for point in reversed(POINTS)]
+            p.process('merra', *POINTS[0])
+        finally:
+            merra.process_many = process_many
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(calls[0]), sorted(POINTS))
+        self.assertAtmosphereEqual(atmospheres[0], merra.process(*POINTS[2]))
+
+        self.assertRaises(ValueError, p.process, 'gfs', *POINTS[0])
+
+    def test_groups_extracted_concurrently(self):
+        # both extractions must be running at once to pass the barrier
+        barrier = threading.Barrier(2, timeout=10)
+        process_many = merra.process_many
+
+        def _waiting(points, verbose=False):
+            barrier.wait()
+            return [point for point in points]
+
+        other_day = (DATE + datetime.timedelta(days=1), 38.9, -73.8)
+        p = provider.AtmosphereProvider()
+        p.expect('merra', POINTS + [other_day])
+
+        merra.process_many = _waiting
+        try:
+            threads = [threading.Thread(target=p.process, args=('merra',) + point) for point in (POINTS[0], other_day)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            merra.process_many = process_many
+
+        self.assertFalse(barrier.broken)
+        self.assertEqual(p.process('merra', *other_day), other_day)
+        self.assertEqual(p.process('merra', *POINTS[2]), POINTS[2])
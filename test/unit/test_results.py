@@ -0,0 +1,128 @@
+import datetime
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from buoycalib import results
+
+L8 = 'LC08_L1TP_013033_20170703_20170715_01_T1'
+MODIS = 'MOD021KM.A2017184.1540.006.2017185013203.hdf'
+
+
+def matchup(buoy_id, date, offset=0.0, bands=(10, 11), std=False):
+    """ one entry of a forward model output, std: with the radiance std of the image (modis) """
+    mod_ltoa = {b: 9.0 + i + offset for i, b in enumerate(bands)}
+    img_ltoa = {b: 9.1 + i for i, b in enumerate(bands)}
+    img_ltoa_std = {b: 0.05 for b in bands} if std else {}
+    error = {b: 0.1 for b in bands}
+    return (buoy_id, 295.0, 294.6 + offset, 38.5, -74.7, mod_ltoa, error, img_ltoa, img_ltoa_std, date)
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'results.sqlite')
+        self.store = results.ResultStore(self.path)
+
+        self.date = datetime.datetime(2017, 7, 3, 15, 40, 12)
+        self.store.add(L8, {'44009': matchup('44009', self.date), '44025': matchup('44025', self.date)}, 'merra', 60.0)
+        self.store.add(MODIS, {'44009': matchup('44009', self.date, bands=(31, 32), std=True)}, 'narr')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_long_format(self):
+        rows = self.store.query(scene_id=L8, buoy_id='44009')
+
+        self.assertEqual([r['band'] for r in rows], ['10', '11'])
+        self.assertEqual(rows[0]['date'], self.date)
+        self.assertEqual((rows[0]['sensor'], rows[0]['atmo_source'], rows[0]['seconds']), ('landsat8', 'merra', 60.0))
+        self.assertAlmostEqual(rows[1]['modeled_ltoa'], 10.0)
+        self.assertAlmostEqual(rows[1]['image_ltoa'], 10.1)
+
+    def test_filters(self):
+        self.assertEqual(len(self.store.query()), 6)
+        self.assertEqual(len(self.store.query(sensor='modis')), 2)
+        self.assertEqual(len(self.store.query(buoy_id=['44025', '45012'])), 2)
+        self.assertEqual(len(self.store.query(band=31)), 1)
+        self.assertEqual(len(self.store.query(start=self.date)), 6)
+        self.assertEqual(len(self.store.query(end=self.date)), 0)
+        self.assertEqual(len(self.store.query(start=datetime.datetime(2017, 7, 4))), 0)
+
+    def test_append_only(self):
+        store = results.ResultStore(self.path)   # i.e. a later run
+        store.add(L8, {'44009': matchup('44009', self.date, offset=1.0)}, 'merra')
+
+        latest = self.store.query(scene_id=L8, buoy_id='44009')
+        self.assertAlmostEqual(latest[0]['skin_temp'], 295.6)
+        self.assertEqual(len(self.store.query(scene_id=L8, buoy_id='44009', latest=False)), 4)
+
+        runs = self.store.runs()
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(latest[0]['run'], runs[1]['id'])
+        self.assertIn('atmo_subset', runs[0]['settings'])
+
+    def test_csv(self):
+        f = io.StringIO()
+        self.assertEqual(results.write_csv(f, self.store.query(sensor='landsat8')), 2)
+
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[0], '#' + results.CSV_HEADER)
+        self.assertEqual(lines[1].split(', ')[:3], [L8, '2017/07/03', '44009'])
+        self.assertEqual(len(lines[1].split(', ')), len(results.CSV_HEADER.split(', ')))
+        self.assertEqual(lines[1].split(', ')[-2:], ['nan', 'nan'])   # landsat has no std
+
+        f = io.StringIO()
+        results.write_csv(f, self.store.query(sensor='modis'))
+        self.assertEqual(f.getvalue().splitlines()[1].split(', ')[-2:], ['0.05', '0.05'])
+
+    def test_image_std(self):
+        self.assertEqual([r['image_ltoa_std'] for r in self.store.query(sensor='modis')], [0.05, 0.05])
+        self.assertEqual([r['image_ltoa_std'] for r in self.store.query(sensor='landsat8')], [None] * 4)
+
+    def test_migrated(self):
+        path = os.path.join(self.directory, 'old.sqlite')
+        with sqlite3.connect(path) as db:
+            db.executescript(results.SCHEMA.replace('    image_ltoa_std REAL,\n', '')
+                                           .replace('(scene_id, buoy_id, atmo_source)', '(scene_id, buoy_id)'))
+            db.execute('INSERT INTO meta (key, value) VALUES (?, ?)', ('schema_version', '1'))
+
+        store = results.ResultStore(path)
+        store.add(MODIS, {'44009': matchup('44009', self.date, bands=(31, 32), std=True)}, 'narr')
+
+        self.assertEqual([r['image_ltoa_std'] for r in store.query()], [0.05, 0.05])
+        self.assertEqual(results.ResultStore(path).query(), store.query())
+        with sqlite3.connect(path) as db:
+            columns = [row[2] for row in db.execute('PRAGMA index_info(matchups_scene)')]
+        self.assertEqual(columns, ['scene_id', 'buoy_id', 'atmo_source'])
+
+    def test_added_matchups(self):
+        # a later run of the scene that skipped 44025
+        added = self.store.add(L8, {'44009': matchup('44009', self.date, offset=1.0)}, 'merra')
+
+        rows = self.store.query(matchup=added, latest=False)
+        self.assertEqual([(r['buoy_id'], r['band'], r['skin_temp']) for r in rows], [('44009', '10', 295.6), ('44009', '11', 295.6)])
+        self.assertEqual(len(self.store.query(scene_id=L8)), 4)   # 44025 of the first run still there
+        self.assertEqual(self.store.query(matchup=self.store.add(L8, {}, 'merra')), [])
+
+    def test_latest_of_each_atmosphere(self):
+        # the same scene with both reanalyses, and merra again
+        self.store.add(L8, {'44009': matchup('44009', self.date, offset=1.0)}, 'narr')
+        self.store.add(L8, {'44009': matchup('44009', self.date, offset=2.0)}, 'merra')
+
+        rows = self.store.query(scene_id=L8, buoy_id='44009', band=10)
+        self.assertEqual(sorted((r['atmo_source'], r['skin_temp']) for r in rows),
+                         [('merra', 296.6), ('narr', 295.6)])
+
+        f = io.StringIO()
+        self.assertEqual(results.write_csv(f, self.store.query(scene_id=L8)), 3)   # 44025 with merra
+
+    def test_schema_version(self):
+        with sqlite3.connect(self.path) as db:
+            db.execute('UPDATE meta SET value = ? WHERE key = ?', (str(results.SCHEMA_VERSION + 1), 'schema_version'))
+
+        self.assertRaises(results.ResultStoreError, results.ResultStore, self.path)
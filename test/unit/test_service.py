@@ -0,0 +1,121 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from buoycalib import (buoy, service)
+
+DATE = datetime.datetime(2017, 7, 3, 15, 40, 12)
+
+
+class FakeForwardModel(object):
+    """ stand-in forward_model.calibrate, scenes ..._EMPTY have no buoys, ..._SLOW wait on an event """
+
+    def __init__(self):
+        self.calls = []
+        self.buoys = ['44009']
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def __call__(self, scene_id, atmo_source, bands=None, remote=False, force=False, preview='show', workers=4):
+        self.calls.append((scene_id, atmo_source, bands, remote, force, preview))
+
+        if scene_id.endswith('_EMPTY'):
+            raise buoy.BuoyDataException('no buoys in scene')
+        if scene_id.endswith('_SLOW'):
+            self.started.set()
+            self.release.wait(10)
+
+        bands = bands or [10, 11]
+        return {b_id: (b_id, 295.0, 294.8, 38.461, -74.703, {b: 9.0 for b in bands}, {b: 0.1 for b in bands},
+                       {b: 9.2 for b in bands}, {}, DATE) for b_id in self.buoys}
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.model = FakeForwardModel()
+        self.service = service.Service(self.model, os.path.join(self.directory, 'results.sqlite'), jobs=1, queue=0)
+
+        self.server = service.make_server(self.service, 'http://127.0.0.1:0')
+        self.url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.model.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def test_matchup(self):
+        rows = service.matchup(self.url, 'LC08_L1TP_014033_20170703_20170715_01_T1', atmo='narr', bands=[10])
+
+        self.assertEqual(self.model.calls, [('LC08_L1TP_014033_20170703_20170715_01_T1', 'narr', [10], False, False, 'none')])
+        self.assertEqual([(r['buoy_id'], r['band'], r['modeled_ltoa'], r['date']) for r in rows], [('44009', '10', 9.0, DATE)])
+
+        # the results are in the service's store too
+        self.assertEqual(len(self.service.store.query(scene_id='LC08_L1TP_014033_20170703_20170715_01_T1')), 1)
+        self.assertEqual(service.status(self.url)['served'], 1)
+
+    def test_rows_of_this_run(self):
+        self.model.buoys = ['44009', '44025']
+        self.assertEqual(len(service.matchup(self.url, 'LC08_L1TP_014033_20170703_20170715_01_T1')), 4)
+
+        # 44025 skipped this time, its rows of the first run are not part of the answer
+        self.model.buoys = ['44009']
+        rows = service.matchup(self.url, 'LC08_L1TP_014033_20170703_20170715_01_T1', bands=[10])
+        self.assertEqual([(r['buoy_id'], r['band']) for r in rows], [('44009', '10')])
+
+    def test_errors(self):
+        with self.assertRaisesRegex(service.ServiceError, '422.*no buoys'):
+            service.matchup(self.url, 'LC08_L1TP_014033_20170703_20170715_01_EMPTY')
+        with self.assertRaisesRegex(service.ServiceError, '400.*atmo'):
+            service.matchup(self.url, 'LC08_L1TP_014033_20170703_20170715_01_T1', atmo='ncep')
+
+        self.assertEqual(service.status(self.url)['failed'], 1)
+
+    def test_busy(self):
+        slow = threading.Thread(target=service.matchup, args=(self.url, 'LC08_L1TP_014033_20170703_20170715_01_SLOW'))
+        slow.start()
+        self.assertTrue(self.model.started.wait(10))
+
+        # one job, no queue: refused while the slow scene runs
+        with self.assertRaises(service.ServiceBusy):
+            service.matchup(self.url, 'LC08_L1TP_014033_20170703_20170715_01_T1')
+
+        self.model.release.set()
+        slow.join()
+        self.assertEqual(service.status(self.url)['served'], 1)
+        self.assertEqual(len(service.matchup(self.url, 'LC08_L1TP_014033_20170703_20170715_01_T1')), 2)   # two bands
+
+    def test_same_scene_takes_turns(self):
+        self.service.jobs, self.service.queue, self.service._slots = 2, 1, threading.BoundedSemaphore(2)
+        scene_id = 'LC08_L1TP_014033_20170703_20170715_01_SLOW'
+
+        merra = threading.Thread(target=service.matchup, args=(self.url, scene_id), kwargs={'atmo': 'merra'})
+        merra.start()
+        self.assertTrue(self.model.started.wait(10))
+
+        # a free job, but the scene's MODTRAN and stage files are in use
+        narr = threading.Thread(target=service.matchup, args=(self.url, scene_id), kwargs={'atmo': 'narr'})
+        narr.start()
+        time.sleep(0.3)
+        self.assertEqual([c[1] for c in self.model.calls], ['merra'])
+        self.assertEqual(service.status(self.url)['waiting'], 1)
+
+        self.model.release.set()
+        merra.join()
+        narr.join()
+        self.assertEqual([c[1] for c in self.model.calls], ['merra', 'narr'])
+        self.assertEqual(service.status(self.url)['served'], 2)
+        self.assertEqual(self.service._scenes, {})
+
+    def test_no_service(self):
+        with self.assertRaisesRegex(service.ServiceError, 'no calibration service'):
+            service.status('http://127.0.0.1:9')
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from buoycalib import (download, settings, store)
+
+from .http_server import LocalServer
+
+
+class TestDataStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = settings.MANIFEST
+        settings.MANIFEST = os.path.join(self.directory, 'manifest.sqlite')
+        self.store = store.DataStore(settings.MANIFEST)
+
+    def tearDown(self):
+        settings.MANIFEST = self.manifest
+        store._default = None
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_recorded_file_checks(self):
+        path = self.write('a.nc', b'a' * 100)
+        self.store.record(path, 'http://example.com/a.nc')
+
+        self.assertTrue(self.store.check(path))
+        self.assertTrue(self.store.check(path, full=True))
+
+    def test_truncated_file_fails(self):
+        path = self.write('a.nc', b'a' * 100)
+        self.store.record(path, 'http://example.com/a.nc')
+        self.write('a.nc', b'a' * 50)
+
+        self.assertFalse(self.store.check(path))
+
+    def test_modified_file_fails(self):
+        path = self.write('a.nc', b'a' * 100)
+        self.store.record(path, 'http://example.com/a.nc')
+        time.sleep(0.01)
+        self.write('a.nc', b'b' * 100)
+
+        self.assertFalse(self.store.check(path))
+
+    def test_unrecorded_file_adopted(self):
+        path = self.write('a.nc', b'a' * 100)
+
+        self.assertTrue(self.store.check(path))
+        self.assertEqual(self.store.total_size(), 100)
+
+    def test_evict_lru_and_pins(self):
+        paths = [self.write('{0}.nc'.format(i), b'x' * 100) for i in range(4)]
+        for p in paths:
+            self.store.record(p)
+            time.sleep(0.01)
+
+        self.store.check(paths[0])   # most recently used now
+        self.store.pin([paths[1]], 'job')
+
+        removed = self.store.evict(200)
+
+        self.assertEqual(removed, [os.path.abspath(p) for p in paths[2:]])
+        self.assertTrue(os.path.isfile(paths[0]) and os.path.isfile(paths[1]))
+        self.assertEqual(self.store.total_size(), 200)
+
+        self.store.unpin('job')
+        self.assertEqual(self.store.evict(0), [os.path.abspath(paths[1]), os.path.abspath(paths[0])])
+
+    def test_no_budget_no_eviction(self):
+        path = self.write('a.nc', b'a' * 100)
+        self.store.record(path)
+
+        self.assertEqual(self.store.evict(), [])
+
+    def test_default_manifest(self):
+        self.assertEqual(store.DataStore().manifest, settings.MANIFEST)
+
+    def test_job_pins_until_done(self):
+        store._default = self.store
+        self.store.budget = 0
+
+        with LocalServer({'/a.nc': b'a' * 100}) as server:
+            with store.job('scene'):
+                path = download.url_download(server.url + '/a.nc', self.directory)
+
+                # downloaded by this job, kept until it is done
+                self.assertEqual(self.store.evict(), [])
+
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.store.total_size(), 0)
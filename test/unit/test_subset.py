@@ -0,0 +1,127 @@
+import datetime
+import os
+import re
+import shutil
+import tempfile
+import unittest
+import urllib.parse
+
+import numpy
+import netCDF4
+
+from buoycalib import (settings, store)
+from buoycalib.atmo import (merra, subset)
+
+from .http_server import LocalServer
+
+DATE = datetime.datetime(2017, 7, 3, 15)
+BUOY_LAT, BUOY_LON = 38.9073, -73.8077
+
+# full MERRA-2 grid coordinates
+LAT = numpy.arange(subset.MERRA_NLAT) * subset.MERRA_DLAT + subset.MERRA_LAT0
+LON = numpy.arange(subset.MERRA_NLON) * subset.MERRA_DLON + subset.MERRA_LON0
+LEV = numpy.linspace(1000, 0.1, subset.MERRA_NLEV)
+
+
+def merra_temperature(t, lev, lat, lon):
+    return 250 + 0.1 * lat + 0.05 * lon - 0.5 * lev + t
+
+
+def write_merra_subset(filepath, lat_range, lon_range):
+    """ the netCDF4 file an OPeNDAP server returns for a subset of a synthetic MERRA-2 day """
+    lat = LAT[lat_range[0]:lat_range[1] + 1]
+    lon = LON[lon_range[0]:lon_range[1] + 1]
+    t, lev, la, lo = numpy.meshgrid(numpy.arange(8), numpy.arange(len(LEV)), lat, lon, indexing='ij')
+
+    with netCDF4.Dataset(filepath, 'w', format='NETCDF4') as ds:
+        for name, values in (('time', numpy.arange(8) * 180), ('lev', LEV), ('lat', lat), ('lon', lon)):
+            ds.createDimension(name, len(values))
+            ds.createVariable(name, 'f8', (name,))[:] = values
+        ds.variables['time'].units = 'minutes since 2017-07-03 00:00:00'
+
+        dims = ('time', 'lev', 'lat', 'lon')
+        ds.createVariable('T', 'f4', dims)[:] = merra_temperature(t, lev, la, lo)
+        ds.createVariable('RH', 'f4', dims)[:] = numpy.full(t.shape, 0.5)
+        ds.createVariable('H', 'f4', dims)[:] = lev * 1000.0 + la
+
+
+class TestBbox(unittest.TestCase):
+
+    def test_snapped(self):
+        self.assertEqual(subset.bbox(BUOY_LAT, BUOY_LON), (36.0, 40.0, -76.0, -72.0))
+
+    def test_nearby_points_share_box(self):
+        self.assertEqual(subset.bbox(38.1, -73.1), subset.bbox(38.9, -73.9))
+
+    def test_several_points_clipped(self):
+        self.assertEqual(subset.bbox([89.5, 80.0], [179.5, 170.0]), (78.0, 90.0, 168.0, 180.0))
+
+    def test_merra_indices_cover_box(self):
+        box = subset.bbox(BUOY_LAT, BUOY_LON)
+        (lat0, lat1), (lon0, lon1) = subset.merra_indices(box)
+
+        self.assertTrue(LAT[lat0] <= box[0] and LAT[lat1] >= box[1])
+        self.assertTrue(LON[lon0] <= box[2] and LON[lon1] >= box[3])
+
+    def test_narr_urls(self):
+        urls = subset.narr_urls(DATE, subset.bbox(BUOY_LAT, BUOY_LON))
+
+        self.assertEqual(len(urls), 3)
+        for var, url in zip(['air', 'hgt', 'shum'], urls):
+            query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+            self.assertIn('{0}.201707.nc'.format(var), url)
+            self.assertEqual(query['var'], [var])
+            self.assertEqual(query['north'], ['40.0'])
+            self.assertEqual(query['time_start'], ['2017-07-03T12:00:00Z'])
+            self.assertEqual(query['time_end'], ['2017-07-03T18:00:00Z'])
+
+
+class TestMerraSubset(unittest.TestCase):
+    """ MERRA-2 subsets from a local stand-in OPeNDAP server """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        store._default = store.DataStore(os.path.join(self.directory, 'manifest.sqlite'))
+
+        self.settings = settings.SUBSET_DIR, settings.COLUMN_DIR, settings.MERRA_OPENDAP_URL, settings.ATMO_SUBSET
+        settings.SUBSET_DIR = os.path.join(self.directory, 'subset')
+        settings.COLUMN_DIR = os.path.join(self.directory, 'columns')
+        settings.ATMO_SUBSET = True
+
+    def tearDown(self):
+        settings.SUBSET_DIR, settings.COLUMN_DIR, settings.MERRA_OPENDAP_URL, settings.ATMO_SUBSET = self.settings
+        store._default = None
+        shutil.rmtree(self.directory)
+
+    def opendap(self, request):
+        constraint = urllib.parse.unquote(request.path.split('?')[1])
+        lat_range = [int(i) for i in re.search(r'lat\[(\d+):(\d+)\]', constraint).groups()]
+        lon_range = [int(i) for i in re.search(r'lon\[(\d+):(\d+)\]', constraint).groups()]
+
+        filepath = os.path.join(self.directory, 'response.nc4')
+        write_merra_subset(filepath, lat_range, lon_range)
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    def test_process_from_subset(self):
+        with LocalServer(handler=self.opendap) as server:
+            settings.MERRA_OPENDAP_URL = server.url + '/opendap/%s/%s/MERRA2_400.inst3_3d_asm_Np.%s.nc4'
+
+            height, press, temp, relhum = merra.process(DATE, BUOY_LAT, BUOY_LON)
+
+            requests = len(server.requests)
+            for command, path, headers in server.requests:
+                self.assertIn('MERRA2_400.inst3_3d_asm_Np.20170703.nc4.nc4?', path)
+
+            # the second buoy nearby reuses the cached subset
+            merra.process(DATE, BUOY_LAT - 0.5, BUOY_LON - 0.3)
+            self.assertEqual(len(server.requests), requests)
+
+        # surface temperature is interpolated between the 4 grid points around the buoy, at 15:00
+        lats = LAT[numpy.abs(LAT - BUOY_LAT) < subset.MERRA_DLAT]
+        lons = LON[numpy.abs(LON - BUOY_LON) < subset.MERRA_DLON]
+        corners = [merra_temperature(5, 0, la, lo) for la in lats for lo in lons]
+
+        self.assertTrue(min(corners) - 1e-3 <= temp[0] <= max(corners) + 1e-3)
+        self.assertEqual([f for f in os.listdir(settings.SUBSET_DIR) if f.endswith('.nc4')],
+                         ['merra_20170703_+036+040-0076-0072.nc4'])
@@ -0,0 +1,83 @@
+import unittest
+
+import numpy
+import utm
+
+from buoycalib.sat import (geoindex, mrt_swath, swath_grid)
+
+BUOY_LAT, BUOY_LON = 38.461, -74.703
+
+
+def synthetic_swath(shape=(200, 150)):
+    """ a rotated 1 km swath over the buoy, and a band whose values are its pixels' positions """
+    r, c = numpy.mgrid[0:shape[0], 0:shape[1]]
+    lat = BUOY_LAT - 0.9 + 0.009 * r + 0.002 * c
+    lon = BUOY_LON - 0.8 + 0.0115 * c - 0.002 * r
+    return lat, lon, (1000 * r + c).astype(numpy.uint16)
+
+
+class Band(object):
+    """ stand-in gdal band, keeps the windows read """
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize):
+        self.reads.append((xoff, yoff, xsize, ysize))
+        return self.data[yoff:yoff + ysize, xoff:xoff + xsize]
+
+
+class TestWindow(unittest.TestCase):
+
+    def test_cell_of_point(self):
+        lats, lons = swath_grid.window(BUOY_LAT, BUOY_LON, width=3)
+        self.assertEqual(lats.shape, (3, 3))
+
+        # the center cell is the one of swath2grid's grid the point falls in
+        zone, ul_x, ul_y, __, __ = mrt_swath.bbox(BUOY_LAT, BUOY_LON)
+        x, y, __, __ = utm.from_latlon(lats, lons, force_zone_number=zone)
+        bx, by, __, __ = utm.from_latlon(BUOY_LAT, BUOY_LON)
+        self.assertEqual(int((x[1, 1] - ul_x) / 1000), int((bx - ul_x) / 1000))
+        self.assertEqual(int((ul_y - y[1, 1]) / 1000), int((ul_y - by) / 1000))
+        numpy.testing.assert_allclose(numpy.diff(x, axis=1), 1000, atol=0.01)
+        numpy.testing.assert_allclose(numpy.diff(y, axis=0), -1000, atol=0.01)
+
+
+class TestResample(unittest.TestCase):
+
+    def test_nearest_pixels(self):
+        lat, lon, data = synthetic_swath()
+        index = geoindex.SwathIndex(lat, lon)
+        band = Band(data)
+
+        lats, lons = swath_grid.window(BUOY_LAT, BUOY_LON, width=5)
+        resampled = swath_grid.resample({31: band}, index, lats, lons)[31]
+
+        # same as the brute force nearest pixel
+        xyz = geoindex.latlon_to_xyz(lat, lon)
+        for (i, j), value in numpy.ndenumerate(resampled):
+            d = ((xyz - geoindex.latlon_to_xyz(lats[i, j], lons[i, j]))**2).sum(axis=1)
+            self.assertEqual(value, data.ravel()[numpy.argmin(d)])
+
+        # one read, of the few pixels under the window only
+        self.assertEqual(len(band.reads), 1)
+        self.assertLessEqual(band.reads[0][2] * band.reads[0][3], 100)
+
+    def test_off_swath(self):
+        lat, lon, data = synthetic_swath()
+        index = geoindex.SwathIndex(lat, lon)
+
+        bands = {31: Band(data), 32: Band(data)}
+        lats, lons = numpy.array([[BUOY_LAT, 60.0]]), numpy.array([[BUOY_LON, 10.0]])
+        resampled = swath_grid.resample(bands, index, lats, lons)
+
+        self.assertEqual(sorted(resampled), [31, 32])
+        self.assertFalse(numpy.isnan(resampled[31][0, 0]))
+        self.assertTrue(numpy.isnan(resampled[32][0, 1]))
+        self.assertEqual(bands[32].reads[0][2:], (1, 1))   # the pixel on the swath only
+
+        # nothing on the swath, nothing read
+        bands = {31: Band(data)}
+        self.assertTrue(numpy.isnan(swath_grid.resample(bands, index, [[60.0]], [[10.0]])[31]).all())
+        self.assertEqual(bands[31].reads, [])
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from buoycalib.sat import wrs2
+
+
+def square(lon, lat, size=2.0):
+    return [(lon, lat), (lon + size, lat), (lon + size, lat + size), (lon, lat + size), (lon, lat)]
+
+
+class TestWrs2Index(unittest.TestCase):
+
+    def setUp(self):
+        # two overlapping scenes, and one across the antimeridian
+        paths = [13, 14, 80]
+        rows = [33, 33, 60]
+        rings = [square(-74.0, 38.0), square(-75.0, 38.5), [(179.0, -10.0), (-179.0, -10.0), (-179.0, -8.0), (179.0, -8.0), (179.0, -10.0)]]
+        self.index = wrs2.Wrs2Index(wrs2.make_index(paths, rows, rings))
+
+    def test_find(self):
+        self.assertEqual(self.index.find(14, 33), 1)
+        self.assertRaises(wrs2.ogrError, self.index.find, 1, 1)
+
+    def test_centroid(self):
+        lat, lon = self.index.centroid[0]
+        self.assertAlmostEqual(lat, 39.0)
+        self.assertAlmostEqual(lon, -73.0)
+
+    def test_centroid_across_antimeridian(self):
+        lat, lon = self.index.centroid[2]
+        self.assertAlmostEqual(lat, -9.0)
+        self.assertAlmostEqual(abs(lon), 180.0)
+
+    def test_containing_overlap(self):
+        self.assertEqual(self.index.containing(39.0, -73.5), [0, 1])
+        self.assertEqual(self.index.containing(38.2, -73.5), [0])
+        self.assertEqual(self.index.containing(30.0, -73.5), [])
+
+    def test_containing_across_antimeridian(self):
+        self.assertEqual(self.index.containing(-9.0, 179.5), [2])
+        self.assertEqual(self.index.containing(-9.0, -179.5), [2])
+        self.assertEqual(self.index.containing(-9.0, -178.5), [])
+
+    def test_point_in_ring(self):
+        ring = numpy.array(square(0.0, 0.0))
+        self.assertTrue(wrs2.point_in_ring(1.0, 1.0, ring))
+        self.assertFalse(wrs2.point_in_ring(3.0, 1.0, ring))
+
+
+class TestLoadIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_file = os.path.join(self.directory, 'wrs2_index.npz')
+        numpy.savez(self.index_file, **wrs2.make_index([13], [33], [square(-74.0, 38.0)]))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        wrs2.load_index.cache_clear()
+
+    def test_round_trip(self):
+        index = wrs2.load_index('unused.shp', self.index_file)
+
+        self.assertEqual(index.containing(39.0, -73.0), [0])
+        self.assertIs(wrs2.load_index('unused.shp', self.index_file), index)
@@ -3,53 +3,200 @@
 ## deal with it, future me
 # to fix the pathing issues, run this script from the repository root 
 # i.e. Landsat-Buoy-Calibration $ python tools/blah.py
+import datetime
+import functools
+import glob
+import json
+import os
+import time
+
 import forward_model
+from buoycalib import (batch, buoy, instrument, prefetch, results, settings)
+from buoycalib.atmo import provider
+from buoycalib.sat import modis
+
+# atmospheres of the group of scenes the worker process claimed last
+_PROVIDER = provider.AtmosphereProvider()
+
+
+def scene_date(scene_id):
+    """ acquisition day of a scene, from its id """
+    if scene_id[0:3] == 'MOD':
+        return modis.parse_granule(scene_id)['date']
+
+    if '_' in scene_id:   # landsat product id, LC08_L1TP_PPPRRR_YYYYMMDD_...
+        return datetime.datetime.strptime(scene_id.split('_')[3], '%Y%m%d')
+
+    # landsat entity id, LC8PPPRRRYYYYDDD...
+    return datetime.datetime.strptime(scene_id[9:16], '%Y%j')
+
+
+def scene_group(scene_id, atmo='merra'):
+    """ scenes on the same reanalysis file (MERRA day, NARR month) share a group """
+    try:
+        date = scene_date(scene_id)
+    except (ValueError, IndexError):
+        return ''   # not a scene id, fails on its own when processed
+
+    return '{0}:{1}'.format(atmo, date.strftime('%Y%m' if atmo == 'narr' else '%Y%m%d'))
+
+
+def prepare_group(scenes, prefetcher, atmo='merra', subset=False):
+    """
+    expect the atmospheres of every buoy of the claimed scenes, they are extracted together.
+    Does not wait: the points of a scene are expected as soon as it is planned (its metadata
+    downloaded), the first scene starts without waiting for the others.
+    """
+    global _PROVIDER
+    settings.ATMO_SUBSET = subset
+    _PROVIDER = provider.AtmosphereProvider()   # drops the atmospheres of the previous group
+
+    if prefetcher is None:
+        return
+
+    for scene_id in scenes:
+        planned = prefetcher.planned(scene_id)
+        if planned is not None:
+            planned.add_done_callback(functools.partial(_expect, _PROVIDER, atmo))
+
+
+def _expect(atmosphere, atmo, planned):
+    """ expect the points of a planned scene """
+    if planned.exception() is not None:
+        return
+
+    date, points, __ = planned.result()
+    if date is not None:
+        atmosphere.expect(atmo, [(date, lat, lon) for lat, lon in points])
+
+
+def process_scene(scene_id, atmo='merra', remote=False, preview='none', subset=False, db=None, metrics=None):
+    """
+    forward model of one scene, run by the batch workers, its results are appended
+    to the result store db, and the worker's instrument report written to metrics.<worker>.json
+    """
+    # settings are module state, set again in each worker process
+    settings.ATMO_SUBSET = subset
+    start = time.time()
+
+    try:
+        with instrument.job(scene_id):
+            if scene_id[0:3] in ('LC8', 'LC0'):   # Landsat 8
+                ret = forward_model.landsat8(scene_id, atmo, remote=remote, preview=preview, atmosphere=_PROVIDER)
 
+            elif scene_id[0:3] == 'MOD':   # Modis
+                ret = forward_model.modis(scene_id, atmo, preview=preview, atmosphere=_PROVIDER)
 
-def batch_forward_model(scenes, output_txt, atmo='merra', verbose=False):
+            else:
+                raise ValueError('Scene ID is not a valid format for (landsat8, modis)')
+    finally:
+        if metrics is not None:
+            instrument.write('{0}.{1}.json'.format(metrics, batch.worker_name().replace(':', '_')))
+
+    if db is not None:
+        results.ResultStore(db).add(scene_id, ret, atmo, seconds=time.time() - start)
+
+    return ret
+
+
+def merge_metrics(metrics):
+    """ merge the reports of every worker (of every machine) into metrics, JSON or Prometheus text for a .prom file """
+    reports = []
+    for filepath in sorted(glob.glob(metrics + '.*.json')):
+        with open(filepath) as f:
+            reports.append(json.load(f))
+
+    instrument.write(metrics, instrument.merge(reports))
+
+
+def write_results(queue, output_txt, db):
+    """ write the results of the done jobs, from the result store """
+    store = results.ResultStore(db)
+    scenes = [scene_id for scene_id, __ in queue.results()]
+
+    # in chunks, sqlite limits the number of values in a query
+    rows = []
+    for i in range(0, len(scenes), 500):
+        rows += store.query(scene_id=scenes[i:i + 500])
 
     with open(output_txt, 'w') as f:
-        f.write('# Comma Seperated Values, Nathan Dileas, RIT, 2018\n')
-        f.write('Scene_ID, Date, Buoy_ID, bulk_temp, skin_temp, buoy_lat, buoy_lon, mod1, mod2, img1, img2, error1, error2\n')
-        f.flush()
+        results.write_csv(f, rows)
+
 
-        for i, scene_id in enumerate(scenes):
-            print(scene_id, '[{0}/{1}]'.format(i+1, len(scenes)))
-            
-            try:
-                if scene_id[0:3] in ('LC8', 'LC0'):   # Landsat 8
-                    ret = forward_model.landsat8(scene_id, atmo)
+def batch_forward_model(scenes, output_txt, atmo='merra', verbose=False, workers=4, lookahead=4, remote=False,
+                        preview='none', processes=1, queue_path=None, retry_failed=False, db=None, metrics=None):
+    """
+    Run the forward model of every scene, in worker processes fed from a job queue.
 
-                elif scene_id[0:3] == 'MOD':   # Modis
-                    ret = forward_model.modis(scene_id, atmo)
+    The queue (by default next to output_txt) persists the status and result of each
+    scene, running the same batch again resumes it. Workers on other machines can
+    join by running this script with the same --queue. Results are appended to the
+    result store db (default settings.RESULTS_DB) as each scene finishes. With metrics,
+    the time and resources used by each stage are reported there (see buoycalib/instrument.py).
+    """
+    if db is None:
+        db = settings.RESULTS_DB
 
-            except Exception as e:
-                print('ERROR: ', str(e))
-                continue
+    if queue_path is None:
+        queue_path = os.path.splitext(output_txt)[0] + '_jobs.sqlite'
 
-            print(ret)
+    queue = batch.JobQueue(queue_path)
+    # scenes on the same reanalysis file are claimed together, their atmospheres read at once
+    added = queue.add(scenes, group=functools.partial(scene_group, atmo=atmo))
+    print('{0} new scenes queued in {1}'.format(added, queue_path))
 
-            for key in ret.keys():
-                buoy_id, bulk_temp, skin_temp, buoy_lat, buoy_lon, mod_ltoa, error, img_ltoa, date = ret[key]
-                print(scene_id, date.strftime('%Y/%m/%d'), buoy_id, bulk_temp, skin_temp, buoy_lat, buoy_lon, \
-                    *mod_ltoa.values(), *img_ltoa.values(), *error.values(), file=f, sep=', ')
-            
-            f.flush()
+    if retry_failed:
+        print('{0} failed scenes queued again'.format(queue.retry_failed()))
+
+    process = functools.partial(process_scene, atmo=atmo, remote=remote, preview=preview, subset=settings.ATMO_SUBSET,
+                                db=db, metrics=metrics)
+
+    # each worker downloads the inputs of the scenes it claimed ahead while it processes the current one
+    fetch = functools.partial(prefetch.Prefetcher, atmo_source=atmo, workers=workers, lookahead=lookahead, remote=remote)
+
+    prepare = functools.partial(prepare_group, atmo=atmo, subset=settings.ATMO_SUBSET)
+
+    progress = batch.run(queue, process, workers=processes, permanent=(buoy.BuoyDataException,),
+                         lookahead=lookahead, prefetch=fetch, prepare=prepare)
+
+    for scene_id, attempts, error in queue.errors():
+        print('ERROR: ', scene_id, '({0} attempts)'.format(attempts), error.strip().split('\n')[-1])
+
+    write_results(queue, output_txt, db)
+
+    if metrics is not None:
+        merge_metrics(metrics)
+
+    return progress
 
 
 if __name__ == '__main__':
     import argparse
-    parser = argparse.ArgumentParser(description='')
+    parser = argparse.ArgumentParser(description='Forward model a list of scenes, resuming an interrupted batch.')
 
     parser.add_argument('scene_txt')
     parser.add_argument('-a', '--atmo', default='merra', choices=['merra', 'narr'], help='Choose atmospheric data source, choices:[narr, merra].')
-    parser.add_argument('-s', '--save', default='results.txt')
+    parser.add_argument('-s', '--save', default='results.txt', help='Text file of the results of the batch.')
+    parser.add_argument('-b', '--db', default=settings.RESULTS_DB, help='Result store the results are appended to.')
+    parser.add_argument('-m', '--metrics', default=None, help='Write the time and resources used by each stage, as JSON, or Prometheus text for a .prom file.')
+    parser.add_argument('-w', '--workers', default=4, type=int, help='Concurrent downloads.')
+    parser.add_argument('-l', '--lookahead', default=4, type=int, help='Scenes to download ahead of processing.')
+    parser.add_argument('-j', '--processes', default=1, type=int, help='Worker processes on this machine.')
+    parser.add_argument('-q', '--queue', default=None, help='Job queue file, shared by every worker. Default: next to --save.')
+    parser.add_argument('--retry-failed', default=False, action='store_true', help='Run the scenes that failed in an earlier run again.')
+    parser.add_argument('-r', '--remote', default=False, action='store_true', help='Read landsat bands over http, only around the buoys.')
+    parser.add_argument('-p', '--preview', default='none', choices=forward_model.PREVIEW_MODES, help='Scene previews, off by default for headless runs.')
+    parser.add_argument('-u', '--subset', default=False, action='store_true', help='Download only the atmospheric data around the buoys.')
 
     args = parser.parse_args()
 
+    if args.subset:
+        settings.ATMO_SUBSET = True
+
     with open(args.scene_txt, 'r') as f:
-        scenes = f.read().split('\n')
-        #scenes = [s for s in scenes]
-        scenes = list(set(scenes))
+        # the queue keeps the first occurrence of each scene, in file order
+        scenes = [s.strip() for s in f.read().split('\n') if s.strip()]
 
-    batch_forward_model(scenes, args.save, args.atmo)
+    batch_forward_model(scenes, args.save, args.atmo, workers=args.workers, lookahead=args.lookahead, remote=args.remote,
+                        preview=args.preview, processes=args.processes, queue_path=args.queue, retry_failed=args.retry_failed,
+                        db=args.db, metrics=args.metrics)
@@ -1,68 +1,39 @@
+# export forward model results from the result store (see buoycalib/results.py)
+# run this script from the repository root
+# i.e. Landsat-Buoy-Calibration $ python tools/to_csv.py results.csv --sensor landsat8 --start 2017-01-01
+import datetime
 import sys
-import time
-import os
 from os import path
-import csv
 
 sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
-import landsatbuoycalib.BuoyCalib as bc
-#import landsatbuoycalib as bin
+from buoycalib import (results, settings)
 
-import pickle_funcs
-from scenes import all as scenes
 
-def fmt_items(cc):
-    """ organize elements for csv row. """
-    # Each Item in items is a column in the resultant csv file
-    # cc: calibration_controller object
-    
-    items = [cc.scene_id]
-    
-    if cc._buoy_id:
-        items.append(str(cc.buoy_location[0]))   # lat
-        items.append(str(cc.buoy_location[1]))   # lon
-            
-    items.append(cc.date.strftime('%m/%d/%Y'))   # year
-    items.append(cc.date.strftime('%j'))   # doy
-    items.append(cc.wrs2[0:3])   # path
-    items.append(cc.wrs2[3:6])   # row
-    items.append(' ')   # day/ night
-    items.append(cc.buoy_id)   # buoy id
-    items.append(' ')   # sca
-    items.append(' ')   # detector
-    items.append(' ')   # temp difference band 10
-    items.append(' ')   # temp difference band 11
-    
-    if cc.modeled_radiance and cc.image_radiance:
-        items.append(str(cc.image_radiance[0]))  # band 10
-        items.append(str(cc.modeled_radiance[0]))   # band 10
-        items.append(str(cc.image_radiance[1]))   # band 11
-        items.append(str(cc.modeled_radiance[1]))   # band 11
-        items.append(str(cc.skin_temp))   # buoy (skin) temp
+def parse_date(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d')
+
 
-    return items
-        
 if __name__ == '__main__':
-    filename = 'output_narr.csv'
-    
-    # options
-    a = 'narr'   # atmo data src
-    v = False   # verbose
-    
-    with open(filename, 'wb') as f:
-        w = csv.writer(f, quoting=csv.QUOTE_NONE)
-        
-        for s in scenes:
-            try:
-                #print s, '%s of %s' % (scenes.index(s) + 1, len(scenes))
-                cc = bc.CalibrationController(s, verbose=v, atmo_src=a)
-                cc_loaded = pickle_funcs.read_cache(cc)
-                w.writerow(fmt_items(cc_loaded))
-            except AttributeError:
-                w.writerow([s])
-            except KeyboardInterrupt:
-                break
-            except OSError:
-                w.writerow([s])
-            except ImportError:
-                w.writerow([s])
+    import argparse
+    parser = argparse.ArgumentParser(description='Write the results matching the filters as comma separated values.')
+
+    parser.add_argument('output', help='csv file, - for stdout')
+    parser.add_argument('-b', '--db', default=settings.RESULTS_DB, help='Result store to read.')
+    parser.add_argument('--start', type=parse_date, help='First day, YYYY-MM-DD.')
+    parser.add_argument('--end', type=parse_date, help='Day after the last, YYYY-MM-DD.')
+    parser.add_argument('--buoy', nargs='+', help='Buoy ids.')
+    parser.add_argument('--sensor', nargs='+', choices=['landsat8', 'modis'])
+    parser.add_argument('--scene', nargs='+', help='Scene ids.')
+    parser.add_argument('--band', nargs='+')
+    parser.add_argument('--all', default=False, action='store_true', help='Every run of each match-up, not only the newest.')
+
+    args = parser.parse_args()
+
+    rows = results.ResultStore(args.db).query(start=args.start, end=args.end, buoy_id=args.buoy, sensor=args.sensor,
+                                              scene_id=args.scene, band=args.band, latest=not args.all)
+
+    if args.output == '-':
+        results.write_csv(sys.stdout, rows)
+    else:
+        with open(args.output, 'w') as f:
+            print('{0} match-ups written'.format(results.write_csv(f, rows)))